@@ -0,0 +1,128 @@
+"""Read-only fast path for hot list endpoints.
+
+``RowMapper`` turns ``QuerySet.values()`` rows into the same dicts a DRF
+serializer would produce, without instantiating serializers or model
+instances. Each output key is compiled once into a small getter; value
+formatting reuses DRF field instances so the output stays identical.
+
+``FastJSONRenderer`` renders with orjson when it is installed and falls
+back to DRF's ``JSONRenderer`` otherwise; both produce the same bytes.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+class Column:
+    """A ``values()`` path, optionally formatted by a DRF field."""
+
+    def __init__(self, path, field=None):
+        self.path = path
+        self.field = field
+
+    def paths(self):
+        return [self.path]
+
+    def compile(self):
+        path = self.path
+        if self.field is None:
+            return lambda row: row[path]
+        to_representation = self.field.to_representation
+
+        def get(row):
+            value = row[path]
+            return None if value is None else to_representation(value)
+        return get
+
+
+class Const:
+    """A fixed value, e.g. a placeholder filled in per page afterwards."""
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def paths(self):
+        return []
+
+    def compile(self):
+        value = self.value
+        return lambda row: value
+
+
+class Computed:
+    """A value derived from several columns of the row."""
+
+    def __init__(self, func, *paths):
+        self.func = func
+        self._paths = list(paths)
+
+    def paths(self):
+        return self._paths
+
+    def compile(self):
+        return self.func
+
+
+class RowMapper:
+    """Ordered ``{output key: Column | Const | Computed | RowMapper | str}``.
+
+    Plain strings are shorthand for ``Column(path)``. A nested mapper
+    renders as ``None`` when its ``null_if`` path is null.
+    """
+
+    def __init__(self, fields, null_if=None):
+        self.fields = {
+            key: Column(spec) if isinstance(spec, str) else spec
+            for key, spec in fields.items()
+        }
+        self.null_if = null_if
+        self._build = self.compile()
+
+    def paths(self):
+        paths = [self.null_if] if self.null_if else []
+        for spec in self.fields.values():
+            paths.extend(path for path in spec.paths() if path not in paths)
+        return paths
+
+    def compile(self):
+        getters = [(key, spec.compile()) for key, spec in self.fields.items()]
+        null_if = self.null_if
+
+        def build(row):
+            if null_if is not None and row[null_if] is None:
+                return None
+            return {key: get(row) for key, get in getters}
+        return build
+
+    def __call__(self, row):
+        return self._build(row)
+
+    def many(self, rows):
+        build = self._build
+        return [build(row) for row in rows]
+
+
+class FastJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` output, produced by orjson when available."""
+
+    options = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    def __init__(self):
+        super().__init__()
+        self._encoder = encoders.JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        # Non-native types (Decimal, datetime, lazy strings, ...) go through
+        # DRF's encoder so they format exactly as JSONRenderer would.
+        ret = orjson.dumps(data, default=self._encoder.default, option=self.options)
+        # JSONRenderer escapes U+2028/U+2029 for JavaScript compatibility.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,121 @@
+"""``Idempotency-Key`` support for retried POSTs.
+
+A client that may retry a request sends a unique ``Idempotency-Key``
+header. The first request with a key takes an in-flight lock
+(``cache.add`` on the shared ``STATE_CACHE`` alias), runs the view and
+stores the rendered response for ``IDEMPOTENCY_KEY_TTL`` seconds.
+Retries with the same key get the stored response back without running
+the view again, so a retried checkout creates no second order and
+touches no stock.
+
+Keys are scoped per endpoint and per user, or per guest session when the
+view can name one (``idempotency_principal``). Anonymous callers it
+cannot tell apart get no idempotency: they would share each other's
+keys. A key reused with a different body is rejected with 422; a retry
+that arrives while the first request is still running gets 409. Only
+responses the view returns with a status below 500 are stored: errors
+raised as exceptions (validation failures, server errors) rolled their
+work back, so the client may retry them with the same key.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+
+from .fastpath import FastJSONRenderer
+from .state import state_cache
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+LOCK_TIMEOUT = 60
+
+
+def key_ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+
+def principal(view, request):
+    """Whose key this is, or None when the caller is anonymous and the
+    view cannot identify it."""
+    if request.user and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    guest_principal = getattr(view, 'idempotency_principal', None)
+    return guest_principal(request) if guest_principal else None
+
+
+def fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def replay(stored):
+    response = HttpResponse(stored['content'], status=stored['status'], content_type=stored['content_type'])
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(scope):
+    """Make a view method honour ``Idempotency-Key`` for ``scope``."""
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            owner = principal(view, request) if key else None
+            if owner is None:
+                return method(view, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {"detail": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            digest = hashlib.sha256(key.encode()).hexdigest()
+            result_key = f'idempotency:{scope}:{owner}:{digest}'
+            lock_key = f'{result_key}:lock'
+            cache = state_cache()
+            request_fingerprint = fingerprint(request)
+
+            def stored_response():
+                stored = cache.get(result_key)
+                if stored is None:
+                    return None
+                if stored['fingerprint'] != request_fingerprint:
+                    return Response(
+                        {"detail": f"{HEADER} was already used for a different request."},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                return replay(stored)
+
+            response = stored_response()
+            if response is not None:
+                return response
+
+            if not cache.add(lock_key, request_fingerprint, timeout=LOCK_TIMEOUT):
+                return Response(
+                    {"detail": f"A request with this {HEADER} is still being processed."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            try:
+                # The first request may have stored its result and dropped
+                # its lock between our read above and our cache.add.
+                response = stored_response()
+                if response is not None:
+                    return response
+                response = method(view, request, *args, **kwargs)
+                if response.status_code < 500:
+                    cache.set(result_key, {
+                        'fingerprint': request_fingerprint,
+                        'status': response.status_code,
+                        'content': FastJSONRenderer().render(response.data),
+                        'content_type': 'application/json',
+                    }, timeout=key_ttl())
+                return response
+            finally:
+                cache.delete(lock_key)
+        return wrapper
+    return decorator
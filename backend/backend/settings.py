@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -46,6 +48,7 @@ INSTALLED_APPS = [
     'cart',
     'inventory',
     'reports',
+    'benchmarks',
 ]
 
 MIDDLEWARE = [
@@ -87,6 +90,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'backend.fastpath.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
@@ -101,9 +108,64 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Writers take the lock at BEGIN and wait for each other instead of
+        # failing with "database is locked" on concurrent checkouts.
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than in-memory, so threaded tests get real
+        # connections with SQLite's normal locking.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Local-memory cache is per process: it holds cached catalog responses,
+# which are keyed by the catalog version kept in the shared state cache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'electric-store',
+    },
+    # Guest carts, idempotency keys and the catalog and promotion
+    # versions: shared by every process (web workers and management
+    # commands) and never culled to make room for catalog pages. Use Redis
+    # or Memcached in production.
+    'state': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'var' / 'state-cache',
+        'OPTIONS': {'MAX_ENTRIES': 1_000_000},
+    },
+}
+
+# Cache alias for guest carts, stored Idempotency-Key responses and the
+# catalog and promotion versions.
+STATE_CACHE = 'state'
+
+# Tests swap the state cache for local memory (see backend.test_runner).
+TEST_RUNNER = 'backend.test_runner.TestRunner'
+
+# Seconds a cached catalog response may live; writes invalidate it sooner.
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Product full-text search backend used for `?search=` on the catalog.
+# Use 'products.search.DatabaseSearchBackend' on engines without FTS5.
+PRODUCT_SEARCH_BACKEND = 'products.search.SQLiteFTSSearchBackend'
+
+# Seconds stock stays held for a cart line, and for a checked-out order
+# awaiting payment. `release_expired_reservations` frees expired holds.
+CART_HOLD_SECONDS = 15 * 60
+ORDER_HOLD_SECONDS = 30 * 60
+
+# Guest carts live in the cache for this many seconds after their last
+# change; `flush_guest_carts` persists them write-behind.
+GUEST_CART_TIMEOUT = 7 * 24 * 60 * 60
+
+# Seconds a response stays replayable for its Idempotency-Key.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -156,4 +218,8 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = True
+# Guest carts are identified by X-Cart-Session (see cart.guest); retried
+# POSTs carry Idempotency-Key (see backend.idempotency).
+CORS_ALLOW_HEADERS = (*default_headers, 'x-cart-session', 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['X-Cart-Session', 'Idempotent-Replayed']
\ No newline at end of file
@@ -0,0 +1,9 @@
+from django.conf import settings
+from django.core.cache import caches
+
+
+def state_cache():
+    """The cross-process cache (``STATE_CACHE``) for state that web workers
+    and management commands share: guest carts, idempotency keys and the
+    catalog and promotion versions."""
+    return caches[getattr(settings, 'STATE_CACHE', 'default')]
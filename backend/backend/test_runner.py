@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the suite against a local-memory ``STATE_CACHE``.
+
+    The real state cache is a file store shared with the dev server;
+    tests must neither clear nor read the guest carts, idempotency keys
+    and queues kept there.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        alias = getattr(settings, 'STATE_CACHE', 'default')
+        self.state_cache_override = override_settings(CACHES={
+            **settings.CACHES,
+            alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-state'},
+        })
+        self.state_cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.state_cache_override.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.synthetic import SCALES, generate
+
+
+class Command(BaseCommand):
+    help = "Generate a deterministic synthetic catalog, inventory and order history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=list(SCALES), default='tiny')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        for name in SCALES['tiny']:
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, dest=name, help="Override the scale preset.")
+
+    def handle(self, *args, **options):
+        overrides = {name: options[name] for name in SCALES['tiny']}
+        started = time.monotonic()
+        try:
+            counts = generate(
+                scale=options['scale'],
+                seed=options['seed'],
+                batch_size=options['batch_size'],
+                progress=self.stdout.write,
+                **overrides,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        summary = ', '.join(f"{name}={count}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Generated {summary} in {time.monotonic() - started:.1f}s"))
@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from benchmarks.serialization import benchmark_serialization
+from benchmarks.suite import BenchmarkSuite, compare, write_results
+
+
+class Command(BaseCommand):
+    help = "Benchmark the API routes and write latency/query/memory results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='bench_results.json')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--warm-cache', action='store_true', help="Keep the response cache between requests.")
+        parser.add_argument('--only', nargs='*', help="Scenario name prefixes to run.")
+        parser.add_argument('--compare', help="Previous results file to diff against.")
+        parser.add_argument(
+            '--serialization', action='store_true',
+            help="Also compare serializer and values() fast path throughput on list rows.",
+        )
+
+    def handle(self, *args, **options):
+        suite = BenchmarkSuite(
+            iterations=options['iterations'],
+            warmup=options['warmup'],
+            warm_cache=options['warm_cache'],
+        )
+
+        def progress(name, result):
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"{name:32} p50={latency['p50']:9.2f}ms p99={latency['p99']:9.2f}ms "
+                f"queries={result['queries']:4} peak={result['peak_memory_kb']:9.1f}KB {result['status_codes']}"
+            )
+
+        results = suite.run(only=options['only'], progress=progress)
+        if options['serialization']:
+            results['serialization'] = benchmark_serialization()
+            for name, result in results['serialization'].items():
+                self.stdout.write(
+                    f"serialization.{name:18} rows={result['rows']:6} serializer={result['serializer_ms']:9.2f}ms "
+                    f"fast={result['fast_ms']:9.2f}ms x{result['speedup']} identical={result['identical']}"
+                )
+        write_results(options['output'], results)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as handle:
+                baseline = json.load(handle)
+            for name, delta in compare(baseline, results).items():
+                self.stdout.write(
+                    f"{name:32} Δp50={delta['p50_ms']:+9.2f}ms Δp99={delta['p99_ms']:+9.2f}ms "
+                    f"Δqueries={delta['queries']:+4} Δpeak={delta['peak_memory_kb']:+9.1f}KB"
+                )
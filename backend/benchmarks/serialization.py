@@ -0,0 +1,62 @@
+"""Serializer vs. values() fast path throughput for the hot list endpoints.
+
+Both paths render the same rows to JSON bytes; timings are best-of-N
+wall clock for query + serialization + rendering, so the ratio is the
+speedup a list request sees.
+"""
+import time
+
+from rest_framework.renderers import JSONRenderer
+
+from backend.fastpath import FastJSONRenderer
+from inventory.listing import INVENTORY_ROW
+from inventory.models import InventoryItem
+from inventory.serializers import InventoryItemSerializer
+from products.listing import product_rows, render_products
+from products.models import Product
+from products.serializers import ProductListSerializer
+
+
+def best_of(repeat, func):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def measure(repeat, slow, fast):
+    slow_seconds, slow_bytes = best_of(repeat, slow)
+    fast_seconds, fast_bytes = best_of(repeat, fast)
+    return {
+        'bytes': len(fast_bytes),
+        'identical': slow_bytes == fast_bytes,
+        'serializer_ms': round(slow_seconds * 1000, 3),
+        'fast_ms': round(fast_seconds * 1000, 3),
+        'speedup': round(slow_seconds / fast_seconds, 2) if fast_seconds else None,
+    }
+
+
+def benchmark_serialization(limit=1000, repeat=5):
+    products = Product.objects.filter(is_active=True).select_related('category', 'brand').with_primary_image()
+    products = products.order_by('-created_at', '-id')[:limit]
+    inventory = InventoryItem.objects.select_related('branch', 'variant').order_by('id')[:limit]
+    json_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+
+    results = {
+        'products': measure(
+            repeat,
+            lambda: json_renderer.render(ProductListSerializer(products.all(), many=True).data),
+            lambda: fast_renderer.render(render_products(product_rows(products.all()))),
+        ),
+        'inventory': measure(
+            repeat,
+            lambda: json_renderer.render(InventoryItemSerializer(inventory.all(), many=True).data),
+            lambda: fast_renderer.render(INVENTORY_ROW.many(inventory.values(*INVENTORY_ROW.paths()))),
+        ),
+    }
+    results['products']['rows'] = len(products)
+    results['inventory']['rows'] = len(inventory)
+    return results
@@ -0,0 +1,231 @@
+"""End-to-end benchmark suite.
+
+Each scenario drives a real URL route through the Django test client and
+records latency percentiles, SQL query counts and peak Python memory.
+Results are plain JSON so two runs can be diffed with ``compare``.
+
+Scenarios that write (``rollback=True``) run each request, setup
+included, in a transaction that is rolled back, so repeated iterations
+and runs neither place real orders nor use up the stock they measure.
+"""
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone as dt_timezone
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from cart.models import Cart, CartItem
+from inventory.availability import available_expression, available_subquery
+from inventory.models import InventoryItem
+from products.models import Category, Product, ProductVariant
+
+User = get_user_model()
+
+BENCH_USERNAME = 'benchmark-user'
+
+
+class Scenario:
+    def __init__(self, name, method, url, auth=None, data=None, setup=None, cold=True, rollback=False):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.auth = auth  # None, 'customer' or 'staff'
+        self.data = data
+        self.setup = setup
+        self.cold = cold
+        self.rollback = rollback
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+
+class BenchmarkSuite:
+    def __init__(self, iterations=20, warmup=2, warm_cache=False):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.warm_cache = warm_cache
+        self.customer, _ = User.objects.get_or_create(username=BENCH_USERNAME, defaults={'email': 'bench@example.test'})
+        self.staff, _ = User.objects.get_or_create(
+            username=f'{BENCH_USERNAME}-staff', defaults={'email': 'bench-staff@example.test', 'is_staff': True},
+        )
+
+    def client_for(self, auth):
+        # Failing endpoints are recorded by status code rather than raised.
+        client = APIClient(raise_request_exception=False)
+        if auth == 'customer':
+            client.force_authenticate(self.customer)
+        elif auth == 'staff':
+            client.force_authenticate(self.staff)
+        return client
+
+    def fill_cart(self):
+        """Put one in-stock variant in the benchmark user's cart."""
+        cart, _ = Cart.objects.get_or_create(user=self.customer)
+        item = (
+            InventoryItem.objects.annotate(available=available_expression())
+            .filter(available__gt=10, variant__is_active=True).select_related('variant').order_by('id').first()
+        )
+        if item is None:
+            return
+        CartItem.objects.update_or_create(
+            cart=cart, variant=item.variant,
+            defaults={'quantity': 1, 'unit_price': item.variant.base_price},
+        )
+
+    def default_scenarios(self):
+        product = Product.objects.filter(is_active=True).order_by('id').first()
+        category = Category.objects.filter(parent__isnull=False).order_by('id').first() or Category.objects.first()
+        variant = (
+            ProductVariant.objects.annotate(available=available_subquery('pk'))
+            .filter(is_active=True, available__gt=10).order_by('id').first()
+        )
+        slug = product.slug if product else 'missing'
+        scenarios = [
+            Scenario('products.list.page', 'get', '/api/products/?page_size=24'),
+            Scenario('products.list.by_price', 'get', '/api/products/?page_size=24&ordering=base_price'),
+            Scenario('products.search', 'get', '/api/products/?search=device&page_size=24'),
+            Scenario('products.facets', 'get', '/api/products/facets/'),
+            Scenario('products.detail', 'get', f'/api/products/{slug}/'),
+            Scenario(
+                'products.detail.expanded', 'get',
+                f'/api/products/{slug}/?expand=related,promo_price,availability',
+            ),
+            Scenario('products.variants', 'get', f'/api/products/{slug}/variants/'),
+            Scenario('products.related', 'get', f'/api/products/{slug}/related/'),
+            Scenario('categories.tree', 'get', '/api/products/categories/tree/'),
+            Scenario('cart.detail', 'get', '/api/cart/', auth='customer', setup=self.fill_cart, rollback=True),
+            Scenario('orders.list', 'get', '/api/cart/orders/', auth='customer'),
+            Scenario('inventory.list', 'get', '/api/inventory/inventory/', auth='staff'),
+            Scenario('reports.sales', 'get', '/api/reports/sales/?period=monthly', auth='staff'),
+            Scenario('reports.top_products', 'get', '/api/reports/top-products/', auth='staff'),
+            Scenario('reports.trends', 'get', '/api/reports/trends/', auth='staff'),
+            Scenario(
+                'checkout', 'post', '/api/cart/checkout/', auth='customer', setup=self.fill_cart,
+                data={'shipping_address': '1 Benchmark Street', 'payment_method': 'aba_payway'}, rollback=True,
+            ),
+        ]
+        if category is not None:
+            scenarios.append(Scenario('products.category_subtree', 'get', f'/api/products/?category__subtree={category.slug}&page_size=24'))
+        if variant is not None:
+            scenarios.append(Scenario(
+                'cart.add_item', 'post', '/api/cart/items/', auth='customer',
+                data={'variant_id': variant.id, 'quantity': 1},
+                setup=lambda: CartItem.objects.filter(cart__user=self.customer).delete(), rollback=True,
+            ))
+        return scenarios
+
+    def request(self, client, scenario):
+        if not scenario.rollback:
+            return self.send(client, scenario)
+        with transaction.atomic():
+            result = self.send(client, scenario)
+            transaction.set_rollback(True)
+        return result
+
+    def send(self, client, scenario):
+        if scenario.setup:
+            scenario.setup()
+        if scenario.cold and not self.warm_cache:
+            cache.clear()
+        call = getattr(client, scenario.method)
+        start = time.perf_counter()
+        response = call(scenario.url, scenario.data, format='json') if scenario.data is not None else call(scenario.url)
+        return time.perf_counter() - start, response
+
+    def run_scenario(self, scenario):
+        client = self.client_for(scenario.auth)
+        for _ in range(self.warmup):
+            self.request(client, scenario)
+
+        timings = []
+        statuses = set()
+        for _ in range(self.iterations):
+            elapsed, response = self.request(client, scenario)
+            timings.append(elapsed * 1000)
+            statuses.add(response.status_code)
+
+        # One instrumented pass for queries and memory, kept out of the timings.
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as ctx:
+            _, response = self.request(client, scenario)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        timings.sort()
+        return {
+            'method': scenario.method.upper(),
+            'url': scenario.url,
+            'status_codes': sorted(statuses | {response.status_code}),
+            'iterations': self.iterations,
+            'latency_ms': {
+                'mean': round(statistics.fmean(timings), 3),
+                'p50': round(percentile(timings, 50), 3),
+                'p90': round(percentile(timings, 90), 3),
+                'p99': round(percentile(timings, 99), 3),
+                'max': round(timings[-1], 3),
+            },
+            'queries': len(ctx.captured_queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+            'response_bytes': len(response.content),
+        }
+
+    def run(self, scenarios=None, only=None, progress=None):
+        scenarios = scenarios or self.default_scenarios()
+        results = {}
+        for scenario in scenarios:
+            if only and not any(scenario.name.startswith(prefix) for prefix in only):
+                continue
+            results[scenario.name] = self.run_scenario(scenario)
+            if progress:
+                progress(scenario.name, results[scenario.name])
+        return {
+            'meta': {
+                'timestamp': datetime.now(dt_timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'iterations': self.iterations,
+                'warm_cache': self.warm_cache,
+                'dataset': {
+                    'products': Product.objects.count(),
+                    'variants': ProductVariant.objects.count(),
+                    'inventory_items': InventoryItem.objects.count(),
+                },
+            },
+            'results': results,
+        }
+
+
+def compare(baseline, current):
+    """Per-scenario deltas between two result documents (current - baseline)."""
+    diff = {}
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        diff[name] = {
+            'p50_ms': round(result['latency_ms']['p50'] - before['latency_ms']['p50'], 3),
+            'p99_ms': round(result['latency_ms']['p99'] - before['latency_ms']['p99'], 3),
+            'queries': result['queries'] - before['queries'],
+            'peak_memory_kb': round(result['peak_memory_kb'] - before['peak_memory_kb'], 1),
+        }
+    return diff
+
+
+def write_results(path, results):
+    with open(path, 'w', encoding='utf-8') as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
@@ -0,0 +1,276 @@
+"""Deterministic synthetic data at configurable scale.
+
+Produces the same shape as ``products.views.create_demo_catalog`` —
+categories, brands, products with variants, images and per-branch
+inventory — plus customers and paid/pending orders, so the benchmark
+suite has realistic volumes to run against. The same seed and sizes
+always produce the same rows, timestamps included: they count back from
+``EPOCH`` rather than from the wall clock.
+
+Everything is written with ``bulk_create`` in batches and only ids and
+prices are kept in memory, so a 1M-variant / 2M-order dataset fits in
+a few tens of MB.
+"""
+import random
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from cart.models import Order, OrderItem
+from inventory.models import Branch, InventoryItem
+from products import attributes
+from products.cache import bump_catalog_version
+from products.models import Category, Brand, Product, ProductVariant, ProductImage
+from products.search import get_search_backend
+
+User = get_user_model()
+
+SLUG_PREFIX = 'syn-'
+EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+SCALES = {
+    'tiny': dict(categories=4, brands=4, products=20, variants_per_product=2, branches=2, users=5, orders=50),
+    'small': dict(categories=12, brands=20, products=2_000, variants_per_product=3, branches=3, users=500, orders=20_000),
+    'medium': dict(categories=40, brands=80, products=40_000, variants_per_product=4, branches=5, users=10_000, orders=400_000),
+    'large': dict(categories=120, brands=300, products=200_000, variants_per_product=5, branches=5, users=50_000, orders=2_000_000),
+}
+
+COLORS = ['Black', 'White', 'Silver', 'Natural Titanium', 'Space Black', 'Blue', 'Green']
+STORAGE = ['64GB', '128GB', '256GB', '512GB', '1TB']
+RAM = ['', '8GB', '16GB', '32GB']
+ORDER_STATUSES = [Order.Status.PAID] * 6 + [Order.Status.DELIVERED] * 3 + [Order.Status.PENDING]
+
+
+@contextmanager
+def manual_timestamps(model, *field_names):
+    """Let bulk_create keep explicit values for auto_now_add fields."""
+    fields = [model._meta.get_field(name) for name in field_names]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class SyntheticDataGenerator:
+    def __init__(self, seed=42, batch_size=5000, progress=None, **sizes):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.progress = progress or (lambda message: None)
+        self.sizes = {**SCALES['tiny'], **{k: v for k, v in sizes.items() if v is not None}}
+        self.now = EPOCH
+        self.counts = {}
+
+    def _bulk(self, model, objects):
+        """bulk_create an iterable in batches; returns created objects' ids."""
+        ids = []
+        batch = []
+
+        def flush():
+            with transaction.atomic():
+                created = model.objects.bulk_create(batch)
+            ids.extend(obj.pk for obj in created)
+            batch.clear()
+
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                flush()
+        if batch:
+            flush()
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(ids)
+        self.progress(f"{model.__name__}: {len(ids)}")
+        return ids
+
+    def generate(self):
+        if Product.objects.filter(slug__startswith=SLUG_PREFIX).exists():
+            raise ValueError("Synthetic data already present; use a fresh database.")
+        sizes = self.sizes
+
+        category_ids = self.generate_categories(sizes['categories'])
+        brand_ids = self._bulk(Brand, (
+            Brand(slug=f"{SLUG_PREFIX}brand-{i}", name=f"Synthetic Brand {i}") for i in range(sizes['brands'])
+        ))
+        branch_ids = self._bulk(Branch, (
+            Branch(code=f"{SLUG_PREFIX}{i}", name=f"Synthetic Branch {i}") for i in range(sizes['branches'])
+        ))
+        product_ids, product_prices = self.generate_products(sizes['products'], category_ids, brand_ids)
+        variant_ids, variant_prices = self.generate_variants(product_ids, product_prices, sizes['variants_per_product'])
+        self.product_ids = product_ids
+        self._bulk(InventoryItem, (
+            InventoryItem(
+                branch_id=branch_id,
+                variant_id=variant_id,
+                quantity=self.rng.randint(0, 200),
+                min_threshold=self.rng.choice([0, 5, 10]),
+            )
+            for variant_id in variant_ids
+            for branch_id in branch_ids
+        ))
+        user_ids = self._bulk(User, (
+            User(username=f"{SLUG_PREFIX}user-{i}", email=f"user{i}@synthetic.test", password='!')
+            for i in range(sizes['users'])
+        ))
+        if user_ids:
+            self.generate_orders(sizes['orders'], user_ids, variant_ids, variant_prices)
+
+        self.progress("Rebuilding search index")
+        get_search_backend().rebuild()
+        self.progress("Rebuilding variant attribute index")
+        attributes.rebuild(batch_size=self.batch_size)
+        bump_catalog_version()
+        return self.counts
+
+    def generate_categories(self, count):
+        roots = max(1, count // 4)
+        root_ids = self._bulk(Category, (
+            Category(slug=f"{SLUG_PREFIX}cat-{i}", name=f"Synthetic Category {i}") for i in range(roots)
+        ))
+        child_ids = self._bulk(Category, (
+            Category(
+                slug=f"{SLUG_PREFIX}cat-{i}",
+                name=f"Synthetic Category {i}",
+                parent_id=root_ids[i % len(root_ids)],
+            )
+            for i in range(roots, count)
+        ))
+        # bulk_create skips Category.save(), so fill the materialized paths.
+        categories = list(Category.objects.filter(pk__in=[*root_ids, *child_ids]))
+        for category in categories:
+            category.path = f"{category.parent_id}/{category.pk}/" if category.parent_id else f"{category.pk}/"
+            category.depth = 1 if category.parent_id else 0
+        Category.objects.bulk_update(categories, ['path', 'depth'], batch_size=self.batch_size)
+        return child_ids or root_ids
+
+    def generate_products(self, count, category_ids, brand_ids):
+        rng = self.rng
+        types = list(Product.ProductType.values)
+        prices = array('q')
+
+        def products():
+            for i in range(count):
+                cents = rng.randint(10_00, 3000_00)
+                prices.append(cents)
+                yield Product(
+                    slug=f"{SLUG_PREFIX}product-{i}",
+                    name=f"Synthetic {rng.choice(COLORS)} Device {i}",
+                    category_id=rng.choice(category_ids),
+                    brand_id=rng.choice(brand_ids),
+                    product_type=rng.choice(types),
+                    description=f"Synthetic product {i} for benchmarking.",
+                    base_price=Decimal(cents) / 100,
+                    # One minute apart, newest last, like a catalog built up over time.
+                    created_at=self.now - timedelta(minutes=count - i),
+                    updated_at=self.now - timedelta(minutes=count - i),
+                )
+
+        with manual_timestamps(Product, 'created_at', 'updated_at'):
+            product_ids = self._bulk(Product, products())
+        self._bulk(ProductImage, (
+            ProductImage(
+                product_id=product_id,
+                image_url=f"https://images.synthetic.test/{product_id}.jpg",
+                alt_text=f"Product {product_id}",
+                is_primary=True,
+            )
+            for product_id in product_ids
+        ))
+        return product_ids, prices
+
+    def generate_variants(self, product_ids, product_prices, per_product):
+        rng = self.rng
+        prices = array('q')
+
+        def variants():
+            for index, product_id in enumerate(product_ids):
+                for v in range(per_product):
+                    cents = product_prices[index] + v * 50_00
+                    prices.append(cents)
+                    yield ProductVariant(
+                        product_id=product_id,
+                        sku=f"SYN-{product_id}-{v}",
+                        color=rng.choice(COLORS),
+                        storage=STORAGE[v % len(STORAGE)],
+                        ram=rng.choice(RAM),
+                        attributes={'generation': rng.randint(1, 5)},
+                        base_price=Decimal(cents) / 100,
+                    )
+
+        return array('q', self._bulk(ProductVariant, variants())), prices
+
+    def generate_orders(self, count, user_ids, variant_ids, variant_prices):
+        rng = self.rng
+        span = int(timedelta(days=3 * 365).total_seconds())
+        order_lines = []
+
+        def orders():
+            for i in range(count):
+                lines = []
+                subtotal = 0
+                for _ in range(rng.randint(1, 4)):
+                    index = rng.randrange(len(variant_ids))
+                    quantity = rng.randint(1, 3)
+                    subtotal += quantity * variant_prices[index]
+                    lines.append((index, quantity))
+                order_lines.append(lines)
+                status = rng.choice(ORDER_STATUSES)
+                created_at = self.now - timedelta(seconds=rng.randrange(span))
+                total = Decimal(subtotal) / 100
+                yield Order(
+                    user_id=rng.choice(user_ids),
+                    order_number=f"SYN{i:010d}",
+                    status=status,
+                    subtotal=total,
+                    total_amount=total,
+                    payment_method='aba_payway',
+                    payment_status='PAID' if status != Order.Status.PENDING else 'PENDING',
+                    created_at=created_at,
+                    paid_at=created_at if status != Order.Status.PENDING else None,
+                )
+
+        # Orders and their items are flushed together per batch so the
+        # per-order line plan never grows beyond one batch.
+        with manual_timestamps(Order, 'created_at'):
+            batch = []
+            for order in orders():
+                batch.append(order)
+                if len(batch) >= self.batch_size:
+                    self._flush_orders(batch, order_lines, variant_ids, variant_prices)
+            if batch:
+                self._flush_orders(batch, order_lines, variant_ids, variant_prices)
+        self.progress(f"Order: {self.counts.get('Order', 0)}")
+
+    def _flush_orders(self, batch, order_lines, variant_ids, variant_prices):
+        with transaction.atomic():
+            created = Order.objects.bulk_create(batch)
+            items = []
+            for order, lines in zip(created, order_lines):
+                for index, quantity in lines:
+                    price = Decimal(variant_prices[index]) / 100
+                    product_index, v = divmod(index, self.sizes['variants_per_product'])
+                    items.append(OrderItem(
+                        order_id=order.pk,
+                        variant_id=variant_ids[index],
+                        product_name=f"Synthetic Device {product_index}",
+                        variant_sku=f"SYN-{self.product_ids[product_index]}-{v}",
+                        unit_price=price,
+                        quantity=quantity,
+                        line_total=price * quantity,
+                    ))
+            OrderItem.objects.bulk_create(items, batch_size=self.batch_size)
+        self.counts['Order'] = self.counts.get('Order', 0) + len(created)
+        self.counts['OrderItem'] = self.counts.get('OrderItem', 0) + len(items)
+        batch.clear()
+        order_lines.clear()
+
+
+def generate(scale='tiny', seed=42, batch_size=5000, progress=None, **overrides):
+    sizes = {**SCALES[scale], **{k: v for k, v in overrides.items() if v is not None}}
+    return SyntheticDataGenerator(seed=seed, batch_size=batch_size, progress=progress, **sizes).generate()
@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+
+from cart.models import CartItem, Order, OrderItem
+from inventory.models import InventoryItem, StockReservation
+from products.models import Category, Product
+
+from .synthetic import generate
+from .serialization import benchmark_serialization
+from .suite import BenchmarkSuite, compare
+
+
+class SyntheticDataTests(TestCase):
+    def snapshot(self, **kwargs):
+        with transaction.atomic():
+            counts = generate(**kwargs)
+            products = list(Product.objects.order_by('slug').values_list('slug', 'name', 'base_price', 'created_at'))
+            orders = list(Order.objects.order_by('order_number').values_list(
+                'order_number', 'total_amount', 'status', 'created_at', 'paid_at',
+            ))
+            transaction.set_rollback(True)
+        return counts, products, orders
+
+    def test_sizes_and_determinism(self):
+        counts, products, orders = self.snapshot(scale='tiny', seed=7, products=10, orders=30)
+        self.assertEqual(counts['Product'], 10)
+        self.assertEqual(counts['ProductVariant'], 20)
+        self.assertEqual(counts['InventoryItem'], 40)
+        self.assertEqual(counts['Order'], 30)
+        self.assertEqual(len(products), 10)
+        self.assertEqual(self.snapshot(scale='tiny', seed=7, products=10, orders=30), (counts, products, orders))
+        self.assertNotEqual(self.snapshot(scale='tiny', seed=8, products=10, orders=30)[1], products)
+
+    def test_orders_spread_over_history_and_categories_have_paths(self):
+        counts = generate(scale='tiny')
+        self.assertEqual(OrderItem.objects.count(), counts['OrderItem'])
+        dates = Order.objects.values_list('created_at', flat=True)
+        self.assertGreater(max(dates) - min(dates), timedelta(days=30))
+        self.assertFalse(Category.objects.filter(path='').exists())
+
+
+class BenchmarkSuiteTests(TestCase):
+    def test_suite_records_metrics_for_every_route(self):
+        generate(scale='tiny')
+        results = BenchmarkSuite(iterations=2, warmup=0).run()
+        self.assertIn('products.list.page', results['results'])
+        for name, result in results['results'].items():
+            self.assertIn(result['status_codes'][0], (200, 201), name)
+            self.assertGreaterEqual(result['latency_ms']['p99'], result['latency_ms']['p50'])
+            self.assertGreaterEqual(result['queries'], 0)
+        self.assertEqual(compare(results, results)['products.list.page']['queries'], 0)
+
+    def test_writing_scenarios_leave_no_orders_or_holds(self):
+        generate(scale='tiny')
+        orders = Order.objects.count()
+        stock = list(InventoryItem.objects.order_by('id').values_list('quantity', 'reserved_quantity'))
+        results = BenchmarkSuite(iterations=5, warmup=1).run(only=['checkout', 'cart.'])
+        for name in ('checkout', 'cart.add_item', 'cart.detail'):
+            self.assertEqual(results['results'][name]['status_codes'], [201 if name != 'cart.detail' else 200], name)
+        self.assertEqual(Order.objects.count(), orders)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(list(InventoryItem.objects.order_by('id').values_list('quantity', 'reserved_quantity')), stock)
+
+    def test_command_writes_json(self):
+        generate(scale='tiny')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.json')
+            call_command('run_benchmarks', output=path, iterations=1, warmup=0, only=['products.list'], stdout=StringIO())
+            with open(path, encoding='utf-8') as handle:
+                data = json.load(handle)
+        self.assertEqual(sorted(data['results']), ['products.list.by_price', 'products.list.page'])
+
+
+class SerializationBenchmarkTests(TestCase):
+    def test_fast_path_output_is_identical(self):
+        generate(scale='tiny')
+        results = benchmark_serialization(limit=50, repeat=1)
+        for name in ('products', 'inventory'):
+            self.assertTrue(results[name]['identical'], name)
+            self.assertGreater(results[name]['rows'], 0)
@@ -0,0 +1,241 @@
+"""Guest carts, held in the cache and persisted write-behind.
+
+A guest cart is ``{variant_id: {'quantity', 'unit_price', 'created_at'}}``
+cached under ``guest-cart:<session id>``; the session id travels in the
+``X-Cart-Session`` header. Writes only touch the cache and mark the
+session dirty. ``persist_dirty`` (the ``flush_guest_carts`` command)
+copies dirty carts to ``Cart``/``CartItem`` rows keyed by
+``Cart.session_id``, so carts that are emptied between flushes never
+reach the database and a cache restart loses at most one flush interval.
+Carts and the dirty marks live in the ``STATE_CACHE`` alias, which the web
+workers and the command share; it must be a cross-process cache.
+A cache miss reloads the persisted rows.
+
+On OTP login ``merge_into_user_cart`` folds the guest cart into the
+user's ``Cart`` with one bulk upsert and drops the guest copies.
+"""
+import re
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from backend.state import state_cache
+from inventory import reservations
+from inventory.availability import available_stock
+from inventory.stock import InsufficientStock
+from products.models import ProductVariant
+from .models import Cart, CartItem
+
+SESSION_HEADER = 'X-Cart-Session'
+CACHE_PREFIX = 'guest-cart:'
+DIRTY_KEY = 'guest-cart:dirty'
+DIRTY_MARK_PREFIX = 'guest-cart:dirty-mark:'
+DIRTY_GENERATION_KEY = 'guest-cart:dirty-generation'
+SESSION_ID_RE = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+def cart_timeout():
+    return getattr(settings, 'GUEST_CART_TIMEOUT', 7 * 24 * 60 * 60)
+
+
+def new_session_id():
+    return secrets.token_urlsafe(24)
+
+
+def get_session_id(request):
+    """The guest session id sent by the client, if it looks like one of ours.
+
+    Login requests may send it as ``cart_session`` in the body instead.
+    """
+    session_id = request.headers.get(SESSION_HEADER)
+    if not session_id and isinstance(request.data, dict):
+        session_id = request.data.get('cart_session')
+    if session_id and SESSION_ID_RE.match(session_id):
+        return session_id
+    return None
+
+
+def mark_dirty(session_id):
+    cache = state_cache()
+    cache.set(f'{DIRTY_MARK_PREFIX}{session_id}', True, timeout=None)
+    # Read-modify-write on one set: a racing writer can drop an id, which
+    # only delays that cart's persistence until its next change.
+    key = f'{DIRTY_KEY}:{cache.get(DIRTY_GENERATION_KEY, 0)}'
+    dirty = cache.get(key) or set()
+    dirty.add(session_id)
+    cache.set(key, dirty, timeout=None)
+
+
+def next_dirty_generation(cache):
+    try:
+        return cache.incr(DIRTY_GENERATION_KEY)
+    except ValueError:
+        cache.add(DIRTY_GENERATION_KEY, 0, timeout=None)
+        return cache.incr(DIRTY_GENERATION_KEY)
+
+
+class GuestCart:
+    def __init__(self, session_id, lines=None, created_at=None):
+        self.session_id = session_id
+        self.lines = lines or {}
+        self.created_at = created_at or timezone.now()
+
+    @property
+    def key(self):
+        return f'{CACHE_PREFIX}{self.session_id}'
+
+    @property
+    def holder(self):
+        return reservations.session_holder(self.session_id)
+
+    @classmethod
+    def load(cls, session_id):
+        cached = state_cache().get(f'{CACHE_PREFIX}{session_id}')
+        if cached is not None:
+            return cls(session_id, cached['lines'], cached['created_at'])
+        cart = cls(session_id)
+        persisted = Cart.objects.filter(session_id=session_id, user__isnull=True).first()
+        if persisted is not None:
+            cart.created_at = persisted.created_at
+            cart.lines = {
+                variant_id: {'quantity': quantity, 'unit_price': unit_price, 'created_at': created_at}
+                for variant_id, quantity, unit_price, created_at in persisted.items.values_list(
+                    'variant_id', 'quantity', 'unit_price', 'created_at',
+                )
+            }
+            cart.cache()
+        return cart
+
+    def cache(self):
+        state_cache().set(self.key, {'lines': self.lines, 'created_at': self.created_at}, timeout=cart_timeout())
+
+    def save(self):
+        self.cache()
+        mark_dirty(self.session_id)
+
+    def quantity(self, variant_id):
+        line = self.lines.get(variant_id)
+        return line['quantity'] if line else 0
+
+    def set_line(self, variant, quantity):
+        """Hold ``quantity`` units and store the line; raises ``InsufficientStock``."""
+        with transaction.atomic():
+            reservations.set_hold(self.holder, variant.pk, quantity)
+        line = self.lines.setdefault(variant.pk, {'unit_price': variant.base_price, 'created_at': timezone.now()})
+        line['quantity'] = quantity
+        self.save()
+
+    def remove(self, variant_id):
+        reservations.release(reservations.active(self.holder, [variant_id]))
+        if self.lines.pop(variant_id, None) is not None:
+            self.save()
+
+    def items(self):
+        """Unsaved ``CartItem`` objects (``id`` is the variant id) shaped like
+        ``CartItem.objects.for_display()`` rows."""
+        ids = list(self.lines)
+        variants = ProductVariant.objects.in_bulk(ids)
+        stock = available_stock(ids)
+        held = reservations.held_quantities(self.holder, ids)
+        items = []
+        for variant_id, line in sorted(self.lines.items(), key=lambda pair: pair[1]['created_at']):
+            if variant_id not in variants:
+                continue
+            item = CartItem(
+                id=variant_id, variant=variants[variant_id], quantity=line['quantity'],
+                unit_price=line['unit_price'], created_at=line['created_at'],
+            )
+            item.available_quantity = stock[variant_id] + held.get(variant_id, 0)
+            items.append(item)
+        return items
+
+    def discard(self):
+        state_cache().delete(self.key)
+        Cart.objects.filter(session_id=self.session_id, user__isnull=True).delete()
+        self.lines = {}
+
+
+def upsert_items(cart, lines, quantities=None):
+    """Write ``lines`` into ``cart`` with one INSERT ... ON CONFLICT UPDATE."""
+    quantities = quantities or {variant_id: line['quantity'] for variant_id, line in lines.items()}
+    CartItem.objects.bulk_create(
+        [
+            CartItem(cart=cart, variant_id=variant_id, quantity=quantities[variant_id], unit_price=line['unit_price'])
+            for variant_id, line in lines.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['cart', 'variant'],
+        update_fields=['quantity'],
+    )
+
+
+@transaction.atomic
+def persist(session_id):
+    """Copy one guest cart from the cache into ``Cart``/``CartItem`` rows."""
+    cached = state_cache().get(f'{CACHE_PREFIX}{session_id}')
+    if cached is None or not cached['lines']:
+        Cart.objects.filter(session_id=session_id, user__isnull=True).delete()
+        return
+    lines = cached['lines']
+    cart, _ = Cart.objects.update_or_create(session_id=session_id, user=None)
+    upsert_items(cart, lines)
+    cart.items.exclude(variant_id__in=list(lines)).delete()
+
+
+def persist_dirty():
+    """Persist every cart written since the last flush; returns how many.
+
+    Writers move on to a fresh dirty set before the closed ones are read,
+    and the set closed by the previous flush is read once more for ids
+    added just as it closed. Each cart is claimed by deleting its own
+    dirty mark, so a cart changed during the flush stays marked.
+    """
+    cache = state_cache()
+    generation = next_dirty_generation(cache)
+    keys = [f'{DIRTY_KEY}:{generation - 2}', f'{DIRTY_KEY}:{generation - 1}']
+    persisted = 0
+    for session_id in set().union(*cache.get_many(keys).values()):
+        if not cache.delete(f'{DIRTY_MARK_PREFIX}{session_id}'):
+            continue
+        try:
+            persist(session_id)
+        except Exception:
+            mark_dirty(session_id)
+            raise
+        persisted += 1
+    cache.delete(keys[0])
+    return persisted
+
+
+def prune_persisted(now=None):
+    """Delete persisted guest carts untouched for longer than the cache timeout."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=cart_timeout())
+    deleted, _ = Cart.objects.filter(user__isnull=True, updated_at__lt=cutoff).delete()
+    return deleted
+
+
+@transaction.atomic
+def merge_into_user_cart(session_id, user):
+    """Fold a guest cart into ``user``'s cart, adding quantities per variant."""
+    guest = GuestCart.load(session_id)
+    if not guest.lines:
+        return None
+    cart, _ = Cart.objects.get_or_create(user=user)
+    existing = dict(cart.items.filter(variant_id__in=list(guest.lines)).values_list('variant_id', 'quantity'))
+    merged = {variant_id: existing.get(variant_id, 0) + guest.quantity(variant_id) for variant_id in guest.lines}
+    upsert_items(cart, guest.lines, merged)
+
+    holder = reservations.cart_holder(cart.pk)
+    try:
+        with transaction.atomic():
+            reservations.release(reservations.active(holder, list(merged)))
+            reservations.transfer(guest.holder, holder, merged, ttl=reservations.cart_hold_ttl())
+    except InsufficientStock:
+        # Logging in never fails on stock; the lines are held again at
+        # the next quantity change and checked at checkout.
+        reservations.release(reservations.active(guest.holder))
+    guest.discard()
+    return cart
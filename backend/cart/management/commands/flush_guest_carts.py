@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from cart.guest import persist_dirty, prune_persisted
+
+
+class Command(BaseCommand):
+    help = "Persist guest carts changed since the last run and prune stale ones. Run it every few minutes."
+
+    def handle(self, *args, **options):
+        persisted = persist_dirty()
+        pruned = prune_persisted()
+        self.stdout.write(self.style.SUCCESS(f"Persisted {persisted} guest carts; pruned {pruned} rows."))
@@ -0,0 +1,28 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart.webhooks import BATCH_SIZE, drain, inbox_metrics
+
+
+class Command(BaseCommand):
+    help = "Apply queued payment webhooks in batches. Use --loop to keep polling."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--loop', type=float, metavar='SECONDS', help="Poll the inbox every SECONDS.")
+        parser.add_argument('--metrics', action='store_true', help="Print backlog and lag metrics and exit.")
+
+    def handle(self, *args, **options):
+        if options['metrics']:
+            self.stdout.write(json.dumps(inbox_metrics(), indent=2))
+            return
+        while True:
+            handled = drain(workers=options['workers'], batch_size=options['batch_size'])
+            if handled or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f"Processed {handled} webhook events."))
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
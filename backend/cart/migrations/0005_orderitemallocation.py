@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-17 18:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0004_order_user_created_index'),
+        ('inventory', '0002_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItemAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='order_allocations', to='inventory.branch')),
+                ('inventory_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_allocations', to='inventory.inventoryitem')),
+                ('order_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='cart.orderitem')),
+            ],
+        ),
+    ]
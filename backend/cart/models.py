@@ -1,12 +1,34 @@
 from django.db import models
 
 # Create your models here.
+from collections import defaultdict
+
 from django.db import models
 from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, DecimalField, F, Prefetch, Sum
+from django.db.models.functions import Cast, Concat
 from django.utils import timezone
+from inventory import reservations
+from inventory.allocation import FulfillmentPlanner
+from inventory.availability import available_subquery
+from inventory.models import Branch, InventoryItem
+from inventory.stock import InsufficientStock, deduct_stock
 from products.models import ProductVariant
 
 
+class CartQuerySet(models.QuerySet):
+    def with_lines(self):
+        """Totals summed in SQL, lines prefetched ready for ``CartSerializer``."""
+        return self.annotate(
+            total_items=Sum('items__quantity'),
+            total_amount=Sum(
+                F('items__quantity') * F('items__unit_price'),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+        ).prefetch_related(Prefetch('items', queryset=CartItem.objects.for_display().order_by('id')))
+
+
 class Cart(models.Model):
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL,
@@ -19,12 +41,25 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         if self.user:
             return f"Cart of {self.user.email}"
         return f"Cart session {self.session_id}"
 
 
+class CartItemQuerySet(models.QuerySet):
+    def for_display(self):
+        """Variant and product joined, plus ``available_quantity``: the most
+        this line can be set to, i.e. free stock plus the cart's own hold."""
+        # reservations.cart_holder(cart_id), built in SQL.
+        holder = Concat(models.Value('cart:'), Cast(models.OuterRef('cart_id'), CharField()))
+        return self.select_related('variant__product').annotate(
+            available_quantity=available_subquery() + reservations.held_subquery(holder),
+        )
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     variant = models.ForeignKey(ProductVariant, on_delete=models.PROTECT, related_name='cart_items')
@@ -32,6 +67,8 @@ class CartItem(models.Model):
     unit_price = models.DecimalField(max_digits=12, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ('cart', 'variant')
 
@@ -63,11 +100,79 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     paid_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        # Order history pages seek on (created_at, id) within one user.
+        indexes = [models.Index(fields=['user', 'created_at', 'id'])]
+
     def mark_paid(self):
+        """Returns False when the order was already paid, e.g. a repeated webhook."""
         self.status = self.Status.PAID
         self.payment_status = 'PAID'
         self.paid_at = timezone.now()
-        self.save(update_fields=['status', 'payment_status', 'paid_at'])
+        return bool(
+            Order.objects.filter(pk=self.pk, paid_at__isnull=True)
+            .update(status=self.status, payment_status=self.payment_status, paid_at=self.paid_at)
+        )
+
+    def commit_stock(self):
+        """Convert the order's stock holds into deductions at payment.
+
+        Lines whose hold already expired are deducted from whatever stock
+        is free; returns ``{variant_id: quantity}`` that could not be had.
+        """
+        return Order.commit_stock_for([self]).get(self.pk, {})
+
+    @classmethod
+    def commit_stock_for(cls, orders):
+        """``commit_stock`` for many orders at once: all holds are settled in
+        one pass. Returns ``{order_id: shortfalls}`` for orders left short.
+
+        Lines deducted afresh are planned like checkout, staying on the
+        branches the order already ships from where possible, and the
+        order's ``OrderItemAllocation`` rows are re-recorded to match.
+        """
+        orders = list(orders)
+        converted = reservations.convert_rows([reservations.order_holder(order.order_number) for order in orders])
+        missing = defaultdict(lambda: defaultdict(int))
+        lines = defaultdict(dict)
+        for order_item_id, order_id, variant_id, quantity in OrderItem.objects.filter(order__in=orders).values_list(
+            'id', 'order_id', 'variant_id', 'quantity',
+        ):
+            missing[order_id][variant_id] += quantity
+            lines[order_id][variant_id] = order_item_id
+        kept = {order.pk: converted.get(reservations.order_holder(order.order_number), []) for order in orders}
+        branch_of = dict(InventoryItem.objects.filter(
+            pk__in={item_id for rows in kept.values() for item_id, _, _ in rows},
+        ).values_list('pk', 'branch_id'))
+        shortfalls, reallocated = {}, {}
+        for order in orders:
+            done = defaultdict(int)
+            for _, variant_id, quantity in kept[order.pk]:
+                done[variant_id] += quantity
+            need = {
+                variant_id: quantity - done[variant_id]
+                for variant_id, quantity in missing[order.pk].items()
+                if quantity > done[variant_id]
+            }
+            if not need:
+                continue
+            planner = FulfillmentPlanner()
+            planner.preferred.update(branch_of[item_id] for item_id, _, _ in kept[order.pk])
+            taken = {}
+            try:
+                with transaction.atomic():
+                    taken = deduct_stock(need, planner=planner)
+            except InsufficientStock as exc:
+                shortfalls[order.pk] = exc.shortfalls
+            branch_of.update(planner.branch_of)
+            reallocated[order.pk] = kept[order.pk] + [
+                (item_id, variant_id, n) for variant_id, takes in taken.items() for item_id, n in takes
+            ]
+        if reallocated:
+            OrderItemAllocation.objects.filter(order_item__order_id__in=reallocated).delete()
+            for order_id, rows in reallocated.items():
+                OrderItemAllocation.record(lines[order_id], rows, branch_of)
+        return shortfalls
 
     def __str__(self):
         return self.order_number
@@ -87,6 +192,36 @@ class OrderItem(models.Model):
         return f"{self.product_name} x{self.quantity}"
 
 
+class OrderItemAllocation(models.Model):
+    """Units of an order line allocated to one branch at checkout."""
+
+    order_item = models.ForeignKey(OrderItem, on_delete=models.CASCADE, related_name='allocations')
+    branch = models.ForeignKey(Branch, on_delete=models.PROTECT, related_name='order_allocations')
+    inventory_item = models.ForeignKey(
+        InventoryItem, null=True, blank=True, on_delete=models.SET_NULL, related_name='order_allocations',
+    )
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.order_item_id} from {self.branch_id}"
+
+    @classmethod
+    def record(cls, lines, rows, branch_of):
+        """One allocation per line and branch row.
+
+        ``lines`` maps variant ids to order item ids, ``rows`` are
+        ``(inventory_item_id, variant_id, quantity)`` and ``branch_of`` maps
+        inventory item ids to branch ids.
+        """
+        amounts = defaultdict(int)
+        for item_id, variant_id, quantity in rows:
+            amounts[variant_id, item_id] += quantity
+        return cls.objects.bulk_create([
+            cls(order_item_id=lines[variant_id], branch_id=branch_of[item_id], inventory_item_id=item_id, quantity=quantity)
+            for (variant_id, item_id), quantity in amounts.items()
+        ])
+
+
 class PaymentTransaction(models.Model):
     class Status(models.TextChoices):
         PENDING = 'PENDING', 'Pending'
@@ -101,4 +236,35 @@ class PaymentTransaction(models.Model):
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
     raw_response = models.JSONField(blank=True, default=dict)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class WebhookEvent(models.Model):
+    """A raw payment gateway callback, queued for ``cart.webhooks`` to apply."""
+
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        PROCESSED = 'PROCESSED', 'Processed'
+        FAILED = 'FAILED', 'Failed'
+
+    gateway = models.CharField(max_length=50)
+    # "<gateway>:<tran_id>:<status>", so repeated deliveries collapse.
+    dedupe_key = models.CharField(max_length=255, unique=True)
+    tran_id = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+            models.Index(fields=['status', 'processed_at']),
+        ]
+
+    def __str__(self):
+        return self.dedupe_key
@@ -1,8 +1,15 @@
+
 from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 from products.models import ProductVariant
-from inventory.models import InventoryItem
-from .models import Cart, CartItem, Order, OrderItem, PaymentTransaction
+from products.pricing import PricedLine, price_lines
+from inventory.availability import available_stock
+from inventory import reservations
+from inventory.allocation import FulfillmentPlanner
+from inventory.models import Branch
+from inventory.stock import InsufficientStock
+from .models import Cart, CartItem, Order, OrderItem, OrderItemAllocation, PaymentTransaction
 
 
 class ProductVariantSimpleSerializer(serializers.ModelSerializer):
@@ -11,6 +18,24 @@ class ProductVariantSimpleSerializer(serializers.ModelSerializer):
         fields = ['id', 'sku', 'color', 'storage', 'ram', 'base_price']
 
 
+def price_items(items):
+    """Attach a promotion-priced ``PricedLine`` to each cart line as ``priced``."""
+    lines = [
+        PricedLine(item.variant_id, item.variant.product_id, item.quantity, item.unit_price) for item in items
+    ]
+    for item, line in zip(items, price_lines(lines)):
+        item.priced = line
+    return items
+
+
+class PricedCartItemListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        if any(not hasattr(item, 'priced') for item in items):
+            price_items(items)
+        return super().to_representation(items)
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     variant = ProductVariantSimpleSerializer(read_only=True)
     variant_id = serializers.PrimaryKeyRelatedField(
@@ -18,35 +43,75 @@ class CartItemSerializer(serializers.ModelSerializer):
         write_only=True,
         source='variant',
     )
+    available_quantity = serializers.IntegerField(read_only=True)
+    promo_price = serializers.SerializerMethodField()
+    discount = serializers.SerializerMethodField()
 
     class Meta:
         model = CartItem
-        fields = ['id', 'variant', 'variant_id', 'quantity', 'unit_price', 'created_at']
+        fields = [
+            'id', 'variant', 'variant_id', 'quantity', 'unit_price', 'created_at',
+            'available_quantity', 'promo_price', 'discount',
+        ]
         read_only_fields = ['unit_price', 'created_at']
+        list_serializer_class = PricedCartItemListSerializer
+
+    def get_priced(self, obj):
+        if not hasattr(obj, 'priced'):
+            price_items([obj])
+        return obj.priced
+
+    def get_promo_price(self, obj):
+        line = self.get_priced(obj)
+        return str(line.discounted_unit_price) if line.discount else None
+
+    def get_discount(self, obj):
+        return str(self.get_priced(obj).discount)
 
 
 class CartSerializer(serializers.ModelSerializer):
+    """Expects a cart from ``Cart.objects.with_lines()``: totals come from SQL."""
+
     items = CartItemSerializer(many=True, read_only=True)
     total_items = serializers.SerializerMethodField()
     total_amount = serializers.SerializerMethodField()
+    discount_total = serializers.SerializerMethodField()
 
     class Meta:
         model = Cart
-        fields = ['id', 'total_items', 'total_amount', 'created_at', 'updated_at', 'items']
+        fields = ['id', 'total_items', 'total_amount', 'discount_total', 'created_at', 'updated_at', 'items']
+
+    def to_representation(self, instance):
+        price_items(instance.items.all())
+        return super().to_representation(instance)
 
     def get_total_items(self, obj):
-        return sum(item.quantity for item in obj.items.all())
+        return obj.total_items or 0
 
     def get_total_amount(self, obj):
-        return sum(item.quantity * item.unit_price for item in obj.items.all())
+        return obj.total_amount or 0
+
+    def get_discount_total(self, obj):
+        return sum(item.priced.discount for item in obj.items.all())
+
+
+def guest_cart_data(guest):
+    """A ``GuestCart`` in the same shape as ``CartSerializer``, plus its session id."""
+    items = price_items(guest.items())
+    return {
+        'id': None,
+        'session_id': guest.session_id,
+        'total_items': sum(item.quantity for item in items),
+        'total_amount': sum(item.quantity * item.unit_price for item in items),
+        'discount_total': sum(item.priced.discount for item in items),
+        'created_at': guest.created_at,
+        'updated_at': max((item.created_at for item in items), default=guest.created_at),
+        'items': CartItemSerializer(items, many=True).data,
+    }
 
 
 def get_available_stock(variant: ProductVariant) -> int:
-    qs = InventoryItem.objects.filter(variant=variant)
-    total = 0
-    for inv in qs:
-        total += inv.available_quantity
-    return total
+    return available_stock([variant.pk])[variant.pk]
 
 
 class CartItemCreateUpdateSerializer(serializers.ModelSerializer):
@@ -61,42 +126,54 @@ class CartItemCreateUpdateSerializer(serializers.ModelSerializer):
         fields = ['id', 'variant_id', 'quantity']
 
     def validate(self, attrs):
-        variant = attrs['variant']
-        quantity = attrs['quantity']
-        available = get_available_stock(variant)
+        quantity = attrs.get('quantity', self.instance.quantity if self.instance else 0)
         if quantity <= 0:
             raise serializers.ValidationError("Quantity must be greater than zero.")
-        if quantity > available:
-            raise serializers.ValidationError(f"Only {available} items available in stock.")
         return attrs
 
+    def stock_error(self, variant, quantity, exc):
+        available = quantity - exc.shortfalls[variant.pk]
+        return serializers.ValidationError(f"Only {available} items available in stock.")
+
+    def hold(self, cart_id, variant, quantity):
+        """Hold ``quantity`` units for the cart line; the hold is the stock check."""
+        try:
+            reservations.set_hold(reservations.cart_holder(cart_id), variant.pk, quantity)
+        except InsufficientStock as exc:
+            raise self.stock_error(variant, quantity, exc)
+
+    def save_guest_line(self, guest, variant, quantity):
+        try:
+            guest.set_line(variant, quantity)
+        except InsufficientStock as exc:
+            raise self.stock_error(variant, quantity, exc)
+        line = guest.lines[variant.pk]
+        return CartItem(id=variant.pk, variant=variant, quantity=quantity, unit_price=line['unit_price'])
+
+    @transaction.atomic
     def create(self, validated_data):
-        cart: Cart = self.context['cart']
         variant = validated_data['variant']
-        quantity = validated_data['quantity']
-
-        item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            variant=variant,
-            defaults={
-                'quantity': quantity,
-                'unit_price': variant.base_price,
-            },
-        )
-        if not created:
-            new_qty = item.quantity + quantity
-            available = get_available_stock(variant)
-            if new_qty > available:
-                raise serializers.ValidationError(f"Only {available} items available in stock.")
-            item.quantity = new_qty
-            item.save(update_fields=['quantity'])
+        guest = self.context.get('guest')
+        if guest is not None:
+            return self.save_guest_line(guest, variant, validated_data['quantity'] + guest.quantity(variant.pk))
+
+        cart: Cart = self.context['cart']
+        item = CartItem.objects.select_for_update().filter(cart=cart, variant=variant).first()
+        quantity = validated_data['quantity'] + (item.quantity if item else 0)
+        self.hold(cart.pk, variant, quantity)
+        if item is None:
+            return CartItem.objects.create(cart=cart, variant=variant, quantity=quantity, unit_price=variant.base_price)
+        item.quantity = quantity
+        item.save(update_fields=['quantity'])
         return item
 
+    @transaction.atomic
     def update(self, instance: CartItem, validated_data):
         quantity = validated_data.get('quantity', instance.quantity)
-        available = get_available_stock(instance.variant)
-        if quantity > available:
-            raise serializers.ValidationError(f"Only {available} items available in stock.")
+        guest = self.context.get('guest')
+        if guest is not None:
+            return self.save_guest_line(guest, instance.variant, quantity)
+        self.hold(instance.cart_id, instance.variant, quantity)
         instance.quantity = quantity
         instance.save(update_fields=['quantity'])
         return instance
@@ -141,9 +218,34 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
 
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """Order header plus line counts, for history lists."""
+
+    item_count = serializers.IntegerField(read_only=True)
+    total_quantity = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id',
+            'order_number',
+            'status',
+            'total_amount',
+            'payment_status',
+            'created_at',
+            'paid_at',
+            'item_count',
+            'total_quantity',
+        ]
+
+
 class CheckoutSerializer(serializers.Serializer):
     shipping_address = serializers.CharField()
     payment_method = serializers.CharField()
+    # Branch code to ship from when it can, e.g. the customer's nearest.
+    preferred_branch = serializers.SlugRelatedField(
+        slug_field='code', queryset=Branch.objects.all(), required=False, allow_null=True,
+    )
 
     def validate(self, attrs):
         user = self.context['request'].user
@@ -162,16 +264,13 @@ class CheckoutSerializer(serializers.Serializer):
         user = request.user
         cart = Cart.objects.select_for_update().get(user=user)
 
-        subtotal = 0
-        for item in cart.items.all():
-            available = get_available_stock(item.variant)
-            if item.quantity > available:
-                raise serializers.ValidationError(
-                    f"Not enough stock for {item.variant.sku}. Available: {available}."
-                )
-            subtotal += item.quantity * item.unit_price
-
-        discount_total = 0
+        items = list(cart.items.select_related('variant__product'))
+        subtotal = sum(item.quantity * item.unit_price for item in items)
+        priced = price_lines([
+            PricedLine(item.variant_id, item.variant.product_id, item.quantity, item.unit_price)
+            for item in items
+        ])
+        discount_total = sum(line.discount for line in priced)
         tax_total = 0
         total_amount = subtotal - discount_total + tax_total
 
@@ -191,8 +290,8 @@ class CheckoutSerializer(serializers.Serializer):
             shipping_address=validated_data['shipping_address'],
         )
 
-        for item in cart.items.all():
-            OrderItem.objects.create(
+        order_items = OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
                 variant=item.variant,
                 product_name=item.variant.product.name,
@@ -206,18 +305,32 @@ class CheckoutSerializer(serializers.Serializer):
                 quantity=item.quantity,
                 line_total=item.quantity * item.unit_price,
             )
-
-            remaining = item.quantity
-            for inv in InventoryItem.objects.filter(variant=item.variant).order_by('id'):
-                if remaining <= 0:
-                    break
-                available = inv.available_quantity
-                if available <= 0:
-                    continue
-                deduct = min(available, remaining)
-                inv.quantity -= deduct
-                inv.save(update_fields=['quantity'])
-                remaining -= deduct
+            for item in items
+        ])
+
+        # The cart's holds become the order's, re-planned onto as few
+        # branches as possible and held until payment converts them (or the
+        # sweeper releases them). Raising rolls the order back.
+        preferred = validated_data.get('preferred_branch')
+        planner = FulfillmentPlanner(preferred.pk if preferred else None)
+        try:
+            holds = reservations.transfer(
+                reservations.cart_holder(cart.pk),
+                reservations.order_holder(order.order_number),
+                {item.variant_id: item.quantity for item in items},
+                planner=planner,
+            )
+        except InsufficientStock as exc:
+            item = next(item for item in items if item.variant_id in exc.shortfalls)
+            available = item.quantity - exc.shortfalls[item.variant_id]
+            raise serializers.ValidationError(
+                f"Not enough stock for {item.variant.sku}. Available: {available}."
+            )
+        OrderItemAllocation.record(
+            {item.variant_id: item.pk for item in order_items},
+            [(held.inventory_item_id, held.variant_id, held.quantity) for held in holds],
+            planner.branch_of,
+        )
 
         cart.items.all().delete()
 
@@ -245,4 +358,4 @@ class CheckoutSerializer(serializers.Serializer):
             raw_response={},
         )
 
-        return order
\ No newline at end of file
+        return order
@@ -1,3 +1,778 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from inventory.availability import available_stock
+from inventory import reservations
+from inventory.models import Branch, InventoryItem, StockReservation
+from products.models import Category, Brand, Product, ProductVariant, PromotionRule
+from products.pricing import get_promotion_index
+from users.models import EmailOTP
+from . import webhooks
+from .models import Cart, CartItem, Order, OrderItem, OrderItemAllocation, PaymentTransaction, WebhookEvent
+
+User = get_user_model()
+
+
+def clear_caches():
+    # Guest carts and idempotency keys would otherwise carry over between
+    # tests; the test runner keeps the state cache in local memory.
+    for alias in caches:
+        caches[alias].clear()
+
+
+class CheckoutPricingTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        category = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        self.product = Product.objects.create(
+            name='Phone', slug='phone', category=category, brand=brand, base_price=Decimal('100.00'),
+        )
+        self.variant = ProductVariant.objects.create(product=self.product, sku='PH-1', base_price=Decimal('100.00'))
+        branch = Branch.objects.create(name='Main', code='main')
+        InventoryItem.objects.create(branch=branch, variant=self.variant, quantity=10)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, variant=self.variant, quantity=3, unit_price=Decimal('100.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self):
+        return self.client.post(
+            '/api/cart/checkout/',
+            {'shipping_address': '1 Main Street', 'payment_method': 'aba_payway'},
+            format='json',
+        )
+
+    def test_checkout_applies_promotions(self):
+        PromotionRule.objects.create(
+            product=self.product, rule_type=PromotionRule.RuleType.BULK_TIER, min_qty=3, discount_percent=Decimal('10'),
+        )
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['subtotal'], '300.00')
+        self.assertEqual(response.json()['discount_total'], '30.00')
+        self.assertEqual(response.json()['total_amount'], '270.00')
+
+    def test_checkout_without_promotions(self):
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['discount_total'], '0.00')
+        self.assertEqual(response.json()['total_amount'], '300.00')
+
+
+class StockAvailabilityTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        get_promotion_index()
+        category = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        product = Product.objects.create(
+            name='Phone', slug='phone', category=category, brand=brand, base_price=Decimal('10.00'),
+        )
+        self.branches = [Branch.objects.create(name=f'Branch {i}', code=f'b{i}') for i in range(2)]
+        self.variants = [
+            ProductVariant.objects.create(product=product, sku=f'PH-{i}', base_price=Decimal('10.00')) for i in range(30)
+        ]
+        for variant in self.variants:
+            InventoryItem.objects.create(branch=self.branches[0], variant=variant, quantity=5, reserved_quantity=1)
+            # Over-reserved rows count as zero, not as negative stock.
+            InventoryItem.objects.create(branch=self.branches[1], variant=variant, quantity=1, reserved_quantity=3)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_available_stock_clamps_per_branch_in_one_query(self):
+        ids = [variant.id for variant in self.variants]
+        with self.assertNumQueries(1):
+            stock = available_stock([*ids, 0])
+        self.assertEqual(set(stock.values()), {4, 0})
+        self.assertEqual(stock[0], 0)
+
+    def checkout_statements(self, lines):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        for variant in self.variants[:lines]:
+            CartItem.objects.create(cart=cart, variant=variant, quantity=2, unit_price=Decimal('10.00'))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                '/api/cart/checkout/', {'shipping_address': 'x', 'payment_method': 'aba_payway'}, format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        return [query['sql'] for query in ctx.captured_queries]
+
+    def test_checkout_statement_count_does_not_grow_with_the_cart(self):
+        small = self.checkout_statements(1)
+        large = self.checkout_statements(30)
+        self.assertEqual(len(small), len(large))
+        stock = [sql for sql in large if 'inventory_inventoryitem' in sql]
+        # one planning read and one conditional UPDATE for all 30 lines
+        self.assertEqual(len(stock), 2)
+        # Stock is held for the orders until payment; variants[0] was
+        # checked out twice.
+        held = InventoryItem.objects.filter(branch=self.branches[0]).order_by('variant_id')
+        self.assertEqual(list(held.values_list('quantity', 'reserved_quantity')), [(5, 5)] + [(5, 3)] * 29)
+
+    def test_checkout_shortfall_rolls_back(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, variant=self.variants[0], quantity=5, unit_price=Decimal('10.00'))
+        response = self.client.post(
+            '/api/cart/checkout/', {'shipping_address': 'x', 'payment_method': 'aba_payway'}, format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Available: 4', str(response.json()))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(cart.items.count(), 1)
+
+    def test_cart_item_quantity_is_checked_against_availability(self):
+        variant = self.variants[0]
+        url = '/api/cart/items/'
+        self.assertEqual(self.client.post(url, {'variant_id': variant.id, 'quantity': 3}, format='json').status_code, 201)
+        response = self.client.post(url, {'variant_id': variant.id, 'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, 400)
+        item = CartItem.objects.get(cart__user=self.user)
+        self.assertEqual(self.client.patch(f'{url}{item.id}/', {'quantity': 4}, format='json').status_code, 200)
+        self.assertEqual(self.client.patch(f'{url}{item.id}/', {'quantity': 5}, format='json').status_code, 400)
+
+
+class CartReadPathTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        get_promotion_index()
+        category = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        self.product = Product.objects.create(
+            name='Phone', slug='phone', category=category, brand=brand, base_price=Decimal('10.00'),
+        )
+        self.variants = [
+            ProductVariant.objects.create(product=self.product, sku=f'PH-{i}', base_price=Decimal('10.00')) for i in range(12)
+        ]
+        branch = Branch.objects.create(name='Main', code='main')
+        for variant in self.variants:
+            InventoryItem.objects.create(branch=branch, variant=variant, quantity=6, reserved_quantity=1)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fill(self, lines):
+        for variant in self.variants[:lines]:
+            self.client.post('/api/cart/items/', {'variant_id': variant.id, 'quantity': 2}, format='json')
+
+    def test_cart_is_read_in_one_prefetching_query(self):
+        self.fill(1)
+        with self.assertNumQueries(2):  # the cart with SQL totals, then its lines
+            self.client.get('/api/cart/')
+        self.fill(12)
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/cart/').json()
+        self.assertEqual(data['total_items'], 24 + 2)
+        self.assertEqual(data['total_amount'], 260)
+
+    def test_lines_carry_availability_and_promo_price(self):
+        PromotionRule.objects.create(
+            product=self.product, rule_type=PromotionRule.RuleType.PERCENT_DISCOUNT, discount_percent=Decimal('10'),
+        )
+        get_promotion_index()
+        self.fill(2)
+        data = self.client.get('/api/cart/').json()
+        line = data['items'][0]
+        # 5 free units, of which this cart holds 2.
+        self.assertEqual(line['available_quantity'], 5)
+        self.assertEqual(line['promo_price'], '9.00')
+        self.assertEqual(line['discount'], '2.00')
+        self.assertEqual(data['discount_total'], 4)
+
+    def test_cart_is_looked_up_once_per_item_request(self):
+        self.fill(1)
+        item = CartItem.objects.get()
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.patch(f'/api/cart/items/{item.id}/', {'quantity': 3}, format='json')
+        carts = [query for query in ctx.captured_queries if 'FROM "cart_cart"' in query['sql']]
+        self.assertEqual(len(carts), 1)
+
+
+class ReservationFlowTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        get_promotion_index()
+        category = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        product = Product.objects.create(
+            name='Phone', slug='phone', category=category, brand=brand, base_price=Decimal('10.00'),
+        )
+        self.variant = ProductVariant.objects.create(product=product, sku='PH-1', base_price=Decimal('10.00'))
+        self.stock = InventoryItem.objects.create(
+            branch=Branch.objects.create(name='Main', code='main'), variant=self.variant, quantity=4,
+        )
+        self.buyer, self.rival = (
+            User.objects.create_user(username=name, email=f'{name}@example.com') for name in ('buyer', 'rival')
+        )
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def add(self, user, quantity):
+        return self.client_for(user).post('/api/cart/items/', {'variant_id': self.variant.id, 'quantity': quantity}, format='json')
+
+    def pay(self, number):
+        response = APIClient().post('/api/cart/webhooks/payway/', {'tran_id': number, 'status': 0}, format='json')
+        webhooks.drain()
+        return response
+
+    def assertStock(self, quantity, reserved):
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.quantity, self.stock.reserved_quantity), (quantity, reserved))
+
+    def test_cart_lines_hold_stock_from_other_shoppers(self):
+        self.assertEqual(self.add(self.buyer, 3).status_code, 201)
+        self.assertStock(4, 3)
+        response = self.add(self.rival, 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Only 1 items available', str(response.json()))
+        # Growing your own line re-holds it rather than counting it twice.
+        item = CartItem.objects.get(cart__user=self.buyer)
+        self.assertEqual(self.client_for(self.buyer).patch(f'/api/cart/items/{item.id}/', {'quantity': 4}, format='json').status_code, 200)
+        self.assertStock(4, 4)
+        self.assertEqual(self.client_for(self.buyer).delete(f'/api/cart/items/{item.id}/').status_code, 204)
+        self.assertStock(4, 0)
+
+    def test_holds_follow_the_order_and_convert_at_payment(self):
+        self.add(self.buyer, 3)
+        response = self.client_for(self.buyer).post(
+            '/api/cart/checkout/', {'shipping_address': 'x', 'payment_method': 'aba_payway'}, format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        number = response.json()['order_number']
+        self.assertStock(4, 3)
+        self.assertEqual(reservations.active(reservations.order_holder(number)).count(), 1)
+
+        for _ in range(2):  # PayWay may deliver the same callback twice
+            self.assertEqual(self.pay(number).status_code, 200)
+        self.assertStock(1, 0)
+        self.assertEqual(Order.objects.get(order_number=number).status, Order.Status.PAID)
+
+    def test_expired_holds_are_swept_and_paid_orders_take_free_stock(self):
+        self.add(self.buyer, 3)
+        response = self.client_for(self.buyer).post(
+            '/api/cart/checkout/', {'shipping_address': 'x', 'payment_method': 'aba_payway'}, format='json',
+        )
+        number = response.json()['order_number']
+        self.assertEqual(reservations.sweep_expired(now=timezone.now() + timedelta(hours=1)), 1)
+        self.assertStock(4, 0)
+        self.pay(number)
+        self.assertStock(1, 0)
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        get_promotion_index()
+        category = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        product = Product.objects.create(
+            name='Phone', slug='phone', category=category, brand=brand, base_price=Decimal('10.00'),
+        )
+        self.variants = [
+            ProductVariant.objects.create(product=product, sku=f'PH-{i}', base_price=Decimal('10.00')) for i in range(2)
+        ]
+        branch = Branch.objects.create(name='Main', code='main')
+        for variant in self.variants:
+            InventoryItem.objects.create(branch=branch, variant=variant, quantity=5)
+        self.client = APIClient()
+
+    def add(self, variant, quantity, session=None):
+        headers = {'HTTP_X_CART_SESSION': session} if session else {}
+        return self.client.post('/api/cart/items/', {'variant_id': variant.id, 'quantity': quantity}, format='json', **headers)
+
+    def test_guest_cart_lives_in_the_cache_and_holds_stock(self):
+        response = self.add(self.variants[0], 2)
+        self.assertEqual(response.status_code, 201)
+        session = response['X-Cart-Session']
+        self.assertEqual(self.add(self.variants[0], 1, session).status_code, 201)
+        self.assertEqual(self.add(self.variants[1], 9, session).status_code, 400)
+
+        cart = self.client.get('/api/cart/', HTTP_X_CART_SESSION=session).json()
+        self.assertEqual(cart['session_id'], session)
+        self.assertEqual(cart['total_items'], 3)
+        self.assertEqual([item['id'] for item in cart['items']], [self.variants[0].id])
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(InventoryItem.objects.get(variant=self.variants[0]).reserved_quantity, 3)
+
+        response = self.client.delete(f'/api/cart/items/{self.variants[0].id}/', HTTP_X_CART_SESSION=session)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/cart/', HTTP_X_CART_SESSION=session).json()['total_items'], 0)
+        self.assertEqual(InventoryItem.objects.get(variant=self.variants[0]).reserved_quantity, 0)
+
+    def test_suite_never_touches_the_real_state_cache(self):
+        self.assertIsInstance(caches['state'], LocMemCache)
+
+    def test_guest_carts_use_the_shared_state_cache(self):
+        session = self.add(self.variants[0], 2)['X-Cart-Session']
+        self.assertIsNone(caches['default'].get(f'guest-cart:{session}'))
+        self.assertTrue(caches['state'].get(f'guest-cart:dirty-mark:{session}'))
+        # The flush command runs in its own process; only what is in the
+        # shared cache, not in this process's memory, reaches it.
+        caches['default'].clear()
+        call_command('flush_guest_carts', stdout=StringIO())
+        self.assertTrue(Cart.objects.filter(session_id=session).exists())
+
+    def test_carts_marked_while_a_flush_reads_the_dirty_set_are_not_lost(self):
+        first = self.add(self.variants[0], 1)['X-Cart-Session']
+        state = caches['state']
+        read_dirty_sets = state.get_many
+        racing = []
+
+        def get_many(keys):
+            found = read_dirty_sets(keys)
+            if not racing:
+                racing.append(self.add(self.variants[1], 1)['X-Cart-Session'])
+                self.add(self.variants[1], 2, first)
+            return found
+
+        with mock.patch.object(state, 'get_many', get_many):
+            call_command('flush_guest_carts', stdout=StringIO())
+        self.assertFalse(Cart.objects.filter(session_id=racing[0]).exists())
+
+        call_command('flush_guest_carts', stdout=StringIO())
+        self.assertTrue(Cart.objects.filter(session_id=racing[0]).exists())
+        persisted = Cart.objects.get(session_id=first)
+        self.assertEqual(sorted(persisted.items.values_list('quantity', flat=True)), [1, 2])
+
+    def test_flush_persists_write_behind_and_survives_a_cache_loss(self):
+        session = self.add(self.variants[0], 2)['X-Cart-Session']
+        self.add(self.variants[1], 1, session)
+        call_command('flush_guest_carts', stdout=StringIO())
+        persisted = Cart.objects.get(session_id=session, user__isnull=True)
+        self.assertEqual(sorted(persisted.items.values_list('quantity', flat=True)), [1, 2])
+
+        clear_caches()
+        cart = self.client.get('/api/cart/', HTTP_X_CART_SESSION=session).json()
+        self.assertEqual(cart['total_items'], 3)
+
+    def test_login_merges_the_guest_cart_in_one_upsert(self):
+        session = self.add(self.variants[0], 2)['X-Cart-Session']
+        self.add(self.variants[1], 1, session)
+        user = User.objects.create_user(username='buyer@example.com', email='buyer@example.com')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, variant=self.variants[0], quantity=1, unit_price=Decimal('10.00'))
+
+        otp = EmailOTP.create_new(email='buyer@example.com', purpose=EmailOTP.Purpose.LOGIN)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                '/api/users/auth/verify-otp/',
+                {'email': 'buyer@example.com', 'code': otp.code, 'purpose': 'LOGIN'},
+                format='json', HTTP_X_CART_SESSION=session,
+            )
+        self.assertEqual(response.status_code, 200)
+        writes = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith('INSERT INTO "cart_cartitem"')]
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(
+            dict(cart.items.values_list('variant_id', 'quantity')), {self.variants[0].id: 3, self.variants[1].id: 1},
+        )
+        held = dict(
+            StockReservation.objects.filter(holder=reservations.cart_holder(cart.pk), status='ACTIVE')
+            .values_list('variant_id', 'quantity')
+        )
+        self.assertEqual(held, {self.variants[0].id: 3, self.variants[1].id: 1})
+        self.assertIsNone(caches['state'].get(f'guest-cart:{session}'))
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        get_promotion_index()
+        category = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        product = Product.objects.create(
+            name='Phone', slug='phone', category=category, brand=brand, base_price=Decimal('10.00'),
+        )
+        self.variant = ProductVariant.objects.create(product=product, sku='PH-1', base_price=Decimal('10.00'))
+        InventoryItem.objects.create(branch=Branch.objects.create(name='Main', code='main'), variant=self.variant, quantity=5)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, key, address='x'):
+        return self.client.post(
+            '/api/cart/checkout/', {'shipping_address': address, 'payment_method': 'aba_payway'},
+            format='json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retried_checkout_replays_without_touching_stock(self):
+        self.client.post('/api/cart/items/', {'variant_id': self.variant.id, 'quantity': 2}, format='json')
+        first = self.checkout('retry-1')
+        self.assertEqual(first.status_code, 201)
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.checkout('retry-1')
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertFalse(ctx.captured_queries)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(PaymentTransaction.objects.count(), 1)
+
+    def test_key_reuse_with_another_body_is_rejected(self):
+        self.client.post('/api/cart/items/', {'variant_id': self.variant.id, 'quantity': 2}, format='json')
+        self.checkout('retry-2')
+        self.assertEqual(self.checkout('retry-2', address='elsewhere').status_code, 422)
+
+    def test_retry_while_in_flight_conflicts(self):
+        with mock.patch.object(caches['state'], 'add', return_value=False):
+            self.assertEqual(self.checkout('retry-3').status_code, 409)
+
+    def test_result_stored_just_before_the_lock_is_replayed(self):
+        self.client.post('/api/cart/items/', {'variant_id': self.variant.id, 'quantity': 2}, format='json')
+        first = self.checkout('retry-4')
+        real_get = caches['state'].get
+        reads = []
+
+        def stale_first_read(key, *args, **kwargs):
+            # The retry read the cache before the first request stored its
+            # result; by the time it takes the lock the result is there.
+            reads.append(key)
+            return None if len(reads) == 1 else real_get(key, *args, **kwargs)
+
+        with mock.patch.object(caches['state'], 'get', side_effect=stale_first_read):
+            second = self.checkout('retry-4')
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_retried_cart_item_create_adds_once(self):
+        for _ in range(2):
+            response = self.client.post(
+                '/api/cart/items/', {'variant_id': self.variant.id, 'quantity': 2}, format='json', HTTP_IDEMPOTENCY_KEY='add-1',
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+
+
+    def test_guest_retries_replay_only_within_their_session(self):
+        self.client.logout()
+        add = {'variant_id': self.variant.id, 'quantity': 1}
+        session = self.client.post('/api/cart/items/', add, format='json')['X-Cart-Session']
+        for _ in range(2):
+            response = self.client.post(
+                '/api/cart/items/', add, format='json', HTTP_IDEMPOTENCY_KEY='guest-1', HTTP_X_CART_SESSION=session,
+            )
+            self.assertEqual(response['X-Cart-Session'], session)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.client.get('/api/cart/', HTTP_X_CART_SESSION=session).json()['total_items'], 2)
+
+        # Without a session two strangers' keys are not each other's.
+        for _ in range(2):
+            response = self.client.post('/api/cart/items/', add, format='json', HTTP_IDEMPOTENCY_KEY='guest-2')
+            self.assertEqual(response.status_code, 201)
+            self.assertFalse(response.has_header('Idempotent-Replayed'))
+            fresh = response['X-Cart-Session']
+            self.assertEqual(self.client.get('/api/cart/', HTTP_X_CART_SESSION=fresh).json()['total_items'], 1)
+
+class WebhookInboxTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        get_promotion_index()
+        category = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        product = Product.objects.create(
+            name='Phone', slug='phone', category=category, brand=brand, base_price=Decimal('10.00'),
+        )
+        self.variant = ProductVariant.objects.create(product=product, sku='PH-1', base_price=Decimal('10.00'))
+        self.stock = InventoryItem.objects.create(
+            branch=Branch.objects.create(name='Main', code='main'), variant=self.variant, quantity=50,
+        )
+        self.orders = []
+        for i in range(6):
+            user = User.objects.create_user(username=f'buyer{i}', email=f'buyer{i}@example.com')
+            client = APIClient()
+            client.force_authenticate(user)
+            client.post('/api/cart/items/', {'variant_id': self.variant.id, 'quantity': 2}, format='json')
+            response = client.post('/api/cart/checkout/', {'shipping_address': 'x', 'payment_method': 'aba_payway'}, format='json')
+            self.orders.append(response.json()['order_number'])
+        self.gateway = APIClient()
+
+    def deliver(self, number, code=0):
+        return self.gateway.post('/api/cart/webhooks/payway/', {'tran_id': number, 'status': code}, format='json')
+
+    def test_callbacks_are_acknowledged_without_processing(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.deliver(self.orders[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), 1)  # the INSERT
+        self.assertEqual(Order.objects.get(order_number=self.orders[0]).status, Order.Status.PENDING)
+        self.assertEqual(webhooks.inbox_metrics()['pending'], 1)
+
+    def test_form_encoded_callback_is_applied(self):
+        response = self.gateway.post('/api/cart/webhooks/payway/', {'tran_id': self.orders[0], 'status': '0'})
+        self.assertEqual(response.status_code, 200)
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.payload, {'tran_id': self.orders[0], 'status': '0'})
+        webhooks.drain()
+        order = Order.objects.select_related('payment').get(order_number=self.orders[0])
+        self.assertEqual(order.status, Order.Status.PAID)
+        self.assertEqual(order.payment.status, PaymentTransaction.Status.SUCCESS)
+
+    def test_duplicates_collapse_and_batches_apply_in_bulk(self):
+        for number in self.orders:
+            self.deliver(number)
+            self.deliver(number)  # redelivery
+        self.deliver(self.orders[0], code=1)  # late failure for a paid order
+        self.deliver('UNKNOWN')
+        self.assertEqual(WebhookEvent.objects.count(), len(self.orders) + 2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            handled = webhooks.drain(batch_size=50)
+        self.assertEqual(handled, len(self.orders) + 2)
+        # one claimed batch of 8 events, applied with a fixed statement count
+        self.assertLess(len(ctx.captured_queries), 25)
+
+        self.assertEqual(Order.objects.filter(status=Order.Status.PAID).count(), len(self.orders))
+        self.assertEqual(PaymentTransaction.objects.filter(status='SUCCESS').count(), len(self.orders))
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.quantity, self.stock.reserved_quantity), (50 - 12, 0))
+
+        metrics = webhooks.inbox_metrics()
+        self.assertEqual((metrics['pending'], metrics['failed'], metrics['processed_recently']), (0, 1, 7))
+
+        # Processing the same payment again later changes nothing.
+        WebhookEvent.objects.filter(tran_id=self.orders[0], payload__status=0).update(status='PENDING', claimed_at=None)
+        webhooks.drain()
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 50 - 12)
+
+    def test_failing_batches_are_retried_then_parked(self):
+        self.deliver(self.orders[0])
+        with mock.patch.object(webhooks, 'apply_batch', side_effect=RuntimeError('boom')), \
+                self.assertLogs('cart.webhooks', 'ERROR'):
+            for attempt in range(webhooks.MAX_ATTEMPTS):
+                self.assertEqual(webhooks.drain(), 0)
+                # retried once the claim lease has run out
+                self.assertFalse(webhooks.claim_batch())
+                WebhookEvent.objects.update(claimed_at=timezone.now() - webhooks.CLAIM_LEASE * 2)
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts, event.error), ('FAILED', webhooks.MAX_ATTEMPTS, 'boom'))
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='history', email='history@example.com')
+        category = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        product = Product.objects.create(
+            name='Phone', slug='phone', category=category, brand=brand, base_price=Decimal('10.00'),
+        )
+        self.variants = [
+            ProductVariant.objects.create(product=product, sku=f'PH-{i}', base_price=Decimal('10.00'))
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_orders(self, count, created_at=None):
+        created_at = created_at or timezone.now()
+        start = Order.objects.count()
+        orders = Order.objects.bulk_create(
+            Order(user=self.user, order_number=f'H{start + i:05d}', total_amount=Decimal('30.00'))
+            for i in range(count)
+        )
+        # Several orders share a timestamp so the id tiebreaker is exercised.
+        Order.objects.filter(pk__in=[order.pk for order in orders]).update(created_at=created_at)
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order, variant=variant, product_name='Phone', variant_sku=variant.sku,
+                unit_price=Decimal('10.00'), quantity=i + 1, line_total=Decimal('10.00') * (i + 1),
+            )
+            for order in orders
+            for i, variant in enumerate(self.variants)
+        )
+        return orders
+
+    def test_list_query_count_does_not_grow_with_orders(self):
+        self.add_orders(2)
+        with self.assertNumQueries(2):  # orders, then items with their variants
+            response = self.client.get('/api/cart/orders/')
+        self.assertEqual(len(response.json()['results']), 2)
+        self.add_orders(10)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/cart/orders/')
+        self.assertEqual(len(response.json()['results']), 12)
+        self.assertEqual(len(response.json()['results'][0]['items']), 3)
+
+    def test_history_is_paginated_by_default(self):
+        self.add_orders(30)
+        for url in ('/api/cart/orders/', '/api/cart/orders/?summary=1'):
+            body = self.client.get(url).json()
+            self.assertEqual(len(body['results']), 24, url)
+            self.assertIsNotNone(body['next'], url)
+
+    def test_keyset_pages_walk_every_order_once(self):
+        self.add_orders(4, timezone.now() - timedelta(days=1))
+        self.add_orders(3)
+        expected = list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        seen = []
+        url = '/api/cart/orders/?page_size=3'
+        while url:
+            with self.assertNumQueries(2):
+                body = self.client.get(url).json()
+            seen.extend(order['id'] for order in body['results'])
+            url = body['next']
+        self.assertEqual(seen, expected)
+
+    def test_summary_lists_headers_and_counts_only(self):
+        self.add_orders(3)
+        with self.assertNumQueries(1):
+            body = self.client.get('/api/cart/orders/?summary=1&page_size=2').json()
+        first = body['results'][0]
+        self.assertNotIn('items', first)
+        self.assertEqual(first['item_count'], 3)
+        self.assertEqual(first['total_quantity'], 6)
+        self.assertIsNotNone(body['next'])
+
+        detail = self.client.get(f"/api/cart/orders/{first['id']}/?summary=1").json()
+        self.assertEqual(len(detail['items']), 3)
+
+    def test_other_users_orders_are_hidden(self):
+        self.add_orders(1)
+        stranger = APIClient()
+        stranger.force_authenticate(User.objects.create_user(username='stranger', email='s@example.com'))
+        self.assertEqual(stranger.get('/api/cart/orders/?summary=1').json()['results'], [])
+
+
+class CheckoutAllocationTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        category = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        product = Product.objects.create(
+            name='Phone', slug='phone', category=category, brand=brand, base_price=Decimal('10.00'),
+        )
+        self.phone, self.case = (
+            ProductVariant.objects.create(product=product, sku=sku, base_price=Decimal('10.00')) for sku in ('PH', 'CS')
+        )
+        self.north, self.south = (Branch.objects.create(name=code, code=code) for code in ('north', 'south'))
+        for branch in (self.north, self.south):
+            InventoryItem.objects.create(branch=branch, variant=self.phone, quantity=5)
+        InventoryItem.objects.create(branch=self.south, variant=self.case, quantity=5)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='buyer', email='buyer@example.com'))
+
+    def checkout(self, **extra):
+        # Cart holds go to the lowest-id branch rows, i.e. north for the phone.
+        for variant in (self.phone, self.case):
+            self.client.post('/api/cart/items/', {'variant_id': variant.id, 'quantity': 2}, format='json')
+        return self.client.post(
+            '/api/cart/checkout/', {'shipping_address': 'x', 'payment_method': 'aba_payway', **extra}, format='json',
+        )
+
+    def allocations(self):
+        return set(OrderItemAllocation.objects.values_list('order_item__variant_id', 'branch_id', 'quantity'))
+
+    def test_order_is_reallocated_to_one_branch_and_recorded_per_line(self):
+        self.assertEqual(self.checkout().status_code, 201)
+        self.assertEqual(self.allocations(), {(self.phone.id, self.south.id, 2), (self.case.id, self.south.id, 2)})
+        reserved = dict(InventoryItem.objects.filter(variant=self.phone).values_list('branch_id', 'reserved_quantity'))
+        self.assertEqual(reserved, {self.north.id: 0, self.south.id: 2})
+
+    def test_preferred_branch_is_used_when_it_costs_no_extra_branch(self):
+        InventoryItem.objects.create(branch=self.north, variant=self.case, quantity=5)
+        self.assertEqual(self.checkout(preferred_branch='south').status_code, 201)
+        self.assertEqual({branch for _, branch, _ in self.allocations()}, {self.south.id})
+
+    def test_payment_reallocates_lines_whose_holds_lapsed(self):
+        self.assertEqual(self.checkout().status_code, 201)
+        order = Order.objects.get()
+        reservations.release(reservations.active(reservations.order_holder(order.order_number)))
+        InventoryItem.objects.filter(branch=self.south, variant=self.phone).update(quantity=1)
+
+        self.assertEqual(order.commit_stock(), {})
+        self.assertEqual(self.allocations(), {(self.phone.id, self.north.id, 2), (self.case.id, self.south.id, 2)})
+        stock = dict(InventoryItem.objects.filter(variant=self.phone).values_list('branch_id', 'quantity'))
+        self.assertEqual(stock, {self.north.id: 3, self.south.id: 1})
+
+    def test_payment_keeps_allocations_of_converted_holds(self):
+        self.assertEqual(self.checkout().status_code, 201)
+        recorded = set(OrderItemAllocation.objects.values_list('pk', flat=True))
+        self.assertEqual(Order.objects.get().commit_stock(), {})
+        self.assertEqual(set(OrderItemAllocation.objects.values_list('pk', flat=True)), recorded)
+
+    def test_unknown_preferred_branch_is_rejected(self):
+        response = self.checkout(preferred_branch='nowhere')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('preferred_branch', response.json())
+        self.assertFalse(Order.objects.exists())
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+        category = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        product = Product.objects.create(
+            name='Phone', slug='phone', category=category, brand=brand, base_price=Decimal('10.00'),
+        )
+        self.variant = ProductVariant.objects.create(product=product, sku='HOT', base_price=Decimal('10.00'))
+        for code, quantity in (('a', 3), ('b', 2)):
+            branch = Branch.objects.create(name=code, code=code)
+            InventoryItem.objects.create(branch=branch, variant=self.variant, quantity=quantity)
+        self.users = []
+        for i in range(8):
+            user = User.objects.create_user(username=f'buyer{i}', email=f'buyer{i}@example.com')
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, variant=self.variant, quantity=1, unit_price=Decimal('10.00'))
+            self.users.append(user)
+
+    def test_concurrent_checkouts_never_oversell(self):
+        barrier = threading.Barrier(len(self.users))
+        statuses, statements = [], []
+
+        def checkout(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                with CaptureQueriesContext(connections['default']) as ctx:
+                    response = client.post(
+                        '/api/cart/checkout/', {'shipping_address': 'x', 'payment_method': 'aba_payway'}, format='json',
+                    )
+                statuses.append(response.status_code)
+                statements.append(len(ctx.captured_queries))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [201] * 5 + [400] * 3)
+        self.assertEqual(Order.objects.count(), 5)
+        # All five units are held for the five pending orders.
+        self.assertEqual(sum(InventoryItem.objects.values_list('reserved_quantity', flat=True)), 5)
+        self.assertEqual(sum(InventoryItem.objects.values_list('quantity', flat=True)), 5)
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.Status.ACTIVE).count(), 5)
+        # A successful checkout runs a fixed number of statements (20 here,
+        # including a cold promotion index); the margin covers the
+        # row-by-row fallback when a batched decrement races.
+        self.assertLessEqual(max(statements), 23)
+
+
+class WebhookWorkerPoolTests(TransactionTestCase):
+    def test_workers_never_take_the_same_event(self):
+        for i in range(40):
+            webhooks.ingest('aba_payway', f'MISSING{i}', {'tran_id': f'MISSING{i}', 'status': 0})
+        self.assertEqual(webhooks.drain(workers=4, batch_size=5), 40)
+        self.assertEqual(set(WebhookEvent.objects.values_list('attempts', flat=True)), {1})
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CartView, CartItemViewSet, CheckoutView, OrderViewSet, ABAPayWayWebhookView
+from .views import CartView, CartItemViewSet, CheckoutView, OrderViewSet, ABAPayWayWebhookView, WebhookMetricsView
 
 router = DefaultRouter()
 router.register('items', CartItemViewSet, basename='cart-item')
@@ -10,5 +10,6 @@ urlpatterns = [
     path('', CartView.as_view(), name='cart-detail'),
     path('checkout/', CheckoutView.as_view(), name='checkout'),
     path('webhooks/payway/', ABAPayWayWebhookView.as_view(), name='payway-webhook'),
+    path('webhooks/metrics/', WebhookMetricsView.as_view(), name='webhook-metrics'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,39 +1,104 @@
 from django.shortcuts import render
 
 # Create your views here.
+from django.db import transaction
+from django.db.models import Count, Prefetch, Sum
+from django.db.models.functions import Coalesce
+from django.http import Http404
 from rest_framework import views, viewsets, permissions, status
 from rest_framework.response import Response
-from .models import Cart, CartItem, Order
+from backend.idempotency import idempotent
+from inventory import reservations
+from products.pagination import KeysetCursorPagination
+from . import webhooks
+from .guest import SESSION_HEADER, GuestCart, get_session_id, new_session_id
+from .models import Cart, CartItem, Order, OrderItem
 from .serializers import (
+    guest_cart_data,
     CartSerializer,
     CartItemSerializer,
     CartItemCreateUpdateSerializer,
     CheckoutSerializer,
     OrderSerializer,
+    OrderSummarySerializer,
 )
 
 
-def get_user_cart(user) -> Cart:
-    cart, _ = Cart.objects.get_or_create(user=user)
-    return cart
+def get_user_cart(request) -> Cart:
+    """The user's cart, looked up once per request."""
+    if not hasattr(request, '_cart'):
+        request._cart, _ = Cart.objects.get_or_create(user=request.user)
+    return request._cart
 
 
-class CartView(views.APIView):
-    permission_classes = [permissions.IsAuthenticated]
+def get_cart_with_lines(user) -> Cart:
+    try:
+        return Cart.objects.with_lines().get(user=user)
+    except Cart.DoesNotExist:
+        Cart.objects.get_or_create(user=user)
+        return Cart.objects.with_lines().get(user=user)
+
+
+def get_guest_cart(request):
+    """The anonymous visitor's cart; a fresh session id is handed out if none was sent."""
+    session_id = get_session_id(request)
+    return GuestCart.load(session_id) if session_id else GuestCart(new_session_id())
+
+
+class GuestCartMixin:
+    """Serves anonymous visitors from a cache-held ``GuestCart``."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.guest = None if request.user.is_authenticated else get_guest_cart(request)
+
+    def idempotency_principal(self, request):
+        # Only a session the client sent tells guests apart; without one,
+        # every anonymous caller would share the same keys.
+        session_id = get_session_id(request)
+        return f'session:{session_id}' if session_id else None
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        guest = getattr(self, 'guest', None)
+        if guest is not None:
+            response[SESSION_HEADER] = guest.session_id
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class CartView(GuestCartMixin, views.APIView):
+    permission_classes = [permissions.AllowAny]
 
     def get(self, request):
-        cart = get_user_cart(request.user)
-        serializer = CartSerializer(cart)
+        if self.guest is not None:
+            return Response(guest_cart_data(self.guest))
+        serializer = CartSerializer(get_cart_with_lines(request.user))
         return Response(serializer.data)
 
 
-class CartItemViewSet(viewsets.ModelViewSet):
-    permission_classes = [permissions.IsAuthenticated]
+class CartItemViewSet(GuestCartMixin, viewsets.ModelViewSet):
+    permission_classes = [permissions.AllowAny]
     queryset = CartItem.objects.all()
 
+    def list(self, request, *args, **kwargs):
+        if self.guest is not None:
+            return Response(CartItemSerializer(self.guest.items(), many=True).data)
+        return super().list(request, *args, **kwargs)
+
+    @idempotent('cart-item')
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def get_object(self):
+        if self.guest is None:
+            return super().get_object()
+        # Guest lines are addressed by variant id.
+        for item in self.guest.items():
+            if str(item.id) == self.kwargs['pk']:
+                return item
+        raise Http404
+
     def get_queryset(self):
-        cart = get_user_cart(self.request.user)
-        return cart.items.select_related('variant', 'variant__product')
+        return CartItem.objects.for_display().filter(cart=get_user_cart(self.request)).order_by('id')
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -42,17 +107,31 @@ class CartItemViewSet(viewsets.ModelViewSet):
 
     def get_serializer_context(self):
         ctx = super().get_serializer_context()
-        ctx['cart'] = get_user_cart(self.request.user)
+        guest = getattr(self, 'guest', None)
+        if guest is not None:
+            ctx['guest'] = guest
+        else:
+            ctx['cart'] = get_user_cart(self.request)
         return ctx
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        if self.guest is not None:
+            self.guest.remove(instance.variant_id)
+            return
+        reservations.release(reservations.active(reservations.cart_holder(instance.cart_id), [instance.variant_id]))
+        instance.delete()
+
 
 class CheckoutView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent('checkout')
     def post(self, request):
         serializer = CheckoutSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
+        order = Order.objects.select_related('payment').prefetch_related('items__variant').get(pk=order.pk)
         order_data = OrderSerializer(order).data
 
         # Include payment URL if payment transaction exists
@@ -69,38 +148,53 @@ class ABAPayWayWebhookView(views.APIView):
         # In production, verify the hash/signature from PayWay first.
         data = request.data
         tran_id = data.get('tran_id')
-        status_code = data.get('status')  # PayWay usually uses 0 for success
 
         if not tran_id:
             return Response({"detail": "Missing tran_id"}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            order = Order.objects.get(order_number=tran_id)
-        except Order.DoesNotExist:
-            return Response({"detail": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        # Success
-        if str(status_code) == '0':
-            order.mark_paid()
-            payment = getattr(order, 'payment', None)
-            if payment:
-                payment.status = payment.Status.SUCCESS
-                payment.raw_response = data
-                payment.save(update_fields=['status', 'raw_response'])
-            return Response({"status": "ok"})
-
-        # Failure
-        payment = getattr(order, 'payment', None)
-        if payment:
-            payment.status = payment.Status.FAILED
-            payment.raw_response = data
-            payment.save(update_fields=['status', 'raw_response'])
-        return Response({"status": "failed"}, status=status.HTTP_400_BAD_REQUEST)
+        # Acknowledge right away; the process_webhooks worker applies it.
+        # Form-encoded callbacks arrive as a QueryDict; keep single values.
+        payload = data.dict() if hasattr(data, 'dict') else dict(data)
+        webhooks.ingest('aba_payway', str(tran_id), payload)
+        return Response({"status": "accepted"})
+
+
+class WebhookMetricsView(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(webhooks.inbox_metrics())
+
+
+class OrderHistoryPagination(KeysetCursorPagination):
+    # A customer's history only grows; never hand it out in one response.
+    always_paginate = True
 
 
 class OrderViewSet(viewsets.ReadOnlyModelViewSet):
+    """Order history, newest first.
+
+    Always paginated on ``(created_at, id)``, ``page_size`` orders a page
+    (24 by default). ``?summary=1`` lists header fields and line counts
+    only; the detail route always returns full lines.
+    """
+
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = OrderSerializer
+    pagination_class = OrderHistoryPagination
+    ordering_fields = ['created_at']
+    ordering = ['-created_at']
+
+    def is_summary(self):
+        return self.action == 'list' and self.request.query_params.get('summary') in ('1', 'true')
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).order_by('-created_at')
\ No newline at end of file
+        orders = Order.objects.filter(user=self.request.user)
+        if self.is_summary():
+            return orders.annotate(item_count=Count('items'), total_quantity=Coalesce(Sum('items__quantity'), 0))
+        return orders.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('variant').order_by('id')),
+        )
+
+    def get_serializer_class(self):
+        return OrderSummarySerializer if self.is_summary() else OrderSerializer
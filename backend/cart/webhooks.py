@@ -0,0 +1,194 @@
+"""Payment webhook inbox.
+
+The webhook view only stores the raw callback as a ``WebhookEvent`` and
+acknowledges it; one INSERT with the dedupe key
+``<gateway>:<tran_id>:<status>`` under a unique constraint, so repeated
+deliveries of the same outcome are dropped by the database.
+
+``drain`` runs a small worker pool over the inbox. Each worker claims a
+batch of pending events with a conditional UPDATE (so two workers never
+take the same event) and applies it in bulk:
+
+- orders are loaded in one query;
+- paid transitions are one conditional UPDATE on ``paid_at IS NULL``,
+  so an order already paid is never paid (or deducted) twice;
+- stock holds of the newly paid orders are settled in one pass;
+- payment rows are written with one ``bulk_update``.
+
+A batch that raises is retried after its claim lease runs out and is
+marked FAILED after ``MAX_ATTEMPTS``. ``inbox_metrics`` reports backlog depth and
+processing lag.
+"""
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connections, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .models import Order, PaymentTransaction, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+CLAIM_LEASE = timedelta(minutes=5)
+LAG_WINDOW = timedelta(minutes=15)
+
+Status = WebhookEvent.Status
+
+
+def is_success(payload):
+    return str(payload.get('status')) == '0'  # PayWay uses 0 for success
+
+
+def dedupe_key(gateway, tran_id, payload):
+    outcome = 'success' if is_success(payload) else f"status-{payload.get('status')}"
+    return f'{gateway}:{tran_id}:{outcome}'
+
+
+def ingest(gateway, tran_id, payload):
+    """Queue a callback in one INSERT; a repeated delivery is a no-op."""
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(gateway=gateway, tran_id=tran_id, payload=payload, dedupe_key=dedupe_key(gateway, tran_id, payload))],
+        ignore_conflicts=True,
+    )
+
+
+def claim_batch(batch_size=BATCH_SIZE, now=None):
+    """Claim up to ``batch_size`` pending events for this worker."""
+    now = now or timezone.now()
+    claimable = WebhookEvent.objects.filter(
+        Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_LEASE), status=Status.PENDING,
+    )
+    ids = list(claimable.order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # Still conditional on being claimable, so a racing worker's claim wins.
+    claimable.filter(pk__in=ids).update(claim_token=token, claimed_at=now)
+    return list(WebhookEvent.objects.filter(claim_token=token, status=Status.PENDING).order_by('id'))
+
+
+@transaction.atomic
+def apply_batch(events, now=None):
+    """Apply claimed events in bulk; returns how many were handled."""
+    now = now or timezone.now()
+    orders = {
+        order.order_number: order
+        for order in Order.objects.filter(order_number__in={event.tran_id for event in events}).select_related('payment')
+    }
+    paid, failed, unknown = {}, {}, []
+    for event in events:
+        order = orders.get(event.tran_id)
+        if order is None:
+            unknown.append(event.pk)
+        elif is_success(event.payload):
+            paid[order.pk] = (order, event)
+        else:
+            failed[order.pk] = (order, event)
+
+    if paid:
+        # Orders already paid (earlier batch, other worker) are skipped, so
+        # their stock is never committed twice.
+        unpaid = list(Order.objects.filter(pk__in=paid, paid_at__isnull=True).values_list('pk', flat=True))
+        Order.objects.filter(pk__in=unpaid, paid_at__isnull=True).update(
+            status=Order.Status.PAID, payment_status='PAID', paid_at=now,
+        )
+        shortfalls = Order.commit_stock_for([paid[pk][0] for pk in unpaid])
+        for order_id, short in shortfalls.items():
+            logger.warning("Order %s paid with stock short for variants %s", paid[order_id][0].order_number, short)
+
+    payments = []
+    for order, event in paid.values():
+        payment = getattr(order, 'payment', None)
+        if payment is not None:
+            payment.status = PaymentTransaction.Status.SUCCESS
+            payment.raw_response = event.payload
+            payments.append(payment)
+    for order_id, (order, event) in failed.items():
+        payment = getattr(order, 'payment', None)
+        # A late failure never overrides a payment that succeeded.
+        if payment is None or order_id in paid or payment.status == PaymentTransaction.Status.SUCCESS:
+            continue
+        payment.status = PaymentTransaction.Status.FAILED
+        payment.raw_response = event.payload
+        payments.append(payment)
+    if payments:
+        PaymentTransaction.objects.bulk_update(payments, ['status', 'raw_response'])
+
+    handled = WebhookEvent.objects.filter(pk__in=[event.pk for event in events])
+    handled.exclude(pk__in=unknown).update(status=Status.PROCESSED, processed_at=now, attempts=F('attempts') + 1)
+    if unknown:
+        handled.filter(pk__in=unknown).update(
+            status=Status.FAILED, processed_at=now, attempts=F('attempts') + 1, error="Order not found",
+        )
+    return len(events)
+
+
+def release_batch(events, error):
+    """Hand a failed batch back to the queue, or give up after ``MAX_ATTEMPTS``.
+
+    ``claimed_at`` is kept, so the batch is retried once its lease expires
+    rather than straight away.
+    """
+    ids = [event.pk for event in events]
+    WebhookEvent.objects.filter(pk__in=ids).update(attempts=F('attempts') + 1, error=error, claim_token='')
+    WebhookEvent.objects.filter(pk__in=ids, attempts__gte=MAX_ATTEMPTS).update(
+        status=Status.FAILED, processed_at=timezone.now(),
+    )
+
+
+def work(batch_size=BATCH_SIZE):
+    """Drain the inbox until it is empty; returns events handled."""
+    handled = 0
+    while True:
+        events = claim_batch(batch_size)
+        if not events:
+            return handled
+        try:
+            handled += apply_batch(events)
+        except Exception as exc:
+            logger.exception("Webhook batch failed")
+            release_batch(events, str(exc))
+
+
+def drain(workers=1, batch_size=BATCH_SIZE):
+    """Run ``workers`` threads over the inbox until it is empty."""
+    if workers <= 1:
+        return work(batch_size)
+
+    def run():
+        try:
+            return work(batch_size)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(lambda _: run(), range(workers)))
+
+
+def inbox_metrics(now=None):
+    """Backlog depth and processing lag, for monitoring."""
+    now = now or timezone.now()
+    backlog = WebhookEvent.objects.aggregate(
+        pending=Count('id', filter=Q(status=Status.PENDING)),
+        failed=Count('id', filter=Q(status=Status.FAILED)),
+        oldest_pending=Min('received_at', filter=Q(status=Status.PENDING)),
+    )
+    recent = list(
+        WebhookEvent.objects.filter(status=Status.PROCESSED, processed_at__gte=now - LAG_WINDOW)
+        .values_list('received_at', 'processed_at')
+    )
+    lags = sorted((processed - received).total_seconds() for received, processed in recent)
+    oldest = backlog['oldest_pending']
+    return {
+        'pending': backlog['pending'],
+        'failed': backlog['failed'],
+        'oldest_pending_age_seconds': round((now - oldest).total_seconds(), 3) if oldest else 0,
+        'processed_recently': len(lags),
+        'lag_seconds_p50': round(lags[len(lags) // 2], 3) if lags else None,
+        'lag_seconds_max': round(lags[-1], 3) if lags else None,
+    }
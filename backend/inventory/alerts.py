@@ -0,0 +1,160 @@
+"""Set-based stock alert scanning.
+
+An inventory row wants an OUT_OF_STOCK alert when nothing is available
+(``quantity - reserved_quantity <= 0``), a LOW alert when availability is
+at or below a non-zero ``min_threshold``, and no alert otherwise. ``scan``
+brings the active alerts in line with that, ``batch_size`` rows at a time
+in id order, with three statements per batch however many alerts change:
+
+- one SELECT classifies the rows and says whether the wanted alert is
+  already active;
+- one UPDATE resolves every active alert of any other type;
+- one bulk INSERT opens the missing alerts.
+
+Incremental scans only visit rows whose ``updated_at`` (stamped by every
+stock write, see ``inventory.stock.bump``) is at or after the previous
+finished scan's start, less ``STOCK_ALERT_SCAN_OVERLAP_SECONDS`` so a
+write that committed while that scan ran is not missed. Rescanning a row
+is harmless.
+
+Scans are queued as ``StockAlertScan`` rows by ``request_scan`` (the API)
+and run by the ``scan_stock_alerts`` command.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, CharField, Exists, F, OuterRef, Q, Value, When
+from django.utils import timezone
+
+from .models import InventoryItem, StockAlert, StockAlertScan
+
+SCAN_BATCH_SIZE = 500
+
+AlertType = StockAlert.AlertType
+Status = StockAlertScan.Status
+
+
+def scan_overlap():
+    return timedelta(seconds=getattr(settings, 'STOCK_ALERT_SCAN_OVERLAP_SECONDS', 60))
+
+
+def wanted_alert():
+    """The alert type a row should have, or NULL."""
+    return Case(
+        When(quantity__lte=F('reserved_quantity'), then=Value(AlertType.OUT_OF_STOCK)),
+        When(
+            Q(min_threshold__gt=0) & Q(quantity__lte=F('reserved_quantity') + F('min_threshold')),
+            then=Value(AlertType.LOW),
+        ),
+        default=Value(None),
+        output_field=CharField(),
+    )
+
+
+def classify(items):
+    """Annotate ``wanted`` and ``has_wanted`` (that alert is already active)."""
+    return items.annotate(wanted=wanted_alert()).annotate(
+        has_wanted=Exists(
+            StockAlert.objects.filter(inventory_item=OuterRef('pk'), is_resolved=False, alert_type=OuterRef('wanted')),
+        ),
+    )
+
+
+def reconcile(rows):
+    """Apply classified ``[(item_id, wanted, has_wanted)]``; returns ``(created, resolved)``."""
+    wanted_ids = defaultdict(list)
+    for item_id, wanted, _ in rows:
+        if wanted:
+            wanted_ids[wanted].append(item_id)
+    keep = Q()
+    for wanted, ids in wanted_ids.items():
+        keep |= Q(alert_type=wanted, inventory_item_id__in=ids)
+    resolved = (
+        StockAlert.objects.filter(is_resolved=False, inventory_item_id__in=[row[0] for row in rows])
+        .exclude(keep)
+        .update(is_resolved=True)
+    )
+    created = StockAlert.objects.bulk_create([
+        StockAlert(inventory_item_id=item_id, alert_type=wanted)
+        for item_id, wanted, has_wanted in rows
+        if wanted and not has_wanted
+    ])
+    return len(created), resolved
+
+
+def scan(since=None, batch_size=SCAN_BATCH_SIZE):
+    """Reconcile alerts for rows changed at or after ``since`` (every row
+    when None). Returns ``(scanned, created, resolved)``."""
+    items = InventoryItem.objects.all()
+    if since is not None:
+        items = items.filter(updated_at__gte=since)
+    rows = classify(items).order_by('pk').values_list('pk', 'wanted', 'has_wanted')
+    scanned = created = resolved = last = 0
+    while True:
+        with transaction.atomic():
+            batch = list(rows.filter(pk__gt=last)[:batch_size])
+            if not batch:
+                return scanned, created, resolved
+            batch_created, batch_resolved = reconcile(batch)
+        last = batch[-1][0]
+        scanned += len(batch)
+        created += batch_created
+        resolved += batch_resolved
+
+
+def watermark():
+    """Where the next incremental scan starts; None means every row."""
+    last = (
+        StockAlertScan.objects.filter(status=Status.DONE)
+        .order_by('-started_at').values_list('started_at', flat=True).first()
+    )
+    return None if last is None else last - scan_overlap()
+
+
+def request_scan(full=False):
+    """Queue a scan unless one that covers it is already waiting; returns it."""
+    pending = StockAlertScan.objects.filter(status=Status.PENDING)
+    if full:
+        pending = pending.filter(full=True)
+    return pending.order_by('id').first() or StockAlertScan.objects.create(full=full)
+
+
+def claim_next():
+    """Claim the oldest queued scan, or None when nothing is queued."""
+    for scan_id in StockAlertScan.objects.filter(status=Status.PENDING).order_by('id').values_list('pk', flat=True):
+        # The conditional update makes sure only one worker runs it.
+        if StockAlertScan.objects.filter(pk=scan_id, status=Status.PENDING).update(
+            status=Status.RUNNING, started_at=timezone.now(),
+        ):
+            return StockAlertScan.objects.get(pk=scan_id)
+    return None
+
+
+def run(job, batch_size=SCAN_BATCH_SIZE):
+    """Run a claimed scan and record its outcome on it."""
+    job.since = None if job.full else watermark()
+    try:
+        job.scanned, job.alerts_created, job.alerts_resolved = scan(job.since, batch_size=batch_size)
+    except Exception as exc:
+        job.status, job.error, job.finished_at = Status.FAILED, str(exc), timezone.now()
+        job.save()
+        raise
+    job.status, job.finished_at = Status.DONE, timezone.now()
+    job.save()
+    return job
+
+
+def run_pending(batch_size=SCAN_BATCH_SIZE):
+    """Run every queued scan; returns them."""
+    jobs = []
+    while (job := claim_next()) is not None:
+        jobs.append(run(job, batch_size=batch_size))
+    return jobs
+
+
+def run_now(full=False, batch_size=SCAN_BATCH_SIZE):
+    """Run a scan straight away, without queueing it."""
+    job = StockAlertScan.objects.create(full=full, status=Status.RUNNING, started_at=timezone.now())
+    return run(job, batch_size=batch_size)
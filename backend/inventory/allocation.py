@@ -0,0 +1,134 @@
+"""Multi-branch fulfillment allocation.
+
+``plan_deduction`` takes each line from branch rows in id order, so an
+order can end up split over branches for no reason. ``FulfillmentPlanner``
+reads availability for every variant of the order across all branches in
+one query and picks the smallest set of branches that can ship the whole
+order, favouring the customer's preferred branch among equally small
+sets. Within that set each line is filled from the preferred branch
+first, then from the branch holding most of it.
+
+Picking the smallest set is a set-cover problem. Orders touch few
+branches, so sets are tried smallest first: exhaustively up to
+``EXACT_SEARCH_BRANCHES`` candidate branches, greedily beyond that.
+
+A planner is a drop-in ``planner`` for ``inventory.stock.deduct_stock``
+and ``reserve_stock``: it returns ``(plan, shortfalls)`` like
+``plan_deduction`` and remembers each planned row's branch in
+``branch_of``.
+"""
+from itertools import combinations
+
+from .models import InventoryItem
+
+EXACT_SEARCH_BRANCHES = 12
+
+
+def load_availability(variant_ids):
+    """Free stock of ``variant_ids`` in every branch, in one query.
+
+    Returns ``(stock, rows)``: ``{branch_id: {variant_id: available}}`` and
+    ``{(branch_id, variant_id): inventory_item_id}``.
+    """
+    stock, rows = {}, {}
+    for item_id, branch_id, variant_id, quantity, reserved in (
+        InventoryItem.objects.filter(variant_id__in=variant_ids)
+        .values_list('id', 'branch_id', 'variant_id', 'quantity', 'reserved_quantity')
+    ):
+        if quantity - reserved > 0:
+            stock.setdefault(branch_id, {})[variant_id] = quantity - reserved
+            rows[branch_id, variant_id] = item_id
+    return stock, rows
+
+
+def find_shortfalls(stock, need):
+    missing = {}
+    for variant_id, n in need.items():
+        total = sum(available.get(variant_id, 0) for available in stock.values())
+        if total < n:
+            missing[variant_id] = n - total
+    return missing
+
+
+def choose_branches(stock, need, preferred=frozenset()):
+    """The fewest branches of ``stock`` that together cover ``need``.
+
+    Among equally small sets, the one with more ``preferred`` branches
+    wins, then the one with lower ids. ``need`` must be coverable.
+    """
+    candidates = sorted(
+        branch_id for branch_id, available in stock.items() if any(variant_id in available for variant_id in need)
+    )
+
+    def covers(branches):
+        return all(
+            sum(stock[branch_id].get(variant_id, 0) for branch_id in branches) >= n
+            for variant_id, n in need.items()
+        )
+
+    if len(candidates) <= EXACT_SEARCH_BRANCHES:
+        for size in range(1, len(candidates) + 1):
+            fits = [combo for combo in combinations(candidates, size) if covers(combo)]
+            if fits:
+                return min(fits, key=lambda combo: (-len(preferred.intersection(combo)), combo))
+
+    # Too many branches to search: take whichever covers most of what is left.
+    chosen, remaining = [], dict(need)
+    while remaining:
+        best = max(
+            (branch_id for branch_id in candidates if branch_id not in chosen),
+            key=lambda branch_id: (
+                sum(min(stock[branch_id].get(variant_id, 0), n) for variant_id, n in remaining.items()),
+                branch_id in preferred,
+                -branch_id,
+            ),
+        )
+        chosen.append(best)
+        remaining = {
+            variant_id: n - stock[best].get(variant_id, 0)
+            for variant_id, n in remaining.items()
+            if n > stock[best].get(variant_id, 0)
+        }
+    return tuple(sorted(chosen))
+
+
+def fill(stock, need, branches, preferred=frozenset()):
+    """``{variant_id: [(branch_id, n), ...]}`` taking each line from ``branches``."""
+    lines = {}
+    for variant_id, n in need.items():
+        for branch_id in sorted(
+            branches, key=lambda branch_id: (branch_id not in preferred, -stock[branch_id].get(variant_id, 0), branch_id),
+        ):
+            take = min(stock[branch_id].get(variant_id, 0), n)
+            if take > 0:
+                lines.setdefault(variant_id, []).append((branch_id, take))
+                n -= take
+            if not n:
+                break
+    return lines
+
+
+class FulfillmentPlanner:
+    """Plans ``{variant_id: quantity}`` onto as few branches as possible."""
+
+    def __init__(self, preferred_branch=None):
+        self.preferred = {preferred_branch} if preferred_branch else set()
+        self.branch_of = {}  # {inventory_item_id: branch_id} for every planned row
+
+    def __call__(self, quantities):
+        need = {variant_id: n for variant_id, n in quantities.items() if n > 0}
+        stock, rows = load_availability(need)
+        shortfalls = find_shortfalls(stock, need)
+        if shortfalls:
+            return {}, shortfalls
+        branches = choose_branches(stock, need, self.preferred)
+        plan = {}
+        for variant_id, takes in fill(stock, need, branches, self.preferred).items():
+            for branch_id, n in takes:
+                item_id = rows[branch_id, variant_id]
+                plan[item_id] = (variant_id, n)
+                self.branch_of[item_id] = branch_id
+        # If a concurrent checkout beats us to some rows, the re-plan for
+        # what is missing should stay on the branches already in use.
+        self.preferred.update(branches)
+        return plan, {}
@@ -0,0 +1,44 @@
+"""Batched stock availability.
+
+Availability of a variant is the sum over branches of
+``max(0, quantity - reserved_quantity)``, the same clamp as
+``InventoryItem.available_quantity``, computed for many variants in one
+grouped query, or as a correlated subquery for annotating other models.
+"""
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import InventoryItem
+
+
+def available_expression(prefix=''):
+    return Greatest(
+        F(f'{prefix}quantity') - F(f'{prefix}reserved_quantity'), Value(0), output_field=IntegerField(),
+    )
+
+
+def available_stock(variant_ids):
+    """``{variant_id: available}`` for every id given; missing stock is 0."""
+    variant_ids = set(variant_ids)
+    stock = dict.fromkeys(variant_ids, 0)
+    if not variant_ids:
+        return stock
+    rows = (
+        InventoryItem.objects.filter(variant_id__in=variant_ids)
+        .values('variant_id')
+        .annotate(available=Sum(available_expression()))
+        .values_list('variant_id', 'available')
+    )
+    stock.update(rows)
+    return stock
+
+
+def available_subquery(variant_ref='variant_id'):
+    """Availability of ``OuterRef(variant_ref)``, for ``annotate()`` on other models."""
+    rows = (
+        InventoryItem.objects.filter(variant_id=OuterRef(variant_ref))
+        .order_by().values('variant_id')
+        .annotate(available=Sum(available_expression()))
+        .values('available')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
@@ -0,0 +1,21 @@
+"""values()-based rendering of inventory list rows, matching
+``InventoryItemSerializer``."""
+from backend.fastpath import Computed, RowMapper
+
+INVENTORY_ROW = RowMapper({
+    'id': 'id',
+    'branch': 'branch',
+    'variant': RowMapper({
+        'id': 'variant__id',
+        'sku': 'variant__sku',
+        'color': 'variant__color',
+        'storage': 'variant__storage',
+        'ram': 'variant__ram',
+    }),
+    'quantity': 'quantity',
+    'reserved_quantity': 'reserved_quantity',
+    'min_threshold': 'min_threshold',
+    'available_quantity': Computed(
+        lambda row: max(0, row['quantity'] - row['reserved_quantity']), 'quantity', 'reserved_quantity',
+    ),
+})
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from inventory import alerts
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued stock alert scans; with nothing queued, scan the rows changed since "
+        "the last scan. Run it every few minutes from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rescan every row, not just changed ones.")
+        parser.add_argument('--queued-only', action='store_true', help="Only run scans queued through the API.")
+        parser.add_argument('--batch-size', type=int, default=alerts.SCAN_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['full']:
+            alerts.request_scan(full=True)
+        jobs = alerts.run_pending(batch_size=batch_size)
+        if not jobs and not options['queued_only']:
+            jobs = [alerts.run_now(batch_size=batch_size)]
+        for job in jobs:
+            self.stdout.write(self.style.SUCCESS(
+                f"Scan {job.pk}: scanned {job.scanned} rows, opened {job.alerts_created} alerts, "
+                f"resolved {job.alerts_resolved}."
+            ))
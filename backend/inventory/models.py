@@ -32,15 +32,46 @@ class InventoryItem(models.Model):
     quantity = models.IntegerField(default=0)
     reserved_quantity = models.IntegerField(default=0)
     min_threshold = models.PositiveIntegerField(default=0)
+    # Advanced by every stock write; see inventory.stock.compare_and_swap.
+    version = models.PositiveIntegerField(default=0)
+    # Stamped by every stock write too; the alert scanner's watermark.
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('branch', 'variant')
+        indexes = [models.Index(fields=['updated_at', 'id'])]
 
     @property
     def available_quantity(self) -> int:
         return max(0, self.quantity - self.reserved_quantity)
 
 
+class StockReservation(models.Model):
+    """Units of one branch row held for a cart or a pending order."""
+
+    class Status(models.TextChoices):
+        ACTIVE = 'ACTIVE', 'Active'
+        RELEASED = 'RELEASED', 'Released'
+        CONVERTED = 'CONVERTED', 'Converted'
+
+    inventory_item = models.ForeignKey(InventoryItem, on_delete=models.CASCADE, related_name='reservations')
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='stock_reservations')
+    holder = models.CharField(max_length=64)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.ACTIVE)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['holder', 'status']),
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.variant_id} for {self.holder}"
+
+
 class StockImport(models.Model):
     branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='stock_imports')
     supplier = models.ForeignKey(Supplier, null=True, blank=True, on_delete=models.SET_NULL, related_name='stock_imports')
@@ -86,4 +117,32 @@ class StockAlert(models.Model):
     is_resolved = models.BooleanField(default=False)
 
     def __str__(self):
-        return f"{self.alert_type} for {self.inventory_item.variant.sku} @ {self.inventory_item.branch.code}"
\ No newline at end of file
+        return f"{self.alert_type} for {self.inventory_item.variant.sku} @ {self.inventory_item.branch.code}"
+
+
+class StockAlertScan(models.Model):
+    """One run of the stock alert scanner: queued by the API, run by the
+    ``scan_stock_alerts`` command (see ``inventory.alerts``)."""
+
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        RUNNING = 'RUNNING', 'Running'
+        DONE = 'DONE', 'Done'
+        FAILED = 'FAILED', 'Failed'
+
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    full = models.BooleanField(default=False)
+    since = models.DateTimeField(null=True, blank=True)  # rows changed before this were skipped
+    scanned = models.PositiveIntegerField(default=0)
+    alerts_created = models.PositiveIntegerField(default=0)
+    alerts_resolved = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'started_at'])]
+
+    def __str__(self):
+        return f"Alert scan {self.pk} ({self.status})"
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""Time-limited stock holds.
+
+A ``StockReservation`` row records units of one branch row held for a
+holder (``cart:<id>``, ``session:<guest session>`` or ``order:<number>``) until ``expires_at``. The
+held units are counted in ``InventoryItem.reserved_quantity``, so every
+availability check and every deduction already leaves them alone.
+
+Holds move through conditional updates only (see ``inventory.stock``):
+
+- ``hold`` reserves with one planning read and one ``CASE`` UPDATE;
+- ``release`` flips the rows to RELEASED and hands the units back with
+  one UPDATE per batch, whatever the number of lines;
+- ``convert`` settles an order's holds at payment, decrementing
+  ``quantity`` and ``reserved_quantity`` together.
+
+``sweep_expired`` is the periodic sweeper behind the
+``release_expired_reservations`` command.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import StockReservation
+from .stock import consume_reserved, release_reserved, reserve_stock
+
+SWEEP_BATCH_SIZE = 500
+
+Status = StockReservation.Status
+
+
+def cart_holder(cart_id):
+    return f'cart:{cart_id}'
+
+
+def session_holder(session_id):
+    return f'session:{session_id}'
+
+
+def order_holder(order_number):
+    return f'order:{order_number}'
+
+
+def cart_hold_ttl():
+    return timedelta(seconds=getattr(settings, 'CART_HOLD_SECONDS', 15 * 60))
+
+
+def order_hold_ttl():
+    return timedelta(seconds=getattr(settings, 'ORDER_HOLD_SECONDS', 30 * 60))
+
+
+def active(holder, variant_ids=None):
+    holds = StockReservation.objects.filter(holder=holder, status=Status.ACTIVE)
+    if variant_ids is not None:
+        holds = holds.filter(variant_id__in=variant_ids)
+    return holds
+
+
+def held_quantities(holder, variant_ids):
+    """``{variant_id: units}`` ``holder`` currently holds."""
+    rows = (
+        active(holder, variant_ids).order_by().values('variant_id')
+        .annotate(held=Sum('quantity')).values_list('variant_id', 'held')
+    )
+    return dict(rows)
+
+
+def held_subquery(holder, variant_ref='variant_id'):
+    """Units ``holder`` (a value or expression) holds of ``OuterRef(variant_ref)``."""
+    rows = (
+        StockReservation.objects.filter(holder=holder, status=Status.ACTIVE, variant_id=OuterRef(variant_ref))
+        .order_by().values('variant_id')
+        .annotate(held=Sum('quantity'))
+        .values('held')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def hold(holder, quantities, ttl, planner=None):
+    """Reserve ``{variant_id: quantity}`` for ``holder``; raises ``InsufficientStock``.
+
+    Call inside a transaction so a shortfall leaves nothing reserved.
+    ``planner`` chooses the branch rows, lowest id first by default.
+    """
+    taken = reserve_stock(quantities, planner=planner)
+    expires_at = timezone.now() + ttl
+    return StockReservation.objects.bulk_create([
+        StockReservation(
+            inventory_item_id=item_id, variant_id=variant_id, holder=holder,
+            quantity=n, expires_at=expires_at,
+        )
+        for variant_id, rows in taken.items()
+        for item_id, n in rows
+    ])
+
+
+def _locked(holds, skip_locked=False):
+    # SQLite has no row locks; its write lock already serializes us.
+    if connection.features.has_select_for_update:
+        holds = holds.select_for_update(skip_locked=skip_locked and connection.features.has_select_for_update_skip_locked)
+    return list(holds.values_list('pk', 'inventory_item_id', 'variant_id', 'quantity', 'holder'))
+
+
+def _settle(rows, status):
+    ids = [row[0] for row in rows]
+    return StockReservation.objects.filter(pk__in=ids, status=Status.ACTIVE).update(status=status)
+
+
+def _per_item(rows):
+    amounts = defaultdict(int)
+    for _, item_id, _, quantity, _ in rows:
+        amounts[item_id] += quantity
+    return dict(amounts)
+
+
+@transaction.atomic(savepoint=False)
+def release(holds, skip_locked=False):
+    """Release a queryset of holds; returns how many rows were released."""
+    rows = _locked(holds.filter(status=Status.ACTIVE), skip_locked=skip_locked)
+    if not rows:
+        return 0
+    _settle(rows, Status.RELEASED)
+    release_reserved(_per_item(rows))
+    return len(rows)
+
+
+@transaction.atomic(savepoint=False)
+def set_hold(holder, variant_id, quantity, ttl=None):
+    """Make ``holder``'s hold on one variant exactly ``quantity`` units, with a fresh expiry."""
+    release(active(holder, [variant_id]))
+    if quantity > 0:
+        hold(holder, {variant_id: quantity}, ttl or cart_hold_ttl())
+
+
+@transaction.atomic(savepoint=False)
+def transfer(source, target, quantities, ttl=None, planner=None):
+    """Re-home ``source``'s holds as ``target``'s, topping up expired ones.
+
+    The source holds are released first inside the same transaction, so
+    their units are the first ones the new hold can take.
+    """
+    release(active(source))
+    return hold(target, quantities, ttl or order_hold_ttl(), planner=planner)
+
+
+def convert(holder):
+    """Turn ``holder``'s holds into deductions; returns ``{variant_id: converted}``."""
+    return convert_many([holder]).get(holder, {})
+
+
+def convert_many(holders):
+    """Settle the holds of many holders in one pass; returns
+    ``{holder: {variant_id: converted}}`` for holders that had any."""
+    totals = defaultdict(lambda: defaultdict(int))
+    for holder, rows in convert_rows(holders).items():
+        for _, variant_id, quantity in rows:
+            totals[holder][variant_id] += quantity
+    return {holder: dict(variants) for holder, variants in totals.items()}
+
+
+@transaction.atomic(savepoint=False)
+def convert_rows(holders):
+    """``convert_many``, reporting what was converted per inventory row:
+    ``{holder: [(inventory_item_id, variant_id, quantity), ...]}``."""
+    rows = _locked(StockReservation.objects.filter(holder__in=holders, status=Status.ACTIVE))
+    if not rows:
+        return {}
+    applied = consume_reserved(_per_item(rows))
+    converted = [row for row in rows if row[1] in applied]
+    _settle(converted, Status.CONVERTED)
+    leftover = [row for row in rows if row[1] not in applied]
+    if leftover:
+        _settle(leftover, Status.RELEASED)
+        release_reserved(_per_item(leftover))
+    by_holder = defaultdict(list)
+    for _, item_id, variant_id, quantity, holder in converted:
+        by_holder[holder].append((item_id, variant_id, quantity))
+    return dict(by_holder)
+
+
+def sweep_expired(now=None, batch_size=SWEEP_BATCH_SIZE):
+    """Release every hold past its expiry, ``batch_size`` rows per transaction."""
+    now = now or timezone.now()
+    expired = StockReservation.objects.filter(status=Status.ACTIVE, expires_at__lte=now).order_by('pk')
+    released = last = 0
+    while True:
+        # Walk forward by id so rows another worker holds locked are
+        # skipped rather than retried forever.
+        ids = list(expired.filter(pk__gt=last).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return released
+        last = ids[-1]
+        released += release(StockReservation.objects.filter(pk__in=ids), skip_locked=True)
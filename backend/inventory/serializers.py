@@ -1,4 +1,4 @@
-from rest_framework import serializers
+from rest_framework import exceptions, serializers
 from .models import (
     Branch,
     Supplier,
@@ -7,8 +7,16 @@ from .models import (
     StockImportItem,
     StockAdjustment,
     StockAlert,
+    StockAlertScan,
 )
 from products.models import ProductVariant
+from .stock import StockConflict, add_quantity, set_quantity
+
+
+class InventoryWriteConflict(exceptions.APIException):
+    status_code = 409
+    default_detail = 'Stock changed while it was being adjusted; please retry.'
+    default_code = 'conflict'
 
 
 class BranchSerializer(serializers.ModelSerializer):
@@ -91,13 +99,7 @@ class StockImportSerializer(serializers.ModelSerializer):
                 quantity_received=qty,
                 purchase_price=price,
             )
-            inv, _ = InventoryItem.objects.get_or_create(
-                branch=stock_import.branch,
-                variant=variant,
-                defaults={'quantity': 0, 'reserved_quantity': 0},
-            )
-            inv.quantity += qty
-            inv.save(update_fields=['quantity'])
+            add_quantity(stock_import.branch_id, variant.pk, qty)
 
         stock_import.total_cost = total_cost
         stock_import.save(update_fields=['total_cost'])
@@ -125,14 +127,10 @@ class StockAdjustmentSerializer(serializers.ModelSerializer):
         variant = validated_data['variant']
         new_quantity = validated_data['new_quantity']
 
-        inv, _ = InventoryItem.objects.get_or_create(
-            branch=branch,
-            variant=variant,
-            defaults={'quantity': 0, 'reserved_quantity': 0},
-        )
-        old_q = inv.quantity
-        inv.quantity = new_quantity
-        inv.save(update_fields=['quantity'])
+        try:
+            old_q = set_quantity(branch.pk, variant.pk, new_quantity)
+        except StockConflict:
+            raise InventoryWriteConflict()
 
         adjustment = StockAdjustment.objects.create(
             branch=branch,
@@ -148,4 +146,22 @@ class StockAdjustmentSerializer(serializers.ModelSerializer):
 class StockAlertSerializer(serializers.ModelSerializer):
     class Meta:
         model = StockAlert
-        fields = ['id', 'inventory_item', 'alert_type', 'created_at', 'is_resolved']
\ No newline at end of file
+        fields = ['id', 'inventory_item', 'alert_type', 'created_at', 'is_resolved']
+
+
+class StockAlertScanSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockAlertScan
+        fields = [
+            'id',
+            'status',
+            'full',
+            'since',
+            'scanned',
+            'alerts_created',
+            'alerts_resolved',
+            'error',
+            'requested_at',
+            'started_at',
+            'finished_at',
+        ]
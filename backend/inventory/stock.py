@@ -0,0 +1,252 @@
+"""Set-based stock deduction and reservation.
+
+Stock leaves branch rows through conditional updates only:
+
+    UPDATE inventory_inventoryitem
+       SET quantity = quantity - n          -- or reserved_quantity + n
+     WHERE id = ... AND quantity - reserved_quantity >= n
+
+so a row can never be driven below its reserved quantity, whatever other
+transactions do between our read and our write. ``deduct_stock`` plans
+all rows from one read and applies the whole plan in a single ``CASE``
+UPDATE; only when that statement reports fewer rows than planned (a
+concurrent checkout took stock in between) does it fall back to
+row-by-row updates and re-plan what is still missing. ``reserve_stock``
+does the same but moves the units into ``reserved_quantity``;
+``release_reserved`` and ``consume_reserved`` undo or settle such holds.
+
+Every write also advances ``InventoryItem.version`` and stamps
+``updated_at`` (the alert scanner's watermark). Writers that must compute
+a new value in Python (an absolute stock count from an adjustment) go
+through ``compare_and_swap``, which only writes if the version is still
+the one they read, and ``cas_update`` retries that a bounded number of
+times. Relative changes such as ``add_quantity`` are a
+single ``F()`` UPDATE and need no retry.
+"""
+import random
+import time
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import InventoryItem
+
+DEDUCT_ATTEMPTS = 3
+CAS_ATTEMPTS = 8
+CAS_BACKOFF = 0.002  # seconds; doubled, with jitter, after each lost race
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls  # {variant_id: quantity that could not be taken}
+        super().__init__(f"Insufficient stock for variant(s) {sorted(shortfalls)}.")
+
+
+def plan_deduction(quantities):
+    """Spread ``{variant_id: quantity}`` over branch rows, lowest id first.
+
+    Returns ``(plan, shortfalls)`` where ``plan`` is ``{item_id: (variant_id, n)}``.
+    """
+    need = dict(quantities)
+    plan = {}
+    rows = (
+        InventoryItem.objects.filter(variant_id__in=need)
+        .order_by('id')
+        .values_list('id', 'variant_id', 'quantity', 'reserved_quantity')
+    )
+    for item_id, variant_id, quantity, reserved in rows:
+        take = min(max(0, quantity - reserved), need[variant_id])
+        if take > 0:
+            plan[item_id] = (variant_id, take)
+            need[variant_id] -= take
+    return plan, {variant_id: n for variant_id, n in need.items() if n > 0}
+
+
+class StockConflict(Exception):
+    def __init__(self, item_id, attempts):
+        self.item_id = item_id
+        super().__init__(f"Inventory item {item_id} kept changing; gave up after {attempts} attempts.")
+
+
+class _PartialUpdate(Exception):
+    """Rolls back the batched UPDATE's savepoint when some rows raced."""
+
+
+def per_item(amounts):
+    """``CASE id WHEN ... THEN n END`` for ``{item_id: n}``."""
+    return Case(
+        *[When(pk=item_id, then=Value(n)) for item_id, n in amounts.items()],
+        output_field=IntegerField(),
+    )
+
+
+def bump(**changes):
+    """``update()`` arguments for ``changes`` that also advance the row version."""
+    return {**changes, 'version': F('version') + 1, 'updated_at': timezone.now()}
+
+
+def _take(amount, reserve):
+    if reserve:
+        return bump(reserved_quantity=F('reserved_quantity') + amount)
+    return bump(quantity=F('quantity') - amount)
+
+
+def conditional_decrement(plan, reserve=False):
+    """Apply ``plan`` with conditional UPDATEs; returns the ids that were applied.
+
+    With ``reserve`` the units are added to ``reserved_quantity`` instead
+    of leaving ``quantity``.
+    """
+    amount = per_item({item_id: n for item_id, (_, n) in plan.items()})
+    try:
+        with transaction.atomic():
+            updated = (
+                InventoryItem.objects.filter(pk__in=plan, quantity__gte=F('reserved_quantity') + amount)
+                .update(**_take(amount, reserve))
+            )
+            if updated != len(plan):
+                raise _PartialUpdate
+        return set(plan)
+    except _PartialUpdate:
+        pass
+
+    applied = set()
+    for item_id, (_, n) in plan.items():
+        if InventoryItem.objects.filter(pk=item_id, quantity__gte=F('reserved_quantity') + n).update(
+            **_take(n, reserve),
+        ):
+            applied.add(item_id)
+    return applied
+
+
+def deduct_stock(quantities, attempts=DEDUCT_ATTEMPTS, reserve=False, planner=None):
+    """Take ``{variant_id: quantity}`` out of available branch stock.
+
+    Returns ``{variant_id: [(inventory_item_id, quantity), ...]}``. Raises
+    ``InsufficientStock`` if the stock is not there; call inside a
+    transaction so a failure leaves no partial deduction behind.
+    ``planner`` picks the rows, ``plan_deduction`` by default; re-plans
+    after a race only cover what is still missing.
+    """
+    planner = planner or plan_deduction
+    remaining = {variant_id: n for variant_id, n in quantities.items() if n > 0}
+    taken = {}
+    for _ in range(attempts):
+        if not remaining:
+            break
+        plan, shortfalls = planner(remaining)
+        if shortfalls:
+            raise InsufficientStock(shortfalls)
+        for item_id in conditional_decrement(plan, reserve=reserve):
+            variant_id, n = plan[item_id]
+            taken.setdefault(variant_id, []).append((item_id, n))
+            remaining[variant_id] -= n
+        remaining = {variant_id: n for variant_id, n in remaining.items() if n > 0}
+    if remaining:
+        raise InsufficientStock(remaining)
+    return taken
+
+
+def reserve_stock(quantities, attempts=DEDUCT_ATTEMPTS, planner=None):
+    """Like ``deduct_stock``, but the units move into ``reserved_quantity``."""
+    return deduct_stock(quantities, attempts=attempts, reserve=True, planner=planner)
+
+
+def release_reserved(amounts):
+    """Give ``{item_id: n}`` reserved units back in one UPDATE.
+
+    Clamped at zero so a row whose reservation was edited by hand cannot
+    go negative.
+    """
+    if not amounts:
+        return 0
+    amount = per_item(amounts)
+    return InventoryItem.objects.filter(pk__in=amounts).update(
+        **bump(reserved_quantity=Greatest(F('reserved_quantity') - amount, Value(0))),
+    )
+
+
+def consume_reserved(amounts):
+    """Turn ``{item_id: n}`` reserved units into a deduction in one UPDATE.
+
+    Returns the ids that were applied; a row whose quantity was lowered by
+    hand below the held units is left untouched for the caller to settle.
+    """
+    if not amounts:
+        return set()
+
+    def settle(n):
+        return bump(
+            quantity=F('quantity') - n,
+            reserved_quantity=Greatest(F('reserved_quantity') - n, Value(0)),
+        )
+
+    amount = per_item(amounts)
+    try:
+        with transaction.atomic():
+            if InventoryItem.objects.filter(pk__in=amounts, quantity__gte=amount).update(**settle(amount)) != len(amounts):
+                raise _PartialUpdate
+        return set(amounts)
+    except _PartialUpdate:
+        pass
+    return {
+        item_id for item_id, n in amounts.items()
+        if InventoryItem.objects.filter(pk=item_id, quantity__gte=n).update(**settle(n))
+    }
+
+
+def get_item(branch_id, variant_id):
+    """The ``(branch, variant)`` row, created empty if it does not exist yet."""
+    return InventoryItem.objects.get_or_create(branch_id=branch_id, variant_id=variant_id)[0]
+
+
+def compare_and_swap(item, **values):
+    """Write ``values`` to ``item`` only if its row is still at ``item.version``.
+
+    On success the instance is updated to match the row and True is
+    returned; False means someone else wrote the row since it was read.
+    """
+    updated = InventoryItem.objects.filter(pk=item.pk, version=item.version).update(
+        **values, version=item.version + 1, updated_at=timezone.now(),
+    )
+    if not updated:
+        return False
+    for field, value in values.items():
+        setattr(item, field, value)
+    item.version += 1
+    return True
+
+
+def cas_update(item, change, attempts=CAS_ATTEMPTS):
+    """Read-modify-write ``item`` with bounded retry.
+
+    ``change(item)`` returns the ``{field: value}`` to write and is called
+    again on a fresh read after every lost race. Returns the replaced
+    values; raises ``StockConflict`` once ``attempts`` are used up.
+    """
+    for attempt in range(attempts):
+        values = change(item)
+        before = {field: getattr(item, field) for field in values}
+        if compare_and_swap(item, **values):
+            return before
+        time.sleep(random.uniform(0, CAS_BACKOFF * 2 ** attempt))
+        item.refresh_from_db(fields=['quantity', 'reserved_quantity', 'min_threshold', 'version'])
+    raise StockConflict(item.pk, attempts)
+
+
+def set_quantity(branch_id, variant_id, quantity, attempts=CAS_ATTEMPTS):
+    """Set a row's stock count; returns the count it replaced."""
+    item = get_item(branch_id, variant_id)
+    return cas_update(item, lambda item: {'quantity': quantity}, attempts=attempts)['quantity']
+
+
+def add_quantity(branch_id, variant_id, delta):
+    """Add ``delta`` units to a row in one UPDATE, creating the row if needed."""
+    updated = InventoryItem.objects.filter(branch_id=branch_id, variant_id=variant_id).update(
+        **bump(quantity=F('quantity') + delta),
+    )
+    if not updated:
+        item = get_item(branch_id, variant_id)
+        InventoryItem.objects.filter(pk=item.pk).update(**bump(quantity=F('quantity') + delta))
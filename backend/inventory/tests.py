@@ -1,3 +1,440 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from products.importer import import_catalog
+from products.models import Category, Brand, Product, ProductVariant
+from . import alerts, allocation, reservations, stock
+from .allocation import FulfillmentPlanner
+from .models import Branch, InventoryItem, StockAlert, StockAlertScan, StockReservation
+from .serializers import InventoryItemSerializer
+from .stock import InsufficientStock, deduct_stock
+
+User = get_user_model()
+
+
+def make_variants(count, prefix='V'):
+    category, _ = Category.objects.get_or_create(slug='phones', defaults={'name': 'Phones'})
+    brand, _ = Brand.objects.get_or_create(slug='acme', defaults={'name': 'Acme'})
+    product = Product.objects.create(
+        name=f'Product {prefix}', slug=f'product-{prefix.lower()}', category=category, brand=brand,
+        base_price=Decimal('10.00'),
+    )
+    return [
+        ProductVariant.objects.create(product=product, sku=f'{prefix}-{i}', color='Black', base_price=Decimal('10.00'))
+        for i in range(count)
+    ]
+
+
+class InventoryListContractTests(TestCase):
+    def setUp(self):
+        self.branch = Branch.objects.create(name='Main', code='main')
+        for i, variant in enumerate(make_variants(3)):
+            InventoryItem.objects.create(branch=self.branch, variant=variant, quantity=i * 2, reserved_quantity=1)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='clerk', email='clerk@example.com'))
+
+    def test_list_matches_serializer_output(self):
+        items = InventoryItem.objects.select_related('branch', 'variant', 'variant__product')
+        expected = JSONRenderer().render(InventoryItemSerializer(items, many=True).data)
+        response = self.client.get('/api/inventory/inventory/')
+        self.assertEqual(response.content, expected)
+        self.assertEqual([item['available_quantity'] for item in response.json()], [0, 1, 3])
+
+    def test_search_still_applies(self):
+        response = self.client.get('/api/inventory/inventory/?search=V-2')
+        self.assertEqual([item['variant']['sku'] for item in response.json()], ['V-2'])
+
+
+class DeductStockTests(TestCase):
+    def setUp(self):
+        self.variants = make_variants(2)
+        self.branches = [Branch.objects.create(name=code, code=code) for code in ('a', 'b')]
+        for variant in self.variants:
+            for branch in self.branches:
+                InventoryItem.objects.create(branch=branch, variant=variant, quantity=3, reserved_quantity=1)
+
+    def quantities(self):
+        return list(InventoryItem.objects.order_by('id').values_list('quantity', flat=True))
+
+    def test_spreads_over_branches_in_one_update(self):
+        first, second = self.variants
+        with self.assertNumQueries(4):  # read, savepoint, UPDATE, release
+            taken = deduct_stock({first.id: 3, second.id: 1})
+        self.assertEqual([n for _, n in taken[first.id]], [2, 1])
+        self.assertEqual(self.quantities(), [1, 2, 2, 3])
+
+    def test_reserved_stock_is_never_taken(self):
+        with self.assertRaises(InsufficientStock) as ctx:
+            deduct_stock({self.variants[0].id: 5})
+        self.assertEqual(ctx.exception.shortfalls, {self.variants[0].id: 1})
+        self.assertEqual(self.quantities(), [3, 3, 3, 3])
+
+    def test_replans_when_a_concurrent_deduction_wins_the_race(self):
+        variant = self.variants[0]
+        real_plan = stock.plan_deduction
+        raced = []
+
+        def plan_then_race(quantities):
+            plan = real_plan(quantities)
+            if not raced:
+                # Another checkout empties branch "a" after we read it.
+                InventoryItem.objects.filter(variant=variant, branch=self.branches[0]).update(quantity=1)
+                raced.append(True)
+            return plan
+
+        InventoryItem.objects.filter(variant=variant, branch=self.branches[1]).update(quantity=5)
+        with mock.patch.object(stock, 'plan_deduction', side_effect=plan_then_race):
+            taken = deduct_stock({variant.id: 4})
+        self.assertEqual(sum(n for _, n in taken[variant.id]), 4)
+        self.assertEqual(self.quantities()[:2], [1, 1])
+
+
+class FulfillmentPlannerTests(TestCase):
+    def setUp(self):
+        self.phone, self.case = make_variants(2)
+        self.branches = {
+            code: Branch.objects.create(name=code, code=code) for code in ('a', 'b', 'c')
+        }
+
+    def stock(self, code, variant, quantity):
+        return InventoryItem.objects.create(branch=self.branches[code], variant=variant, quantity=quantity)
+
+    def branches_used(self, planner, plan):
+        return {planner.branch_of[item_id] for item_id in plan}
+
+    def test_ships_from_one_branch_when_one_has_everything(self):
+        # Lowest-id-first planning would split this over "a" and "b".
+        self.stock('a', self.phone, 5)
+        self.stock('b', self.phone, 5)
+        self.stock('b', self.case, 5)
+        planner = FulfillmentPlanner()
+        with self.assertNumQueries(1):
+            plan, shortfalls = planner({self.phone.id: 2, self.case.id: 1})
+        self.assertEqual(shortfalls, {})
+        self.assertEqual(self.branches_used(planner, plan), {self.branches['b'].id})
+
+    def test_prefers_the_chosen_branch_among_equal_sets(self):
+        self.stock('a', self.phone, 5)
+        self.stock('c', self.phone, 5)
+        planner = FulfillmentPlanner(self.branches['c'].id)
+        plan, _ = planner({self.phone.id: 3})
+        self.assertEqual(self.branches_used(planner, plan), {self.branches['c'].id})
+
+    def test_preference_never_adds_a_branch(self):
+        self.stock('a', self.phone, 1)
+        self.stock('b', self.phone, 5)
+        planner = FulfillmentPlanner(self.branches['a'].id)
+        plan, _ = planner({self.phone.id: 3})
+        self.assertEqual(self.branches_used(planner, plan), {self.branches['b'].id})
+
+    def test_splits_over_the_fewest_branches(self):
+        self.stock('a', self.phone, 2)
+        self.stock('b', self.phone, 1)
+        self.stock('c', self.phone, 3)
+        planner = FulfillmentPlanner()
+        plan, _ = planner({self.phone.id: 5})
+        self.assertEqual(self.branches_used(planner, plan), {self.branches['a'].id, self.branches['c'].id})
+        self.assertEqual(sum(n for _, n in plan.values()), 5)
+
+    def test_greedy_beyond_the_exact_search_limit(self):
+        self.stock('a', self.phone, 1)
+        self.stock('b', self.phone, 4)
+        self.stock('c', self.case, 2)
+        planner = FulfillmentPlanner()
+        with mock.patch.object(allocation, 'EXACT_SEARCH_BRANCHES', 0):
+            plan, _ = planner({self.phone.id: 4, self.case.id: 2})
+        self.assertEqual(self.branches_used(planner, plan), {self.branches['b'].id, self.branches['c'].id})
+
+    def test_reports_shortfalls_net_of_reservations(self):
+        InventoryItem.objects.create(branch=self.branches['a'], variant=self.phone, quantity=3, reserved_quantity=2)
+        plan, shortfalls = FulfillmentPlanner()({self.phone.id: 2})
+        self.assertEqual((plan, shortfalls), ({}, {self.phone.id: 1}))
+
+    def test_plugs_into_reserve_stock(self):
+        self.stock('a', self.phone, 1)
+        b = self.stock('b', self.phone, 3)
+        taken = stock.reserve_stock({self.phone.id: 3}, planner=FulfillmentPlanner())
+        self.assertEqual(taken, {self.phone.id: [(b.id, 3)]})
+        b.refresh_from_db()
+        self.assertEqual(b.reserved_quantity, 3)
+
+
+class ReservationTests(TestCase):
+    def setUp(self):
+        self.variants = make_variants(2)
+        self.branches = [Branch.objects.create(name=code, code=code) for code in ('a', 'b')]
+        for variant in self.variants:
+            for branch in self.branches:
+                InventoryItem.objects.create(branch=branch, variant=variant, quantity=3)
+        self.quantities = {variant.id: 4 for variant in self.variants}
+
+    def stock(self):
+        return list(InventoryItem.objects.order_by('id').values_list('quantity', 'reserved_quantity'))
+
+    def test_holds_are_released_in_one_update(self):
+        with transaction.atomic():
+            holds = reservations.hold('cart:1', self.quantities, timedelta(minutes=5))
+        self.assertEqual(len(holds), 4)
+        self.assertEqual(self.stock(), [(3, 3), (3, 1)] * 2)
+        with self.assertNumQueries(3):  # read, flip status, one UPDATE for every row
+            released = reservations.release(reservations.active('cart:1'))
+        self.assertEqual(released, 4)
+        self.assertEqual(self.stock(), [(3, 0)] * 4)
+
+    def test_convert_settles_holds_and_releases_unpayable_rows(self):
+        with transaction.atomic():
+            reservations.hold('order:A', self.quantities, timedelta(minutes=5))
+        # Someone writes branch "a" of the first variant down by hand.
+        InventoryItem.objects.filter(pk=InventoryItem.objects.order_by('id')[0].pk).update(quantity=2)
+        converted = reservations.convert('order:A')
+        self.assertEqual(converted, {self.variants[0].id: 1, self.variants[1].id: 4})
+        self.assertEqual(self.stock(), [(2, 0), (2, 0), (0, 0), (2, 0)])
+        self.assertFalse(reservations.active('order:A').exists())
+
+    def test_sweeper_releases_only_expired_holds(self):
+        with transaction.atomic():
+            reservations.hold('cart:old', {self.variants[0].id: 2}, timedelta(minutes=-1))
+            reservations.hold('cart:new', {self.variants[1].id: 2}, timedelta(minutes=5))
+        out = StringIO()
+        call_command('release_expired_reservations', '--batch-size', '1', stdout=out)
+        self.assertIn('Released 1 expired', out.getvalue())
+        self.assertEqual(self.stock(), [(3, 0), (3, 0), (3, 2), (3, 0)])
+        self.assertEqual(StockReservation.objects.get(holder='cart:old').status, StockReservation.Status.RELEASED)
+
+
+class StockImportIdempotencyTests(TestCase):
+    def setUp(self):
+        caches['state'].clear()
+        cache.clear()
+        self.variant = make_variants(1)[0]
+        self.branch = Branch.objects.create(name='Main', code='main')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='staff', email='staff@example.com', is_staff=True))
+
+    def test_retried_import_is_applied_once(self):
+        payload = {
+            'branch': self.branch.id,
+            'reference_number': 'PO-1',
+            'items': [{'variant_id': self.variant.id, 'quantity_received': 5, 'purchase_price': '4.00'}],
+        }
+        responses = [
+            self.client.post('/api/inventory/imports/', payload, format='json', HTTP_IDEMPOTENCY_KEY='po-1')
+            for _ in range(2)
+        ]
+        self.assertEqual([response.status_code for response in responses], [201, 201])
+        self.assertEqual(responses[0].json()['id'], responses[1].json()['id'])
+        self.assertEqual(InventoryItem.objects.get(variant=self.variant).quantity, 5)
+
+
+class InventoryVersionTests(TestCase):
+    def setUp(self):
+        self.variant = make_variants(1)[0]
+        self.branch = Branch.objects.create(name='Main', code='main')
+        self.item = InventoryItem.objects.create(branch=self.branch, variant=self.variant, quantity=10)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='staff', email='staff@example.com', is_staff=True))
+
+    def test_stale_version_is_rejected(self):
+        stale = InventoryItem.objects.get(pk=self.item.pk)
+        self.assertTrue(stock.compare_and_swap(self.item, quantity=7))
+        self.assertFalse(stock.compare_and_swap(stale, quantity=3))
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.quantity, self.item.version), (7, 1))
+
+    def test_cas_update_recomputes_after_losing_a_race(self):
+        calls = []
+
+        def add_one(item):
+            if not calls:
+                # Another writer lands between our read and our write.
+                stock.add_quantity(self.branch.id, self.variant.id, 5)
+            calls.append(item.quantity)
+            return {'quantity': item.quantity + 1}
+
+        with mock.patch.object(stock, 'CAS_BACKOFF', 0):
+            before = stock.cas_update(self.item, add_one)
+        self.assertEqual((calls, before), ([10, 15], {'quantity': 15}))
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.quantity, self.item.version), (16, 2))
+
+    def test_gives_up_after_bounded_attempts(self):
+        with mock.patch.object(stock, 'compare_and_swap', return_value=False), \
+                mock.patch.object(stock, 'CAS_BACKOFF', 0):
+            response = self.client.post(
+                '/api/inventory/adjustments/',
+                {'branch': self.branch.id, 'variant': self.variant.id, 'new_quantity': 4}, format='json',
+            )
+        self.assertEqual(response.status_code, 409)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 10)
+
+    def test_adjustment_records_the_quantity_it_replaced(self):
+        stock.add_quantity(self.branch.id, self.variant.id, 2)
+        response = self.client.post(
+            '/api/inventory/adjustments/',
+            {'branch': self.branch.id, 'variant': self.variant.id, 'new_quantity': 4}, format='json',
+        )
+        self.assertEqual(response.json()['old_quantity'], 12)
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.quantity, self.item.version), (4, 2))
+
+    def test_set_based_writers_advance_the_version(self):
+        deduct_stock({self.variant.id: 1})
+        stock.reserve_stock({self.variant.id: 2})
+        stock.release_reserved({self.item.pk: 1})
+        stock.consume_reserved({self.item.pk: 1})
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.quantity, self.item.reserved_quantity, self.item.version), (8, 0, 4))
+
+
+class InventoryWriteStressTests(TransactionTestCase):
+    THREADS = 8
+    WRITES = 25
+
+    def setUp(self):
+        self.variant = make_variants(1)[0]
+        self.branch = Branch.objects.create(name='Main', code='main')
+        self.item = InventoryItem.objects.create(branch=self.branch, variant=self.variant, quantity=1000)
+
+    def test_concurrent_writers_lose_no_updates(self):
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+
+        def writer(index):
+            done = conflicts = 0
+            try:
+                barrier.wait()
+                for n in range(self.WRITES):
+                    try:
+                        if (index + n) % 3 == 0:
+                            stock.add_quantity(self.branch.id, self.variant.id, 1)
+                        elif (index + n) % 3 == 1:
+                            item = InventoryItem.objects.get(pk=self.item.pk)
+                            stock.cas_update(item, lambda item: {'quantity': item.quantity + 1})
+                        else:
+                            with transaction.atomic():
+                                stock.reserve_stock({self.variant.id: 1})
+                            stock.consume_reserved({self.item.pk: 1})
+                            stock.add_quantity(self.branch.id, self.variant.id, 2)
+                        done += 1
+                    except stock.StockConflict:
+                        conflicts += 1
+            finally:
+                results.append((index, done, conflicts))
+                connections.close_all()
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), self.THREADS)
+        # Every write that reported success is in the row: each op nets +1.
+        succeeded = sum(done for _, done, _ in results)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 1000 + succeeded)
+        self.assertEqual(self.item.reserved_quantity, 0)
+        self.assertGreater(succeeded, self.THREADS * self.WRITES * 9 // 10)
+
+
+@override_settings(STOCK_ALERT_SCAN_OVERLAP_SECONDS=0)
+class StockAlertScanTests(TestCase):
+    def setUp(self):
+        self.branch = Branch.objects.create(name='Main', code='main')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='staff', email='staff@example.com', is_staff=True))
+
+    def make_items(self, rows, prefix='V'):
+        """``rows`` of ``(quantity, reserved_quantity, min_threshold)``, last changed an hour ago."""
+        items = [
+            InventoryItem.objects.create(
+                branch=self.branch, variant=variant, quantity=quantity,
+                reserved_quantity=reserved, min_threshold=threshold,
+            )
+            for variant, (quantity, reserved, threshold) in zip(make_variants(len(rows), prefix), rows)
+        ]
+        InventoryItem.objects.filter(pk__in=[item.pk for item in items]).update(
+            updated_at=timezone.now() - timedelta(hours=1),
+        )
+        return items
+
+    def active(self):
+        return dict(StockAlert.objects.filter(is_resolved=False).values_list('inventory_item_id', 'alert_type'))
+
+    def test_classifies_and_reconciles_alerts(self):
+        out, low, fine, recovered = self.make_items([(2, 2, 0), (5, 1, 5), (50, 0, 5), (9, 0, 5)])
+        StockAlert.objects.create(inventory_item=low, alert_type=StockAlert.AlertType.OUT_OF_STOCK)
+        StockAlert.objects.create(inventory_item=recovered, alert_type=StockAlert.AlertType.LOW)
+        self.assertEqual(alerts.scan(), (4, 2, 2))
+        self.assertEqual(self.active(), {out.pk: 'OUT_OF_STOCK', low.pk: 'LOW'})
+        # A second pass finds nothing to change.
+        self.assertEqual(alerts.scan(), (4, 0, 0))
+
+    def test_statements_per_batch_do_not_grow_with_rows(self):
+        self.make_items([(0, 0, 0)] * 10, prefix='A')
+        with self.assertNumQueries(8):  # savepoint, classify, resolve, insert, release; then the empty batch
+            alerts.scan(batch_size=50)
+        StockAlert.objects.all().delete()
+        self.make_items([(0, 0, 0)] * 40, prefix='B')
+        with self.assertNumQueries(8):
+            alerts.scan(batch_size=50)
+        self.assertEqual(len(self.active()), 50)
+
+    def test_incremental_scan_only_visits_rows_changed_since_the_last_one(self):
+        _, second = self.make_items([(5, 0, 2), (5, 0, 2)])
+        self.assertEqual(alerts.run_now().scanned, 2)
+        stock.set_quantity(self.branch.id, second.variant_id, 1)
+        job = alerts.run_now()
+        self.assertEqual((job.scanned, job.alerts_created), (1, 1))
+        self.assertIsNotNone(job.since)
+        self.assertEqual(self.active(), {second.pk: 'LOW'})
+        self.assertEqual(alerts.run_now(full=True).scanned, 2)
+
+    def test_incremental_scan_sees_catalog_import_stock(self):
+        csv = (
+            "category_slug,brand_slug,product_slug,product_name,product_price,sku,branch_code,quantity\n"
+            "tv,lg,oled,OLED,1999,OLED-65,main,{}\n"
+        )
+        import_catalog(StringIO(csv.format(4)))
+        alerts.run_now()
+        import_catalog(StringIO(csv.format(0)))
+        job = alerts.run_now()
+        self.assertEqual((job.scanned, job.alerts_created), (1, 1))
+        self.assertEqual(list(StockAlert.objects.values_list('alert_type', flat=True)), ['OUT_OF_STOCK'])
+
+    def test_api_only_queues_the_scan(self):
+        item, = self.make_items([(0, 0, 0)])
+        first = self.client.post('/api/inventory/scan-alerts/', {}, format='json')
+        again = self.client.post('/api/inventory/scan-alerts/', {}, format='json')
+        self.assertEqual((first.status_code, first.json()['status']), (202, 'PENDING'))
+        self.assertEqual(again.json()['id'], first.json()['id'])
+        self.assertEqual(self.active(), {})
+
+        out = StringIO()
+        call_command('scan_stock_alerts', '--queued-only', stdout=out)
+        self.assertIn('opened 1 alerts', out.getvalue())
+        self.assertEqual(self.active(), {item.pk: 'OUT_OF_STOCK'})
+        latest = self.client.get('/api/inventory/scan-alerts/').json()
+        self.assertEqual((latest['id'], latest['status'], latest['scanned']), (first.json()['id'], 'DONE', 1))
+
+    def test_command_scans_changes_when_nothing_is_queued(self):
+        self.make_items([(0, 0, 0)])
+        out = StringIO()
+        call_command('scan_stock_alerts', '--queued-only', stdout=out)
+        self.assertEqual(out.getvalue(), '')
+        call_command('scan_stock_alerts', stdout=out)
+        self.assertIn('scanned 1 rows, opened 1 alerts', out.getvalue())
+        self.assertEqual(StockAlertScan.objects.get().status, StockAlertScan.Status.DONE)
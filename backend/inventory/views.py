@@ -3,7 +3,9 @@ from rest_framework.response import Response
 
 
 # Create your views here.
-from rest_framework import viewsets, permissions, filters
+from rest_framework import viewsets, permissions, filters, status
+from backend.idempotency import idempotent
+from . import alerts
 from .models import (
     Branch,
     Supplier,
@@ -11,7 +13,9 @@ from .models import (
     StockImport,
     StockAdjustment,
     StockAlert,
+    StockAlertScan,
 )
+from .listing import INVENTORY_ROW
 from .serializers import (
     BranchSerializer,
     SupplierSerializer,
@@ -19,6 +23,7 @@ from .serializers import (
     StockImportSerializer,
     StockAdjustmentSerializer,
     StockAlertSerializer,
+    StockAlertScanSerializer,
 )
 
 
@@ -48,12 +53,25 @@ class InventoryItemViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [filters.SearchFilter]
     search_fields = ['variant__sku', 'variant__product__name', 'branch__code']
 
+    def list(self, request, *args, **kwargs):
+        # values() rows through a precompiled mapper; same output as
+        # InventoryItemSerializer (see inventory.listing).
+        queryset = self.filter_queryset(self.get_queryset()).values(*INVENTORY_ROW.paths())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(INVENTORY_ROW.many(page))
+        return Response(INVENTORY_ROW.many(queryset))
+
 
 class StockImportViewSet(viewsets.ModelViewSet):
     queryset = StockImport.objects.all().select_related('branch', 'supplier')
     serializer_class = StockImportSerializer
     permission_classes = [permissions.IsAdminUser]
 
+    @idempotent('stock-import')
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
 
 class StockAdjustmentViewSet(viewsets.ModelViewSet):
     queryset = StockAdjustment.objects.all().select_related('branch', 'variant')
@@ -73,50 +91,22 @@ class StockAlertViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class TriggerStockAlertScanView(APIView):
-    """Manually scan inventory items and create/resolve stock alerts.
+    """Queue a stock alert scan for the ``scan_stock_alerts`` worker.
 
-    - If available_quantity <= 0: create/keep OUT_OF_STOCK alert.
-    - Else if available_quantity <= min_threshold: create/keep LOW alert.
-    - Else: resolve any active alerts.
+    POST ``{"full": true}`` rescans every row; otherwise only rows changed
+    since the last scan are visited (see ``inventory.alerts``). GET shows
+    the most recent scan.
     """
 
     permission_classes = [permissions.IsAdminUser]
 
+    def get(self, request):
+        job = StockAlertScan.objects.order_by('-id').first()
+        if job is None:
+            return Response({"detail": "No scans yet."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(StockAlertScanSerializer(job).data)
+
     def post(self, request):
-        alerts_created = 0
-        alerts_resolved = 0
-
-        items = InventoryItem.objects.select_related("branch", "variant")
-        for item in items:
-            available = item.available_quantity
-            threshold = item.min_threshold
-            active_alerts = item.alerts.filter(is_resolved=False)
-
-            if available <= 0:
-                desired_type = StockAlert.AlertType.OUT_OF_STOCK
-            elif threshold and available <= threshold:
-                desired_type = StockAlert.AlertType.LOW
-            else:
-                desired_type = None
-
-            if desired_type is None:
-                # No alert should be active; resolve any existing ones.
-                resolved_count = active_alerts.update(is_resolved=True)
-                alerts_resolved += resolved_count
-                continue
-
-            # If an active alert of the desired type already exists, keep it.
-            if active_alerts.filter(alert_type=desired_type).exists():
-                continue
-
-            # Resolve alerts of other types for this item.
-            resolved_count = active_alerts.exclude(alert_type=desired_type).update(is_resolved=True)
-            alerts_resolved += resolved_count
-
-            StockAlert.objects.create(inventory_item=item, alert_type=desired_type)
-            alerts_created += 1
-
-        return Response({
-            "alerts_created": alerts_created,
-            "alerts_resolved": alerts_resolved,
-        })
\ No newline at end of file
+        full = str(request.data.get('full', '')).lower() in ('1', 'true')
+        job = alerts.request_scan(full=full)
+        return Response(StockAlertScanSerializer(job).data, status=status.HTTP_202_ACCEPTED)
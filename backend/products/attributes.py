@@ -0,0 +1,112 @@
+"""Variant attribute index and filters.
+
+Every active variant gets one ``VariantAttribute`` row per attribute
+value: the ``color``, ``storage`` and ``ram`` columns plus each scalar key
+of the ``attributes`` JSON (list values give one row per item). Values
+are normalized (stripped, lower-cased) so ``?storage=256gb`` matches
+``256GB``.
+
+Filters are ``?color=``, ``?storage=``, ``?ram=`` and ``?attr.<key>=``.
+Comma-separated values are alternatives; different keys must all hold
+for the same variant. Each key is one lookup on the
+``(name, value, variant, product)`` index, nested so the intersection
+never reads the variant table.
+"""
+from .models import ProductVariant, VariantAttribute
+
+FIXED_ATTRIBUTES = ('color', 'storage', 'ram')
+ATTRIBUTE_PARAM_PREFIX = 'attr.'
+NAME_MAX_LENGTH = VariantAttribute._meta.get_field('name').max_length
+VALUE_MAX_LENGTH = VariantAttribute._meta.get_field('value').max_length
+
+
+def normalize(value):
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    return str(value).strip().lower()
+
+
+def attribute_pairs(variant):
+    """The normalized (name, value) pairs indexed for ``variant``."""
+    raw = [(name, getattr(variant, name)) for name in FIXED_ATTRIBUTES]
+    attributes = variant.attributes if isinstance(variant.attributes, dict) else {}
+    for name, value in attributes.items():
+        for item in value if isinstance(value, list) else [value]:
+            if item is not None and not isinstance(item, (dict, list)):
+                raw.append((normalize(name), item))
+    pairs = set()
+    for name, value in raw:
+        value = normalize(value)
+        if name and value and len(name) <= NAME_MAX_LENGTH and len(value) <= VALUE_MAX_LENGTH:
+            pairs.add((name, value))
+    return pairs
+
+
+def index_variants(variant_ids, batch_size=1000):
+    """Rebuild the index rows of the given variants."""
+    variant_ids = list(variant_ids)
+    VariantAttribute.objects.filter(variant_id__in=variant_ids).delete()
+    variants = ProductVariant.objects.filter(pk__in=variant_ids, is_active=True).only(
+        'pk', 'product_id', *FIXED_ATTRIBUTES, 'attributes',
+    )
+    VariantAttribute.objects.bulk_create(
+        [
+            VariantAttribute(variant_id=variant.pk, product_id=variant.product_id, name=name, value=value)
+            for variant in variants
+            for name, value in sorted(attribute_pairs(variant))
+        ],
+        batch_size=batch_size,
+    )
+
+
+def rebuild(batch_size=1000):
+    VariantAttribute.objects.all().delete()
+    ids = ProductVariant.objects.filter(is_active=True).order_by('pk').values_list('pk', flat=True)
+    batch = []
+    for pk in ids.iterator(chunk_size=batch_size):
+        batch.append(pk)
+        if len(batch) >= batch_size:
+            index_variants(batch, batch_size)
+            batch = []
+    if batch:
+        index_variants(batch, batch_size)
+
+
+def is_attribute_param(key):
+    return key in FIXED_ATTRIBUTES or (key.startswith(ATTRIBUTE_PARAM_PREFIX) and len(key) > len(ATTRIBUTE_PARAM_PREFIX))
+
+
+def attribute_criteria(query_params):
+    """``{name: [values]}`` from the attribute filter query parameters."""
+    criteria = {}
+    for key, values in query_params.lists():
+        if not is_attribute_param(key):
+            continue
+        name = normalize(key[len(ATTRIBUTE_PARAM_PREFIX):] if key.startswith(ATTRIBUTE_PARAM_PREFIX) else key)
+        wanted = {normalize(part) for value in values for part in value.split(',') if part.strip()}
+        if wanted:
+            criteria.setdefault(name, set()).update(wanted)
+    return {name: sorted(values) for name, values in sorted(criteria.items())}
+
+
+def matching_attributes(criteria):
+    """Index rows of the last criterion whose variants satisfy all criteria."""
+    rows = None
+    for name, values in criteria.items():
+        step = VariantAttribute.objects.filter(name=name, value__in=values)
+        if rows is not None:
+            step = step.filter(variant_id__in=rows.values('variant_id'))
+        rows = step
+    return rows
+
+
+def filter_products(queryset, criteria):
+    if not criteria:
+        return queryset
+    return queryset.filter(id__in=matching_attributes(criteria).values('product_id'))
+
+
+def filter_variants(queryset, criteria):
+    if not criteria:
+        return queryset
+    return queryset.filter(id__in=matching_attributes(criteria).values('variant_id'))
@@ -0,0 +1,127 @@
+"""Versioned response cache for catalog reads.
+
+Every catalog write bumps a single version number (see
+``products.signals``). Cached responses and their ETags are keyed by that
+version, so a write invalidates everything at once without scanning keys,
+and a client revalidating with ``If-None-Match`` gets a ``304`` after one
+cache read, before the view touches the database.
+
+The version lives in the cross-process ``STATE_CACHE``, so a bump from a
+management command or another worker reaches every process; the
+responses themselves can stay in the per-process default cache.
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from backend.state import state_cache
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_version() -> int:
+    versions = state_cache()
+    version = versions.get(CATALOG_VERSION_KEY)
+    if version is None:
+        versions.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = versions.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version() -> int:
+    versions = state_cache()
+    try:
+        return versions.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        versions.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        return versions.incr(CATALOG_VERSION_KEY)
+
+
+def cached_catalog_response(view_method):
+    """Decorate a catalog viewset action so it is served via ``cached_response``."""
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        return self.cached_response(request, functools.partial(view_method, self), *args, **kwargs)
+    return wrapper
+
+
+class CatalogCacheMixin:
+    """Cache ``list``/``retrieve`` and answer conditional requests with 304.
+
+    Extra actions opt in with ``@cached_catalog_response``. Cached actions
+    must produce the same response for every caller, which holds for the
+    catalog's public read endpoints; per-user fields are laid over the
+    shared data by ``personalize`` and such responses carry no ETag.
+    """
+
+    cache_timeout = None
+
+    def get_cache_timeout(self):
+        if self.cache_timeout is not None:
+            return self.cache_timeout
+        return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60)
+
+    def get_cache_version(self):
+        return get_catalog_version()
+
+    def is_personalized(self, request):
+        return False
+
+    def personalize(self, request, data):
+        return data
+
+    def get_cache_params(self, request):
+        """Query parameters that can change the response, as (key, value) pairs."""
+        return [
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        ]
+
+    def get_catalog_cache_key(self, request, version):
+        params = sorted(self.get_cache_params(request))
+        renderer = getattr(request, 'accepted_renderer', None)
+        raw = f"{request.path}|{params}|{renderer.format if renderer else ''}"
+        digest = hashlib.sha1(raw.encode()).hexdigest()
+        return f"catalog:v{version}:{digest}", f'"{version}-{digest[:20]}"'
+
+    def cached_response(self, request, handler, *args, conditional=True, **kwargs):
+        """Serve ``handler``'s response from the cache; with ``conditional``
+        a matching ``If-None-Match`` gets a 304 without running it."""
+        if request.method not in ('GET', 'HEAD'):
+            return handler(request, *args, **kwargs)
+
+        personalized = self.is_personalized(request)
+        conditional = conditional and not personalized
+        key, etag = self.get_catalog_cache_key(request, self.get_cache_version())
+        if_none_match = request.headers.get('If-None-Match') if conditional else None
+        if if_none_match and etag in parse_etags(if_none_match):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = cache.get(key)
+            if data is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data, self.get_cache_timeout())
+            else:
+                response = Response(data)
+        if personalized and response.status_code == status.HTTP_200_OK:
+            response.data = self.personalize(request, response.data)
+        else:
+            response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    @cached_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
@@ -0,0 +1,75 @@
+from decimal import Decimal
+
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .models import Product
+
+# Upper bounds of the price buckets; the last bucket is open-ended.
+PRICE_BUCKET_BOUNDS = [Decimal('100.00'), Decimal('500.00'), Decimal('1000.00'), Decimal('2000.00')]
+
+
+def price_bucket_expression():
+    whens = [
+        When(base_price__lt=bound, then=Value(index))
+        for index, bound in enumerate(PRICE_BUCKET_BOUNDS)
+    ]
+    return Case(*whens, default=Value(len(PRICE_BUCKET_BOUNDS)), output_field=IntegerField())
+
+
+def compute_facets(queryset):
+    """Count brand, category, product type and price bucket in one query.
+
+    The filtered queryset is grouped by all four dimensions at once; the
+    (small) grouped result is then rolled up per facet in Python.
+    """
+    rows = (
+        queryset.order_by()
+        .annotate(price_bucket=price_bucket_expression())
+        .values(
+            'brand__slug', 'brand__name',
+            'category__slug', 'category__name',
+            'product_type', 'price_bucket',
+        )
+        .annotate(count=Count('id'))
+    )
+
+    total = 0
+    brands, categories, product_types = {}, {}, {}
+    buckets = [0] * (len(PRICE_BUCKET_BOUNDS) + 1)
+    for row in rows:
+        count = row['count']
+        total += count
+        brand = brands.setdefault(row['brand__slug'], {'slug': row['brand__slug'], 'name': row['brand__name'], 'count': 0})
+        brand['count'] += count
+        category = categories.setdefault(
+            row['category__slug'],
+            {'slug': row['category__slug'], 'name': row['category__name'], 'count': 0},
+        )
+        category['count'] += count
+        product_types[row['product_type']] = product_types.get(row['product_type'], 0) + count
+        buckets[row['price_bucket']] += count
+
+    labels = dict(Product.ProductType.choices)
+    bounds = [str(bound) for bound in PRICE_BUCKET_BOUNDS]
+    lower_bounds = [None, *bounds]
+    upper_bounds = [*bounds, None]
+
+    def by_count(items, key):
+        return sorted(items, key=lambda item: (-item['count'], item[key]))
+
+    return {
+        'total': total,
+        'brands': by_count(brands.values(), 'slug'),
+        'categories': by_count(categories.values(), 'slug'),
+        'product_types': by_count(
+            [
+                {'value': value, 'label': labels.get(value, value), 'count': count}
+                for value, count in product_types.items()
+            ],
+            'value',
+        ),
+        'price_buckets': [
+            {'min': low, 'max': high, 'count': count}
+            for low, high, count in zip(lower_bounds, upper_bounds, buckets)
+        ],
+    }
@@ -0,0 +1,60 @@
+"""Favorite counters, bulk toggling and the per-user listing overlay."""
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Favorite, Product
+
+
+def refresh_favorite_counts(product_ids=None):
+    """Recompute ``Product.favorite_count`` from the favorites table in one
+    UPDATE; with no ids every product is recomputed."""
+    counts = (
+        Favorite.objects.filter(product=OuterRef('pk'))
+        .order_by().values('product').annotate(total=Count('pk')).values('total')
+    )
+    products = Product.objects.all() if product_ids is None else Product.objects.filter(pk__in=product_ids)
+    products.update(favorite_count=Coalesce(Subquery(counts), Value(0)))
+
+
+@transaction.atomic
+def bulk_set_favorites(user, product_ids, mode='toggle'):
+    """Add, remove or toggle many favorites at once.
+
+    Returns ``(added, removed)`` product id lists. Ids of unknown products
+    are ignored.
+    """
+    wanted = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+    existing = set(
+        Favorite.objects.select_for_update()
+        .filter(user=user, product_id__in=wanted)
+        .values_list('product_id', flat=True)
+    )
+    added = sorted(wanted - existing) if mode in ('add', 'toggle') else []
+    removed = sorted(existing) if mode in ('remove', 'toggle') else []
+    if removed:
+        Favorite.objects.filter(user=user, product_id__in=removed).delete()
+    if added:
+        Favorite.objects.bulk_create(
+            [Favorite(user=user, product_id=product_id) for product_id in added], ignore_conflicts=True,
+        )
+    if added or removed:
+        refresh_favorite_counts([*added, *removed])
+    return added, removed
+
+
+def overlay_favorites(items, user):
+    """Set ``is_favorited`` and a current ``favorite_count`` on serialized
+    products for ``user``, with one ``Exists`` query for the whole page."""
+    ids = [item['id'] for item in items]
+    if not ids:
+        return items
+    rows = (
+        Product.objects.filter(pk__in=ids)
+        .annotate(is_favorited=Exists(Favorite.objects.filter(user=user, product=OuterRef('pk'))))
+        .values_list('pk', 'favorite_count', 'is_favorited')
+    )
+    state = {pk: (count, favorited) for pk, count, favorited in rows}
+    for item in items:
+        item['favorite_count'], item['is_favorited'] = state.get(item['id'], (item.get('favorite_count', 0), False))
+    return items
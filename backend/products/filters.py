@@ -0,0 +1,32 @@
+import django_filters
+from django.db.models import Q
+
+from .attributes import attribute_criteria, filter_products
+from .models import Category, Product
+
+
+class ProductFilter(django_filters.FilterSet):
+    """Product filters; variant attribute parameters (``color``, ``storage``,
+    ``ram``, ``attr.<key>``) are applied together in ``filter_queryset``."""
+
+    category__subtree = django_filters.CharFilter(method='filter_category_subtree')
+
+    class Meta:
+        model = Product
+        fields = {
+            'category__slug': ['exact'],
+            'brand__slug': ['exact'],
+            'product_type': ['exact'],
+            'base_price': ['gte', 'lte'],
+        }
+
+    def filter_category_subtree(self, queryset, name, value):
+        """Products in the category ``value`` or any of its descendants."""
+        category = Category.objects.filter(slug=value).only('path').first()
+        if category is None:
+            return queryset.none()
+        return queryset.filter(**category.subtree_lookup(prefix='category__'))
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return filter_products(queryset, attribute_criteria(self.data))
@@ -0,0 +1,583 @@
+"""Streaming bulk catalog import.
+
+Reads CSV or JSONL catalog files one row per variant and upserts
+``Category``, ``Brand``, ``Product``, ``ProductVariant``, ``ProductImage``
+and ``InventoryItem`` rows with bulk operations, ``chunk_size`` rows at a
+time, so memory stays bounded however large the file is. Foreign keys
+are resolved through in-memory slug/SKU maps that persist across chunks.
+
+Recognised columns (``category_slug``, ``brand_slug``, ``product_slug``,
+``sku`` and one of the two prices are required)::
+
+    category_slug, category_name, category_parent_slug
+    brand_slug, brand_name
+    product_slug, product_name, product_type, description, product_price
+    sku, color, storage, ram, attributes, variant_price, variant_active
+    image_url, image_alt, image_primary
+    branch_code, quantity, min_threshold
+
+Existing categories and brands take the names (and categories the
+parent) their rows give; a blank name or parent leaves them as they are.
+
+Bad rows are reported with their line number and skipped; they never
+abort the run.
+"""
+import csv
+import io
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from inventory.models import Branch, InventoryItem
+from inventory.stock import bump, per_item
+
+from .attributes import index_variants
+from .cache import bump_catalog_version
+from .models import Category, Brand, Product, ProductVariant, ProductImage
+from .search import get_search_backend
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+UNDECODABLE = "File is not valid UTF-8; stopped reading here."
+
+
+class CatalogImportError(ValueError):
+    pass
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line_number, row_dict)`` from a text stream.
+
+    A line that cannot be read yields ``(line_number, error)`` instead.
+    Bytes that are not valid UTF-8 end the file there: nothing after them
+    can be trusted to line up.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as exc:
+                # line_num has not counted the line that failed yet.
+                yield reader.line_num + 1, CatalogImportError(f"Malformed CSV: {exc}.")
+                continue
+            except UnicodeDecodeError:
+                yield reader.line_num + 1, CatalogImportError(UNDECODABLE)
+                return
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        lines = enumerate(stream, start=1)
+        line_number = 0
+        while True:
+            try:
+                line_number, line = next(lines)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                yield line_number + 1, CatalogImportError(UNDECODABLE)
+                return
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield line_number, exc
+                continue
+            yield line_number, row if isinstance(row, dict) else CatalogImportError("Row must be a JSON object.")
+    else:
+        raise CatalogImportError(f"Unsupported format: {fmt}")
+
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def _text(row, key, default=''):
+    value = row.get(key)
+    if value is None:
+        return default
+    return str(value).strip()
+
+
+def _decimal(row, key, required=False):
+    value = _text(row, key)
+    if not value:
+        if required:
+            raise CatalogImportError(f"{key} is required.")
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise CatalogImportError(f"{key} is not a number: {value!r}.")
+
+
+def _int(row, key, default=None):
+    value = _text(row, key)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise CatalogImportError(f"{key} is not an integer: {value!r}.")
+
+
+def _bool(row, key, default):
+    value = row.get(key)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def parse_row(row):
+    """Validate and normalise one raw row; raises ``CatalogImportError``."""
+    for key in ('category_slug', 'brand_slug', 'product_slug', 'sku'):
+        if not _text(row, key):
+            raise CatalogImportError(f"{key} is required.")
+
+    product_type = _text(row, 'product_type', Product.ProductType.OTHER) or Product.ProductType.OTHER
+    if product_type not in Product.ProductType.values:
+        raise CatalogImportError(f"Unknown product_type {product_type!r}.")
+
+    attributes = row.get('attributes') or {}
+    if isinstance(attributes, str):
+        try:
+            attributes = json.loads(attributes)
+        except ValueError:
+            raise CatalogImportError("attributes is not valid JSON.")
+    if not isinstance(attributes, dict):
+        raise CatalogImportError("attributes must be an object.")
+
+    product_price = _decimal(row, 'product_price')
+    variant_price = _decimal(row, 'variant_price')
+    if product_price is None and variant_price is None:
+        raise CatalogImportError("product_price or variant_price is required.")
+
+    quantity = _int(row, 'quantity')
+    branch_code = _text(row, 'branch_code')
+    if quantity is not None and not branch_code:
+        raise CatalogImportError("branch_code is required with quantity.")
+
+    return {
+        'category_slug': _text(row, 'category_slug'),
+        'category_name': _text(row, 'category_name'),
+        'category_parent_slug': _text(row, 'category_parent_slug'),
+        'brand_slug': _text(row, 'brand_slug'),
+        'brand_name': _text(row, 'brand_name'),
+        'product_slug': _text(row, 'product_slug'),
+        'product_name': _text(row, 'product_name') or _text(row, 'product_slug'),
+        'product_type': product_type,
+        'description': _text(row, 'description'),
+        'product_price': product_price if product_price is not None else variant_price,
+        'sku': _text(row, 'sku'),
+        'color': _text(row, 'color'),
+        'storage': _text(row, 'storage'),
+        'ram': _text(row, 'ram'),
+        'attributes': attributes,
+        'variant_price': variant_price if variant_price is not None else product_price,
+        'variant_active': _bool(row, 'variant_active', True),
+        'image_url': _text(row, 'image_url'),
+        'image_alt': _text(row, 'image_alt'),
+        'image_primary': _bool(row, 'image_primary', None),
+        'branch_code': branch_code,
+        'quantity': quantity,
+        'min_threshold': _int(row, 'min_threshold'),
+    }
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.created = {}
+        self.updated = {}
+        self.errors = []
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def count(self, bucket, model, n):
+        if n:
+            bucket[model.__name__] = bucket.get(model.__name__, 0) + n
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': str(message)})
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started
+
+    @property
+    def rows_per_sec(self):
+        elapsed = self.elapsed or time.monotonic() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'failed': self.failed,
+            'created': self.created,
+            'updated': self.updated,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_sec': round(self.rows_per_sec, 1),
+            'errors': self.errors,
+        }
+
+
+class CatalogImporter:
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.report = ImportReport()
+        # slug/SKU -> id maps shared by all chunks.
+        self.categories = {}
+        self.brands = {}
+        self.products = {}
+        self.variants = {}
+        self.branches = {}
+
+    def run(self, stream, fmt):
+        rows = read_rows(stream, fmt)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            self.import_chunk(chunk)
+            if self.progress:
+                self.progress(self.report)
+        self.report.finish()
+        if self.report.imported:
+            bump_catalog_version()
+        return self.report
+
+    def import_chunk(self, chunk):
+        report = self.report
+        parsed = []
+        for line, raw in chunk:
+            report.rows += 1
+            if isinstance(raw, Exception):
+                report.error(line, raw)
+                continue
+            try:
+                parsed.append((line, parse_row(raw)))
+            except CatalogImportError as exc:
+                report.error(line, exc)
+
+        if not parsed:
+            return
+        try:
+            with transaction.atomic():
+                parsed = self.upsert_categories(parsed)
+                parsed = self.upsert_brands(parsed)
+                product_ids = self.upsert_products(parsed)
+                self.upsert_variants(parsed)
+                self.upsert_images(parsed)
+                self.upsert_inventory(parsed)
+                get_search_backend().index_products(product_ids)
+        except DatabaseError as exc:
+            # Roll back the slug/SKU maps too: nothing from this chunk exists.
+            for line, row in parsed:
+                self.categories.pop(row['category_slug'], None)
+                self.brands.pop(row['brand_slug'], None)
+                self.products.pop(row['product_slug'], None)
+                self.variants.pop(row['sku'], None)
+                report.error(line, f"Chunk rolled back: {exc}")
+            return
+        report.imported += len(parsed)
+
+    def _load(self, model, field, keys, cache):
+        missing = {key for key in keys if key not in cache}
+        if missing:
+            for pk, key in model.objects.filter(**{f'{field}__in': missing}).values_list('pk', field):
+                cache[key] = pk
+        return missing - set(cache)
+
+    def upsert_categories(self, parsed):
+        slugs = {row['category_slug'] for _, row in parsed}
+        slugs |= {row['category_parent_slug'] for _, row in parsed if row['category_parent_slug']}
+        missing = self._load(Category, 'slug', slugs, self.categories)
+
+        names = {}
+        parents = {}
+        for _, row in parsed:
+            names.setdefault(row['category_slug'], row['category_name'])
+            if row['category_parent_slug']:
+                parents.setdefault(row['category_slug'], row['category_parent_slug'])
+
+        # Create missing categories parent-first; each pass creates the
+        # categories whose parent is already known.
+        pending = {slug for slug in missing if slug in names}
+        while pending:
+            ready = [slug for slug in pending if parents.get(slug, None) in (None, *self.categories)]
+            if not ready:
+                break
+            paths = dict(Category.objects.filter(
+                pk__in=[self.categories[parents[s]] for s in ready if s in parents]
+            ).values_list('pk', 'path'))
+            created = Category.objects.bulk_create([
+                Category(
+                    slug=slug,
+                    name=names[slug] or slug,
+                    parent_id=self.categories.get(parents.get(slug)),
+                )
+                for slug in ready
+            ])
+            for category in created:
+                self.categories[category.slug] = category.pk
+                parent_path = paths.get(category.parent_id, '')
+                category.path = f"{parent_path}{category.pk}/"
+                category.depth = parent_path.count('/')
+            Category.objects.bulk_update(created, ['path', 'depth'])
+            self.report.count(self.report.created, Category, len(created))
+            pending -= set(ready)
+
+        # Existing categories take the rows' names and parents. Moves go
+        # through save(), which re-roots the subtree and refuses cycles.
+        renamed, moved, refused = [], 0, {}
+        for category in Category.objects.filter(slug__in=[slug for slug in names if slug not in missing]):
+            name = names[category.slug] or category.name
+            parent_id = self.categories.get(parents.get(category.slug), category.parent_id)
+            if parent_id != category.parent_id:
+                category.name, category.parent_id = name, parent_id
+                try:
+                    category.save()
+                except ValueError as exc:
+                    refused[category.slug] = exc
+                    continue
+                moved += 1
+            elif name != category.name:
+                category.name = name
+                renamed.append(category)
+        Category.objects.bulk_update(renamed, ['name'])
+        for category in renamed:
+            get_search_backend().index_category(category.pk)
+        self.report.count(self.report.updated, Category, len(renamed) + moved)
+
+        kept = []
+        for line, row in parsed:
+            if row['category_slug'] in refused:
+                self.report.error(line, refused[row['category_slug']])
+            elif row['category_slug'] in self.categories and (
+                not row['category_parent_slug'] or row['category_parent_slug'] in self.categories
+            ):
+                kept.append((line, row))
+            else:
+                self.report.error(line, f"Unknown parent category {row['category_parent_slug']!r}.")
+        return kept
+
+    def upsert_brands(self, parsed):
+        names = {}
+        for _, row in parsed:
+            names.setdefault(row['brand_slug'], row['brand_name'])
+        missing = self._load(Brand, 'slug', names, self.brands)
+
+        # Brand names are unique: a brand cannot be created with, or renamed
+        # to, a name another brand holds or claims earlier in the chunk.
+        wanted = {slug: name or slug for slug, name in names.items() if slug in missing or name}
+        holders = dict(Brand.objects.filter(name__in=set(wanted.values())).values_list('name', 'slug'))
+        claimed, clashes = {}, set()
+        for slug, name in wanted.items():
+            if holders.get(name, slug) != slug or claimed.setdefault(name, slug) != slug:
+                clashes.add(slug)
+
+        to_create = [Brand(slug=slug, name=wanted[slug]) for slug in missing if slug not in clashes]
+        for brand in Brand.objects.bulk_create(to_create):
+            self.brands[brand.slug] = brand.pk
+        renamed = [
+            Brand(pk=self.brands[slug], slug=slug, name=name)
+            for slug, name in wanted.items()
+            if slug not in missing and slug not in clashes and holders.get(name) != slug
+        ]
+        Brand.objects.bulk_update(renamed, ['name'])
+        for brand in renamed:
+            get_search_backend().index_brand(brand.pk)
+        self.report.count(self.report.created, Brand, len(to_create))
+        self.report.count(self.report.updated, Brand, len(renamed))
+
+        kept = []
+        for line, row in parsed:
+            if row['brand_slug'] in self.brands and row['brand_slug'] not in clashes:
+                kept.append((line, row))
+            else:
+                name = wanted[row['brand_slug']]
+                self.report.error(line, f"Brand name {name!r} is used by another brand.")
+        return kept
+
+    def upsert_products(self, parsed):
+        rows = {}
+        for _, row in parsed:
+            rows[row['product_slug']] = row
+
+        now = timezone.now()
+
+        def apply(product, row):
+            product.updated_at = now
+            product.name = row['product_name']
+            product.category_id = self.categories[row['category_slug']]
+            product.brand_id = self.brands[row['brand_slug']]
+            product.product_type = row['product_type']
+            product.description = row['description']
+            product.base_price = row['product_price']
+
+        existing = list(Product.objects.filter(slug__in=rows))
+        for product in existing:
+            apply(product, rows[product.slug])
+        Product.objects.bulk_update(
+            existing, ['name', 'category', 'brand', 'product_type', 'description', 'base_price', 'updated_at'],
+        )
+        existing_slugs = {product.slug for product in existing}
+
+        to_create = []
+        for slug, row in rows.items():
+            if slug in existing_slugs:
+                continue
+            product = Product(slug=slug)
+            apply(product, row)
+            to_create.append(product)
+        created = Product.objects.bulk_create(to_create)
+
+        for product in [*existing, *created]:
+            self.products[product.slug] = product.pk
+        self.report.count(self.report.updated, Product, len(existing))
+        self.report.count(self.report.created, Product, len(created))
+        return [product.pk for product in [*existing, *created]]
+
+    def upsert_variants(self, parsed):
+        rows = {}
+        for _, row in parsed:
+            rows[row['sku']] = row
+
+        def apply(variant, row):
+            variant.product_id = self.products[row['product_slug']]
+            variant.color = row['color']
+            variant.storage = row['storage']
+            variant.ram = row['ram']
+            variant.attributes = row['attributes']
+            variant.base_price = row['variant_price']
+            variant.is_active = row['variant_active']
+
+        existing = list(ProductVariant.objects.filter(sku__in=rows))
+        for variant in existing:
+            apply(variant, rows[variant.sku])
+        ProductVariant.objects.bulk_update(
+            existing, ['product', 'color', 'storage', 'ram', 'attributes', 'base_price', 'is_active'],
+        )
+        existing_skus = {variant.sku for variant in existing}
+
+        to_create = []
+        for sku, row in rows.items():
+            if sku in existing_skus:
+                continue
+            variant = ProductVariant(sku=sku)
+            apply(variant, row)
+            to_create.append(variant)
+        created = ProductVariant.objects.bulk_create(to_create)
+
+        for variant in [*existing, *created]:
+            self.variants[variant.sku] = variant.pk
+        index_variants([variant.pk for variant in [*existing, *created]])
+        self.report.count(self.report.updated, ProductVariant, len(existing))
+        self.report.count(self.report.created, ProductVariant, len(created))
+
+    def upsert_images(self, parsed):
+        wanted = {}
+        for _, row in parsed:
+            if row['image_url']:
+                wanted.setdefault((self.products[row['product_slug']], row['image_url']), row)
+        if not wanted:
+            return
+        product_ids = {product_id for product_id, _ in wanted}
+        existing = {}
+        with_primary = set()
+        for image in ProductImage.objects.filter(product_id__in=product_ids):
+            existing[(image.product_id, image.image_url)] = image
+            if image.is_primary:
+                with_primary.add(image.product_id)
+
+        to_create, to_update = [], []
+        for (product_id, url), row in wanted.items():
+            image = existing.get((product_id, url))
+            if image is not None:
+                if row['image_alt'] and image.alt_text != row['image_alt']:
+                    image.alt_text = row['image_alt']
+                    to_update.append(image)
+                continue
+            primary = row['image_primary']
+            if primary is None:
+                primary = product_id not in with_primary
+            if primary:
+                with_primary.add(product_id)
+            to_create.append(ProductImage(product_id=product_id, image_url=url, alt_text=row['image_alt'], is_primary=primary))
+        ProductImage.objects.bulk_update(to_update, ['alt_text'])
+        ProductImage.objects.bulk_create(to_create)
+        self.report.count(self.report.updated, ProductImage, len(to_update))
+        self.report.count(self.report.created, ProductImage, len(to_create))
+
+    def upsert_inventory(self, parsed):
+        stock = {}
+        codes = set()
+        for _, row in parsed:
+            if row['quantity'] is None:
+                continue
+            codes.add(row['branch_code'])
+            stock[(row['branch_code'], self.variants[row['sku']])] = row
+        if not stock:
+            return
+
+        missing = self._load(Branch, 'code', codes, self.branches)
+        for branch in Branch.objects.bulk_create([Branch(code=code, name=code) for code in missing]):
+            self.branches[branch.code] = branch.pk
+
+        keyed = {(self.branches[code], variant_id): row for (code, variant_id), row in stock.items()}
+        existing = InventoryItem.objects.filter(
+            branch_id__in={branch_id for branch_id, _ in keyed},
+            variant_id__in={variant_id for _, variant_id in keyed},
+        )
+        quantities, thresholds = {}, {}
+        for item_id, branch_id, variant_id, min_threshold in existing.values_list(
+            'id', 'branch_id', 'variant_id', 'min_threshold',
+        ):
+            row = keyed.pop((branch_id, variant_id), None)
+            if row is None:
+                continue
+            quantities[item_id] = row['quantity']
+            thresholds[item_id] = min_threshold if row['min_threshold'] is None else row['min_threshold']
+        if quantities:
+            # One CASE UPDATE through bump(), so the rows' version and
+            # updated_at move like any other stock write.
+            InventoryItem.objects.filter(pk__in=quantities).update(
+                **bump(quantity=per_item(quantities), min_threshold=per_item(thresholds)),
+            )
+        InventoryItem.objects.bulk_create([
+            InventoryItem(
+                branch_id=branch_id,
+                variant_id=variant_id,
+                quantity=row['quantity'],
+                min_threshold=row['min_threshold'] or 0,
+            )
+            for (branch_id, variant_id), row in keyed.items()
+        ])
+        self.report.count(self.report.updated, InventoryItem, len(quantities))
+        self.report.count(self.report.created, InventoryItem, len(keyed))
+
+
+def import_catalog(stream, fmt='csv', chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Import a catalog from a text stream and return an ``ImportReport``."""
+    return CatalogImporter(chunk_size=chunk_size, progress=progress).run(stream, fmt)
+
+
+def text_stream(binary_file, encoding='utf-8'):
+    return io.TextIOWrapper(binary_file, encoding=encoding, newline='')
@@ -0,0 +1,73 @@
+"""values()-based rendering of product list pages.
+
+Produces exactly what ``ProductListSerializer(many=True)`` does for the
+same products, in the same number of queries (the page plus one for
+primary images), without building model or serializer instances.
+"""
+from rest_framework import serializers
+
+from backend.fastpath import Column, Const, RowMapper
+
+from .models import ProductImage
+from .pricing import PricedLine, price_lines
+
+PRODUCT_ROW = RowMapper({
+    'id': 'id',
+    'name': 'name',
+    'slug': 'slug',
+    'product_type': 'product_type',
+    'base_price': Column('base_price', serializers.DecimalField(max_digits=12, decimal_places=2)),
+    'is_active': 'is_active',
+    'category': RowMapper({
+        'id': 'category__id',
+        'name': 'category__name',
+        'slug': 'category__slug',
+        'parent': 'category__parent',
+    }),
+    'brand': RowMapper({
+        'id': 'brand__id',
+        'name': 'brand__name',
+        'slug': 'brand__slug',
+    }),
+    'primary_image': Const(None),
+    'promo_price': Const(None),
+    'favorite_count': 'favorite_count',
+})
+
+IMAGE_FIELDS = ('id', 'image_url', 'alt_text', 'is_primary', 'sort_order')
+
+
+def product_rows(queryset):
+    """``queryset`` as a values() queryset carrying everything the page needs.
+
+    Ordering columns and annotations (e.g. ``search_rank``) are kept so
+    keyset pagination can build cursors from the rows.
+    """
+    paths = PRODUCT_ROW.paths()
+    extra = [name for name in ['created_at', *queryset.query.annotations] if name not in paths]
+    return queryset.prefetch_related(None).values(*paths, *extra)
+
+
+def render_products(rows):
+    rows = list(rows)
+    items = PRODUCT_ROW.many(rows)
+    if not items:
+        return items
+    by_id = {item['id']: item for item in items}
+
+    # Same choice as primary_image_prefetch: primary first, then sort order.
+    images = (
+        ProductImage.objects.filter(product_id__in=by_id)
+        .order_by('product_id', '-is_primary', 'sort_order', 'id')
+        .values('product_id', *IMAGE_FIELDS)
+    )
+    for image in images:
+        item = by_id[image.pop('product_id')]
+        if item['primary_image'] is None:
+            item['primary_image'] = image
+
+    priced = price_lines([PricedLine(None, row['id'], 1, row['base_price']) for row in rows])
+    for line in priced:
+        if line.discount:
+            by_id[line.product_id]['promo_price'] = str(line.discounted_unit_price)
+    return items
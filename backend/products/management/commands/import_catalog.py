@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import DEFAULT_CHUNK_SIZE, CatalogImportError, detect_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV or JSONL catalog file into the database in bulk chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--show-errors', type=int, default=20, help="How many row errors to print.")
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+
+        def progress(report):
+            self.stdout.write(
+                f"{report.rows} rows, {report.failed} failed ({report.rows_per_sec:.0f} rows/sec)"
+            )
+
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as stream:
+                report = import_catalog(stream, fmt, chunk_size=options['chunk_size'], progress=progress)
+        except (OSError, CatalogImportError) as exc:
+            raise CommandError(str(exc))
+
+        for error in report.errors[:options['show_errors']]:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        summary = report.as_dict()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['imported']}/{summary['rows']} rows in {summary['elapsed_seconds']}s "
+            f"({summary['rows_per_sec']} rows/sec); created {summary['created']}, updated {summary['updated']}."
+        ))
+        if report.imported:
+            self.stdout.write("Run `manage.py refresh_related` to rebuild related-product lists.")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.related import refresh_queued, refresh_related
+
+
+class Command(BaseCommand):
+    help = "Recompute the precomputed related-products lists."
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int, help="Only refresh these products.")
+        parser.add_argument('--queued', action='store_true', help="Only refresh products queued by catalog edits.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['queued']:
+            count = refresh_queued(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Refreshed related products around {count} queued products."))
+            return
+        ids = options['product_ids'] or list(Product.objects.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+        for start in range(0, len(ids), batch_size):
+            refresh_related(ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed related products for {len(ids)} products."))
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.8 on 2026-10-17 17:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copy of products.attributes.attribute_pairs as of this
+# migration, so later changes to that module cannot change what it does.
+FIXED_ATTRIBUTES = ('color', 'storage', 'ram')
+NAME_MAX_LENGTH = 100
+VALUE_MAX_LENGTH = 255
+
+
+def normalize(value):
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    return str(value).strip().lower()
+
+
+def attribute_pairs(variant):
+    raw = [(name, getattr(variant, name)) for name in FIXED_ATTRIBUTES]
+    attributes = variant.attributes if isinstance(variant.attributes, dict) else {}
+    for name, value in attributes.items():
+        for item in value if isinstance(value, list) else [value]:
+            if item is not None and not isinstance(item, (dict, list)):
+                raw.append((normalize(name), item))
+    pairs = set()
+    for name, value in raw:
+        value = normalize(value)
+        if name and value and len(name) <= NAME_MAX_LENGTH and len(value) <= VALUE_MAX_LENGTH:
+            pairs.add((name, value))
+    return pairs
+
+
+def build_index(apps, schema_editor):
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    VariantAttribute = apps.get_model('products', 'VariantAttribute')
+    VariantAttribute.objects.bulk_create(
+        [
+            VariantAttribute(variant_id=variant.pk, product_id=variant.product_id, name=name, value=value)
+            for variant in ProductVariant.objects.filter(is_active=True).iterator()
+            for name, value in sorted(attribute_pairs(variant))
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_category_materialized_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariantAttribute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('value', models.CharField(max_length=255)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attribute_index', to='products.productvariant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['name', 'value', 'variant', 'product'], name='products_va_name_70dd3e_idx')],
+                'unique_together': {('variant', 'name', 'value')},
+            },
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-17 17:49
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_favorites(apps, schema_editor):
+    Favorite = apps.get_model('products', 'Favorite')
+    Product = apps.get_model('products', 'Product')
+    counts = (
+        Favorite.objects.filter(product=OuterRef('pk'))
+        .order_by().values('product').annotate(total=Count('pk')).values('total')
+    )
+    Product.objects.update(favorite_count=Coalesce(Subquery(counts), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_variantattribute'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='favorite_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='products_fa_user_id_dd8e07_idx'),
+        ),
+        migrations.RunPython(count_favorites, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 
 # Create your models here.
 from django.db import models
+from django.db.models.functions import Concat, Substr
 from django.conf import settings
 
 
@@ -15,10 +16,51 @@ class Category(models.Model):
         related_name='children',
         on_delete=models.CASCADE,
     )
+    # Materialized path of ancestor ids, e.g. "1/4/9/" (maintained in save()).
+    path = models.CharField(max_length=255, blank=True, default='', db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
 
+    def subtree_lookup(self, prefix=''):
+        """Range lookup matching this category and all its descendants.
+
+        Every descendant path starts with ``self.path`` ("1/4/"); ``'0'``
+        sorts right after ``'/'``, so ``[path, path[:-1] + '0')`` is exactly
+        that prefix, as an index-friendly range.
+        """
+        return {
+            f'{prefix}path__gte': self.path,
+            f'{prefix}path__lt': self.path[:-1] + '0',
+        }
+
+    def is_descendant_of(self, other):
+        return bool(other.path) and self.path.startswith(other.path)
+
+    def save(self, *args, **kwargs):
+        old_path, old_depth = self.path, self.depth
+        parent_path, parent_depth = '', -1
+        if self.parent_id:
+            parent_path, parent_depth = Category.objects.values_list('path', 'depth').get(pk=self.parent_id)
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError("A category cannot be moved under its own subtree.")
+        super().save(*args, **kwargs)
+
+        new_path = f"{parent_path}{self.pk}/"
+        new_depth = parent_depth + 1
+        if new_path == old_path:
+            return
+
+        Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        if old_path:
+            # Re-root descendants (still under the old path) in one UPDATE.
+            Category.objects.filter(**self.subtree_lookup()).exclude(pk=self.pk).update(
+                path=Concat(models.Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=models.F('depth') + (new_depth - old_depth),
+            )
+        self.path, self.depth = new_path, new_depth
+
 
 class Brand(models.Model):
     name = models.CharField(max_length=150, unique=True)
@@ -28,6 +70,38 @@ class Brand(models.Model):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_primary_image(self, lookup='images'):
+        """Prefetch images so the primary one is resolved in a single query.
+
+        Images are ordered primary-first, so ``primary_images[0]`` is the
+        same image ``images.filter(is_primary=True).first() or
+        images.first()`` would have returned. ``lookup`` lets related
+        querysets (e.g. favorites) prefetch through ``product__images``.
+        """
+        return self.prefetch_related(primary_image_prefetch(lookup))
+
+    def with_detail(self):
+        """Everything the product page shows: category and brand joined,
+        images in display order and active variants as ``active_variants``."""
+        return self.select_related('category', 'brand').prefetch_related(
+            models.Prefetch('images', queryset=ProductImage.objects.order_by('sort_order', 'id')),
+            models.Prefetch(
+                'variants',
+                queryset=ProductVariant.objects.filter(is_active=True).order_by('id'),
+                to_attr='active_variants',
+            ),
+        )
+
+
+def primary_image_prefetch(lookup='images'):
+    return models.Prefetch(
+        lookup,
+        queryset=ProductImage.objects.order_by('-is_primary', 'sort_order', 'id'),
+        to_attr='primary_images',
+    )
+
+
 class Product(models.Model):
     class ProductType(models.TextChoices):
         PHONE_TABLET = 'PHONE_TABLET', 'Phones & Tablets'
@@ -50,8 +124,19 @@ class Product(models.Model):
     base_price = models.DecimalField(max_digits=12, decimal_places=2)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized; kept in step by products.favorites.refresh_favorite_counts().
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Back keyset pagination for each catalog ordering (see pagination.py).
+        indexes = [
+            models.Index(fields=['is_active', 'created_at', 'id']),
+            models.Index(fields=['is_active', 'base_price', 'id']),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -70,6 +155,23 @@ class ProductVariant(models.Model):
         return f"{self.product.name} ({self.sku})"
 
 
+class VariantAttribute(models.Model):
+    """One (name, value) pair of an active variant, for indexed filtering.
+
+    Mirrors ``color``/``storage``/``ram`` and the scalar ``attributes``
+    keys with normalized values; maintained by ``products.attributes``.
+    """
+
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='attribute_index')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    name = models.CharField(max_length=100)
+    value = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('variant', 'name', 'value')
+        indexes = [models.Index(fields=['name', 'value', 'variant', 'product'])]
+
+
 class PromotionRule(models.Model):
     class RuleType(models.TextChoices):
         PERCENT_DISCOUNT = 'PERCENT_DISCOUNT', 'Percent discount'
@@ -112,6 +214,7 @@ class Favorite(models.Model):
 
     class Meta:
         unique_together = ('user', 'product')
+        indexes = [models.Index(fields=['user', 'created_at', 'id'])]
 
 
 class ProductRelation(models.Model):
@@ -137,4 +240,25 @@ class ProductSales(models.Model):
     
     class Meta:
         unique_together = ('product', 'variant', 'sale_date')
-        indexes = [models.Index(fields=['sale_date'])]
\ No newline at end of file
+        indexes = [models.Index(fields=['sale_date'])]
+
+
+class ProductNeighbor(models.Model):
+    """Precomputed, ranked related-product list (see ``products.related``)."""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbor_of')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'neighbor')
+        indexes = [models.Index(fields=['product', 'rank'])]
+
+
+class NeighborRefresh(models.Model):
+    """A product queued for ``products.related.refresh_queued``; at most
+    one row per product, so queueing it again is a no-op."""
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='+')
+    queued_at = models.DateTimeField(auto_now_add=True)
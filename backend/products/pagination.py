@@ -0,0 +1,164 @@
+import base64
+import functools
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    """Keyset ("seek") pagination on ``(<ordering field>, id)``.
+
+    The ordering comes from the view's ordering filter, so every allowed
+    ``?ordering=`` value pages correctly; ``id`` in the same direction is
+    appended as a tiebreaker. Each page is a range scan starting right after
+    the last row of the previous one, so page 500 costs the same as page 1
+    given a composite ``(field, id)`` index.
+
+    Cursors are opaque base64 tokens, returned as ``next``/``previous``
+    links. Pagination is opt-in: requests without ``cursor`` or
+    ``page_size`` get the plain unpaginated list, as before, unless
+    ``always_paginate`` is set.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 24
+    max_page_size = 100
+    tiebreaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+    always_paginate = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (not self.always_paginate
+                and self.cursor_query_param not in request.query_params
+                and self.page_size_query_param not in request.query_params):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field = self.get_ordering_field(request, queryset, view)
+        self.descending = self.field.startswith('-')
+        self.attname = self.field.lstrip('-')
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['d'] == 'p'
+
+        # Walking backwards flips the ordering; rows are re-reversed below.
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f"{prefix}{self.attname}", f"{prefix}{self.tiebreaker}")
+
+        if cursor is not None:
+            value = self.to_python(queryset.model, cursor['v'])
+            op = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f"{self.attname}__{op}": value})
+                | Q(**{self.attname: value, f"{self.tiebreaker}__{op}": cursor['id']})
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.page = rows
+        self.has_next = has_more if not reverse else True
+        self.has_previous = cursor is not None if not reverse else has_more
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering_field(self, request, queryset, view):
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    return ordering[0]
+        ordering = getattr(view, 'ordering', None) or ['-' + self.tiebreaker]
+        return ordering if isinstance(ordering, str) else ordering[0]
+
+    def to_python(self, model, value):
+        try:
+            field = model._meta.get_field(self.attname)
+        except FieldDoesNotExist:
+            field = None
+        # A tampered cursor can carry any JSON value: anything that does not
+        # convert is an invalid cursor, not a server error.
+        try:
+            if field is None:
+                # Annotations such as search_rank are plain floats.
+                return float(value)
+            return field.to_python(value)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, direction):
+        # Rows are model instances, or dicts for values() querysets.
+        get = row.get if isinstance(row, dict) else functools.partial(getattr, row)
+        value = get(self.attname)
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        payload = {'o': self.field, 'v': value, 'id': get(self.tiebreaker), 'd': direction}
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+            cursor = {'v': payload['v'], 'id': int(payload['id']), 'd': payload['d'], 'o': payload['o']}
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        # A cursor only makes sense for the ordering it was issued under.
+        if cursor['o'] != self.field or cursor['d'] not in ('n', 'p'):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], 'n')
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], 'p')
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
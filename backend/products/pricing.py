@@ -0,0 +1,219 @@
+"""Promotion pricing engine.
+
+Active ``PromotionRule`` rows are compiled into an in-memory index keyed
+by product and variant. The index is rebuilt only when rules change (a
+version number in the cross-process ``STATE_CACHE`` is bumped by
+``products.signals``, so a rule saved by any process reaches every
+worker); pricing itself never touches the database.
+
+Rule semantics, evaluated per line (variant, unit price, quantity) and
+only when ``min_qty <= quantity <= max_qty`` and the time window is open:
+
+- ``PERCENT_DISCOUNT`` / ``BULK_TIER``: ``discount_percent`` off every
+  unit, or ``discount_amount`` off every unit. Several ``BULK_TIER``
+  rules with increasing ``min_qty`` form a tier table.
+- ``FIXED_DISCOUNT``: ``discount_amount`` off every unit.
+- ``BUNDLE``: every complete set of ``min_qty`` units gets
+  ``discount_percent`` off the set, or ``discount_amount`` off the set.
+- ``GIFT``: no price change; the rule is reported in ``gifts``.
+
+Price rules do not stack: the line gets the single largest discount
+among its variant- and product-level rules.
+"""
+import bisect
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import Q
+from django.utils import timezone
+
+from backend.state import state_cache
+from .models import PromotionRule
+
+PROMOTIONS_VERSION_KEY = 'promotions:version'
+CENT = Decimal('0.01')
+HUNDRED = Decimal('100')
+
+RuleType = PromotionRule.RuleType
+
+
+def quantize(value):
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class CompiledRule:
+    __slots__ = ('id', 'rule_type', 'min_qty', 'max_qty', 'percent', 'amount', 'start_at', 'end_at')
+
+    def __init__(self, rule):
+        self.id = rule.id
+        self.rule_type = rule.rule_type
+        self.min_qty = rule.min_qty or 1
+        self.max_qty = rule.max_qty
+        self.percent = rule.discount_percent
+        self.amount = rule.discount_amount
+        self.start_at = rule.start_at
+        self.end_at = rule.end_at
+
+    def is_live(self, now):
+        return (self.start_at is None or self.start_at <= now) and (self.end_at is None or now < self.end_at)
+
+    def applies(self, quantity, now):
+        if quantity < self.min_qty or (self.max_qty is not None and quantity > self.max_qty):
+            return False
+        return self.is_live(now)
+
+    def discount(self, unit_price, quantity):
+        """Total discount this rule gives a line, never more than the line total."""
+        line_total = unit_price * quantity
+        if self.rule_type == RuleType.GIFT:
+            return Decimal('0')
+        if self.rule_type == RuleType.BUNDLE:
+            sets = quantity // self.min_qty
+            if self.percent is not None:
+                off = unit_price * self.min_qty * self.percent / HUNDRED * sets
+            else:
+                off = (self.amount or 0) * sets
+        elif self.percent is not None and self.rule_type != RuleType.FIXED_DISCOUNT:
+            off = line_total * self.percent / HUNDRED
+        else:
+            off = min(self.amount or Decimal('0'), unit_price) * quantity
+        return quantize(min(off, line_total))
+
+
+class PricedLine:
+    __slots__ = ('variant_id', 'product_id', 'quantity', 'unit_price', 'discount', 'rule_id', 'gifts')
+
+    def __init__(self, variant_id, product_id, quantity, unit_price):
+        self.variant_id = variant_id
+        self.product_id = product_id
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.discount = Decimal('0.00')
+        self.rule_id = None
+        self.gifts = []
+
+    @property
+    def line_total(self):
+        return quantize(self.unit_price * self.quantity)
+
+    @property
+    def discounted_total(self):
+        return self.line_total - self.discount
+
+    @property
+    def discounted_unit_price(self):
+        if not self.quantity:
+            return self.unit_price
+        return quantize(self.discounted_total / self.quantity)
+
+    def as_dict(self):
+        return {
+            'unit_price': self.unit_price,
+            'discounted_unit_price': self.discounted_unit_price,
+            'discount': self.discount,
+            'promotion_id': self.rule_id,
+            'gifts': self.gifts,
+        }
+
+
+class PromotionIndex:
+    def __init__(self, rules, version=None, now=None):
+        now = now or timezone.now()
+        self.version = version
+        self.by_variant = {}
+        self.by_product = {}
+        boundaries = set()
+        for rule in rules:
+            compiled = CompiledRule(rule)
+            if compiled.end_at is not None and compiled.end_at <= now:
+                continue
+            if rule.variant_id:
+                self.by_variant.setdefault(rule.variant_id, []).append(compiled)
+            elif rule.product_id:
+                self.by_product.setdefault(rule.product_id, []).append(compiled)
+            boundaries.update(t for t in (compiled.start_at, compiled.end_at) if t is not None)
+        # Start/end times at which some rule switches on or off.
+        self.boundaries = sorted(boundaries)
+
+    @classmethod
+    def build(cls, version=None):
+        rules = PromotionRule.objects.filter(is_active=True).filter(
+            Q(product__isnull=False) | Q(variant__isnull=False)
+        )
+        return cls(rules, version=version)
+
+    def epoch(self, now=None):
+        """How many rule start/end boundaries have passed; changes exactly
+        when the set of live rules can change without a write."""
+        return bisect.bisect_right(self.boundaries, now or timezone.now())
+
+    def seconds_until_change(self, now=None):
+        now = now or timezone.now()
+        index = bisect.bisect_right(self.boundaries, now)
+        if index == len(self.boundaries):
+            return None
+        return max(1, int((self.boundaries[index] - now).total_seconds()) + 1)
+
+    def price(self, line, now):
+        candidates = [*self.by_variant.get(line.variant_id, ()), *self.by_product.get(line.product_id, ())]
+        best = None
+        for rule in candidates:
+            if not rule.applies(line.quantity, now):
+                continue
+            if rule.rule_type == RuleType.GIFT:
+                line.gifts.append(rule.id)
+                continue
+            off = rule.discount(line.unit_price, line.quantity)
+            if off > 0 and (best is None or off > best[0]):
+                best = (off, rule.id)
+        if best is not None:
+            line.discount, line.rule_id = best
+        return line
+
+    def price_lines(self, lines, now=None):
+        now = now or timezone.now()
+        return [self.price(line, now) for line in lines]
+
+
+_index = None
+
+
+def get_promotions_version():
+    # Seeded from the clock rather than 1: the compiled index lives in
+    # process memory, so a flushed cache must not hand out a version an
+    # older index was already built for.
+    versions = state_cache()
+    version = versions.get(PROMOTIONS_VERSION_KEY)
+    if version is None:
+        versions.add(PROMOTIONS_VERSION_KEY, time.time_ns(), timeout=None)
+        version = versions.get(PROMOTIONS_VERSION_KEY)
+    return version
+
+
+def bump_promotions_version():
+    versions = state_cache()
+    try:
+        versions.incr(PROMOTIONS_VERSION_KEY)
+    except ValueError:
+        get_promotions_version()
+        versions.incr(PROMOTIONS_VERSION_KEY)
+
+
+def get_promotion_index():
+    """The compiled index for the current rules, rebuilt after rule changes."""
+    global _index
+    version = get_promotions_version()
+    if _index is None or _index.version != version:
+        _index = PromotionIndex.build(version=version)
+    return _index
+
+
+def price_lines(lines, now=None):
+    """Price ``PricedLine`` objects in one pass over the compiled index."""
+    return get_promotion_index().price_lines(lines, now=now)
+
+
+def price_products(products, now=None):
+    """Single-unit promo pricing for catalog listings: ``{product_id: PricedLine}``."""
+    lines = [PricedLine(None, product.id, 1, product.base_price) for product in products]
+    return {line.product_id: line for line in price_lines(lines, now=now)}
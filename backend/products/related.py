@@ -0,0 +1,171 @@
+"""Related-products engine.
+
+Each product gets a ranked neighbor list stored in ``ProductNeighbor``,
+scored from:
+
+- curated ``ProductRelation`` rows (bundle > accessory > related),
+- co-sales: products with ``ProductSales`` on the same days,
+- same category / same brand, and closeness in ``base_price``.
+
+Saving a product never scores anything itself: when a save touches what
+the scores depend on, ``products.signals`` queues the product as a
+``NeighborRefresh`` row, and ``manage.py refresh_related --queued``
+claims the queue in batches and refreshes the queued products and the
+lists around them. A plain
+``manage.py refresh_related`` rebuilds every list (co-sales only change
+there). ``ProductViewSet.related`` then serves a list with one indexed
+join.
+"""
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+
+from .cache import bump_catalog_version
+from .models import NeighborRefresh, Product, ProductNeighbor, ProductRelation, ProductSales
+
+NEIGHBORS_PER_PRODUCT = 12
+
+RELATION_WEIGHTS = {'bundle': 50.0, 'accessory': 40.0, 'related': 30.0}
+CO_SALES_WEIGHT = 20.0
+SAME_CATEGORY_WEIGHT = 10.0
+SAME_BRAND_WEIGHT = 5.0
+PRICE_WEIGHT = 5.0
+
+REFRESH_BATCH_SIZE = 500
+
+
+def score_neighbors(product):
+    """Return ``[(neighbor_id, score), ...]`` best first, ties broken by id."""
+    scores = {}
+
+    def add(product_id, points):
+        scores[product_id] = scores.get(product_id, 0.0) + points
+
+    relations = ProductRelation.objects.filter(product=product).values_list('related_product_id', 'relation_type')
+    for related_id, relation_type in relations:
+        add(related_id, RELATION_WEIGHTS.get(relation_type, 0.0))
+
+    sale_dates = ProductSales.objects.filter(product=product).values('sale_date')
+    co_sales = (
+        ProductSales.objects.filter(sale_date__in=sale_dates)
+        .exclude(product=product)
+        .values('product_id')
+        .annotate(quantity=Sum('quantity_sold'))
+    )
+    co_sales = {row['product_id']: row['quantity'] for row in co_sales}
+    if co_sales:
+        top = max(co_sales.values()) or 1
+        for product_id, quantity in co_sales.items():
+            add(product_id, CO_SALES_WEIGHT * quantity / top)
+
+    similar = (
+        Product.objects.filter(Q(category_id=product.category_id) | Q(brand_id=product.brand_id))
+        .exclude(id=product.id)
+        .values_list('id', 'category_id', 'brand_id', 'base_price')
+    )
+    price = product.base_price
+    for product_id, category_id, brand_id, other_price in similar:
+        points = 0.0
+        if category_id == product.category_id:
+            points += SAME_CATEGORY_WEIGHT
+        if brand_id == product.brand_id:
+            points += SAME_BRAND_WEIGHT
+        high = max(price, other_price)
+        if high > 0:
+            points += PRICE_WEIGHT * float(min(price, other_price) / high)
+        add(product_id, points)
+
+    scores.pop(product.id, None)
+    inactive = set(Product.objects.filter(id__in=scores, is_active=False).values_list('id', flat=True))
+    ranked = sorted(
+        ((product_id, score) for product_id, score in scores.items() if product_id not in inactive),
+        key=lambda item: (-item[1], item[0]),
+    )
+    return ranked[:NEIGHBORS_PER_PRODUCT]
+
+
+@transaction.atomic
+def refresh_related(product_ids):
+    """Recompute the neighbor lists of ``product_ids``, rewriting only the
+    lists that changed; returns how many did."""
+    products = list(Product.objects.filter(id__in=list(product_ids)))
+    if not products:
+        return 0
+    stored = {}
+    for product_id, neighbor_id, score in (
+        ProductNeighbor.objects.filter(product__in=products).order_by('product_id', 'rank')
+        .values_list('product_id', 'neighbor_id', 'score')
+    ):
+        stored.setdefault(product_id, []).append((neighbor_id, score))
+    changed = {}
+    for product in products:
+        ranked = score_neighbors(product)
+        if ranked != stored.get(product.id, []):
+            changed[product.id] = ranked
+    if not changed:
+        return 0
+    ProductNeighbor.objects.filter(product_id__in=changed).delete()
+    ProductNeighbor.objects.bulk_create([
+        ProductNeighbor(product_id=product_id, neighbor_id=neighbor_id, rank=rank, score=score)
+        for product_id, ranked in changed.items()
+        for rank, (neighbor_id, score) in enumerate(ranked)
+    ])
+    bump_catalog_version()
+    return len(changed)
+
+
+def refresh_around(product_ids):
+    """Refresh changed products, the lists they appear in and their own neighbors.
+
+    Scores are (mostly) symmetric, so a product's own best neighbors are
+    the lists it is most likely to have entered.
+    """
+    product_ids = set(product_ids)
+    listed_by = set(ProductNeighbor.objects.filter(neighbor_id__in=product_ids).values_list('product_id', flat=True))
+    refresh_related(product_ids)
+    own = set(ProductNeighbor.objects.filter(product_id__in=product_ids).values_list('neighbor_id', flat=True))
+    refresh_related((listed_by | own) - product_ids)
+
+
+def queue_refresh(product_ids):
+    """Queue ``product_ids`` for ``refresh_queued``."""
+    NeighborRefresh.objects.bulk_create(
+        [NeighborRefresh(product_id=product_id) for product_id in product_ids], ignore_conflicts=True,
+    )
+
+
+def claim_queued(batch_size):
+    """Take up to ``batch_size`` queued product ids off the queue; call
+    inside the transaction that refreshes them, so a failure puts them back."""
+    queued = NeighborRefresh.objects.order_by('pk')
+    # SQLite has no row locks; its write lock already serializes us.
+    if connection.features.has_select_for_update:
+        queued = queued.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+    product_ids = list(queued.values_list('product_id', flat=True)[:batch_size])
+    NeighborRefresh.objects.filter(product_id__in=product_ids).delete()
+    return product_ids
+
+
+def refresh_queued(batch_size=REFRESH_BATCH_SIZE):
+    """Refresh around every queued product; returns how many were queued.
+
+    Products queued while this runs are picked up by a later batch.
+    """
+    refreshed = 0
+    while True:
+        with transaction.atomic():
+            product_ids = claim_queued(batch_size)
+            if not product_ids:
+                return refreshed
+            refresh_around(product_ids)
+        refreshed += len(product_ids)
+
+
+def related_products(product, limit=5, queryset=None):
+    """Return the stored neighbors of ``product``.
+
+    Lists are never computed on read; a product nobody has refreshed yet
+    (e.g. straight out of a bulk import) has none until
+    ``refresh_related`` runs.
+    """
+    queryset = Product.objects.all() if queryset is None else queryset
+    return list(queryset.filter(neighbor_of__product=product, is_active=True).order_by('neighbor_of__rank')[:limit])
@@ -0,0 +1,157 @@
+"""Full-text product search.
+
+``ProductViewSet`` routes ``?search=`` through the backend configured by
+``settings.PRODUCT_SEARCH_BACKEND``. The SQLite backend keeps an FTS5
+virtual table in sync with products (see ``products.signals``); other
+engines can plug in their own backend implementing the same methods.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, Value, FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+FTS_TABLE = 'products_product_fts'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query: str) -> list[str]:
+    return _TOKEN_RE.findall(query or '')
+
+
+class DatabaseSearchBackend:
+    """Engine-agnostic fallback: ``icontains`` across the indexed fields."""
+
+    fields = ['name', 'description', 'brand__name', 'category__name']
+
+    def search(self, queryset, query):
+        terms = tokenize(query)
+        if not terms:
+            return queryset
+        for term in terms:
+            condition = Q()
+            for field in self.fields:
+                condition |= Q(**{f"{field}__icontains": term})
+            queryset = queryset.filter(condition)
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    def index_products(self, product_ids):
+        pass
+
+    def index_brand(self, brand_id):
+        pass
+
+    def index_category(self, category_id):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SQLiteFTSSearchBackend(DatabaseSearchBackend):
+    """SQLite FTS5 index ranked with bm25 (name weighs most, description least)."""
+
+    weights = (10.0, 1.0, 5.0, 3.0)  # name, description, brand_name, category_name
+
+    _select_rows = (
+        f"INSERT INTO {FTS_TABLE} (rowid, name, description, brand_name, category_name) "
+        "SELECT p.id, p.name, p.description, b.name, c.name "
+        "FROM products_product p "
+        "JOIN products_brand b ON b.id = p.brand_id "
+        "JOIN products_category c ON c.id = p.category_id "
+    )
+
+    @staticmethod
+    def match_expression(terms):
+        # Quote each token (neutralising FTS operators) and prefix-match it so
+        # results update as the shopper types.
+        return ' '.join('"{}"*'.format(term.replace('"', '')) for term in terms)
+
+    def search(self, queryset, query):
+        terms = tokenize(query)
+        if not terms:
+            return queryset
+        match = self.match_expression(terms)
+        table = queryset.model._meta.db_table
+        weights = ', '.join(str(w) for w in self.weights)
+        rank = RawSQL(
+            f"SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = \"{table}\".\"id\"",
+            (match,),
+            output_field=FloatField(),
+        )
+        matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+        return queryset.filter(id__in=matches).annotate(search_rank=rank)
+
+    def _delete(self, where, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT p.id FROM products_product p WHERE {where})", params)
+
+    def _reindex(self, where, params):
+        self._delete(where, params)
+        with connection.cursor() as cursor:
+            cursor.execute(self._select_rows + f"WHERE {where}", params)
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        self._reindex(f"p.id IN ({placeholders})", product_ids)
+
+    def index_brand(self, brand_id):
+        self._reindex("p.brand_id = %s", [brand_id])
+
+    def index_category(self, category_id):
+        self._reindex("p.category_id = %s", [category_id])
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", product_ids)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(self._select_rows)
+
+
+def get_search_backend():
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTSSearchBackend()
+    return DatabaseSearchBackend()
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """Drop-in replacement for ``SearchFilter`` backed by the search index."""
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not tokenize(query):
+            return queryset
+        return get_search_backend().search(queryset, query)
+
+
+class RelevanceOrderingFilter(filters.OrderingFilter):
+    """Order search results by relevance unless ``?ordering=`` is given."""
+
+    def get_default_ordering(self, view):
+        ordering = super().get_default_ordering(view) or []
+        request = getattr(view, 'request', None)
+        search_param = ProductSearchFilter.search_param
+        if request is not None and tokenize(request.query_params.get(search_param, '')):
+            return ['search_rank', *ordering]
+        return ordering
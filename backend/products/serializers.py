@@ -8,6 +8,8 @@ from .models import (
     ProductImage,
     Favorite,
 )
+from .favorites import refresh_favorite_counts
+from .pricing import price_products
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -15,6 +17,11 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name', 'slug', 'parent']
 
+    def validate_parent(self, parent):
+        if parent and self.instance and (parent == self.instance or parent.is_descendant_of(self.instance)):
+            raise serializers.ValidationError("A category cannot be moved under its own subtree.")
+        return parent
+
 
 class BrandSerializer(serializers.ModelSerializer):
     class Meta:
@@ -43,10 +50,20 @@ class ProductVariantSerializer(serializers.ModelSerializer):
         ]
 
 
+class PricedProductListSerializer(serializers.ListSerializer):
+    """Price the whole page against the promotion index in one call."""
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        self.child.promo_prices = price_products(items)
+        return super().to_representation(items)
+
+
 class ProductListSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     brand = BrandSerializer(read_only=True)
     primary_image = serializers.SerializerMethodField()
+    promo_price = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
@@ -60,10 +77,25 @@ class ProductListSerializer(serializers.ModelSerializer):
             'category',
             'brand',
             'primary_image',
+            'promo_price',
+            'favorite_count',
         ]
+        list_serializer_class = PricedProductListSerializer
+
+    def get_promo_price(self, obj):
+        line = getattr(self, 'promo_prices', {}).get(obj.id)
+        if line is None:
+            line = price_products([obj])[obj.id]
+        return str(line.discounted_unit_price) if line.discount else None
 
     def get_primary_image(self, obj):
-        img = obj.images.filter(is_primary=True).first() or obj.images.first()
+        # Querysets built with Product.objects.with_primary_image() carry the
+        # images pre-sorted primary-first; fall back to per-object queries.
+        prefetched = getattr(obj, 'primary_images', None)
+        if prefetched is not None:
+            img = prefetched[0] if prefetched else None
+        else:
+            img = obj.images.filter(is_primary=True).first() or obj.images.first()
         return ProductImageSerializer(img).data if img else None
 
 
@@ -71,7 +103,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     brand = BrandSerializer(read_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
-    variants = ProductVariantSerializer(many=True, read_only=True)
+    variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
@@ -89,6 +121,13 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             'variants',
         ]
 
+    def get_variants(self, obj):
+        # Prefetched by Product.objects.with_detail(); active variants only.
+        variants = getattr(obj, 'active_variants', None)
+        if variants is None:
+            variants = obj.variants.filter(is_active=True).order_by('id')
+        return ProductVariantSerializer(variants, many=True).data
+
 
 class FavoriteSerializer(serializers.ModelSerializer):
     product = ProductListSerializer(read_only=True)
@@ -105,5 +144,12 @@ class FavoriteSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = self.context['request'].user
         product = validated_data['product']
-        favorite, _ = Favorite.objects.get_or_create(user=user, product=product)
-        return favorite
\ No newline at end of file
+        favorite, created = Favorite.objects.get_or_create(user=user, product=product)
+        if created:
+            refresh_favorite_counts([product.pk])
+        return favorite
+
+
+class FavoriteBulkSerializer(serializers.Serializer):
+    product_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=500)
+    action = serializers.ChoiceField(choices=['toggle', 'add', 'remove'], default='toggle')
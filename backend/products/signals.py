@@ -0,0 +1,97 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from .attributes import index_variants
+from .cache import bump_catalog_version
+from .models import Category, Brand, Product, ProductVariant, ProductImage, ProductRelation, PromotionRule
+from .pricing import bump_promotions_version
+from .related import queue_refresh, refresh_related
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    get_search_backend().index_products([instance.pk])
+
+
+# The fields neighbor scores depend on; saves that leave them alone keep
+# every list as it is.
+NEIGHBOR_FIELDS = ('category', 'brand', 'base_price', 'is_active')
+
+
+@receiver(pre_save, sender=Product)
+def note_neighbor_changes(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not set(update_fields) & set(NEIGHBOR_FIELDS):
+        instance._neighbors_stale = False
+        return
+    columns = [Product._meta.get_field(name).attname for name in NEIGHBOR_FIELDS]
+    before = Product.objects.filter(pk=instance.pk).values_list(*columns).first()
+    instance._neighbors_stale = before != tuple(getattr(instance, column) for column in columns)
+
+
+@receiver(post_save, sender=Product)
+def queue_product_neighbors(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if created or getattr(instance, '_neighbors_stale', True):
+        queue_refresh([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariant)
+def index_variant_attributes(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    index_variants([instance.pk])
+
+
+@receiver(post_save, sender=ProductRelation)
+@receiver(post_delete, sender=ProductRelation)
+def refresh_relation_neighbors(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    refresh_related([instance.product_id])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Brand)
+def index_brand_products(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    get_search_backend().index_brand(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    get_search_backend().index_category(instance.pk)
+
+
+@receiver(post_save, sender=PromotionRule)
+@receiver(post_delete, sender=PromotionRule)
+def recompile_promotions(sender, raw=False, **kwargs):
+    if raw:
+        return
+    bump_promotions_version()
+
+
+CATALOG_MODELS = (Product, ProductVariant, ProductImage, Category, Brand, ProductRelation, PromotionRule)
+
+
+def bump_catalog(sender, raw=False, **kwargs):
+    if raw:
+        return
+    bump_catalog_version()
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(bump_catalog, sender=model, dispatch_uid=f'bump_catalog_{model.__name__}_save')
+    post_delete.connect(bump_catalog, sender=model, dispatch_uid=f'bump_catalog_{model.__name__}_delete')
@@ -1,3 +1,954 @@
+import base64
+import csv
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from backend.fastpath import FastJSONRenderer
+from inventory.models import Branch, InventoryItem
+from inventory.stock import compare_and_swap
+
+from .models import (
+    Category,
+    Brand,
+    Product,
+    ProductVariant,
+    ProductImage,
+    Favorite,
+    NeighborRefresh,
+    ProductNeighbor,
+    ProductRelation,
+    ProductSales,
+    PromotionRule,
+)
+from . import related
+from .attributes import matching_attributes
+from .cache import CATALOG_VERSION_KEY, get_catalog_version
+from .listing import product_rows, render_products
+from .pricing import PROMOTIONS_VERSION_KEY, PricedLine, get_promotion_index, price_lines
+from .related import queue_refresh, refresh_queued, refresh_related
+from .serializers import ProductListSerializer
+
+User = get_user_model()
+
+
+def reset_cache():
+    """Clear the caches (the catalog and promotion versions live in the
+    state cache) and recompile the promotion index so query counts
+    measure the request alone."""
+    cache.clear()
+    caches['state'].clear()
+    get_promotion_index()
+
+
+def make_products(count, category=None, brand=None, prefix='p'):
+    category = category or Category.objects.get_or_create(slug='phones', defaults={'name': 'Phones'})[0]
+    brand = brand or Brand.objects.get_or_create(slug='acme', defaults={'name': 'Acme'})[0]
+    products = []
+    for i in range(count):
+        product = Product.objects.create(
+            name=f"Product {prefix}{i}",
+            slug=f"{prefix}-{i}",
+            category=category,
+            brand=brand,
+            base_price=Decimal('100.00') + i,
+        )
+        ProductImage.objects.create(product=product, image_url=f"https://img.test/{prefix}{i}-a.jpg", sort_order=0)
+        ProductImage.objects.create(
+            product=product,
+            image_url=f"https://img.test/{prefix}{i}-primary.jpg",
+            is_primary=True,
+            sort_order=1,
+        )
+        products.append(product)
+    return products
+
+
+class PrimaryImageQueryCountTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.client = APIClient()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_product_list_query_count_is_independent_of_size(self):
+        make_products(2, prefix='small')
+        small, _ = self.count_queries('/api/products/')
+        make_products(20, prefix='large')
+        large, response = self.count_queries('/api/products/')
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.json()), 22)
+
+    def test_primary_image_prefers_is_primary(self):
+        make_products(1)
+        _, response = self.count_queries('/api/products/')
+        self.assertTrue(response.json()[0]['primary_image']['image_url'].endswith('-primary.jpg'))
+
+    def test_primary_image_falls_back_to_first_image(self):
+        product = make_products(1)[0]
+        product.images.filter(is_primary=True).delete()
+        _, response = self.count_queries('/api/products/')
+        self.assertTrue(response.json()[0]['primary_image']['image_url'].endswith('-a.jpg'))
+
+    def test_favorite_list_query_count_is_independent_of_size(self):
+        user = User.objects.create_user(username='fav', email='fav@example.com')
+        self.client.force_authenticate(user)
+        for product in make_products(2, prefix='small'):
+            Favorite.objects.create(user=user, product=product)
+        small, _ = self.count_queries('/api/products/favorites/')
+        for product in make_products(15, prefix='large'):
+            Favorite.objects.create(user=user, product=product)
+        large, response = self.count_queries('/api/products/favorites/')
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.json()), 17)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.client = APIClient()
+        self.phones = Category.objects.create(name='Smartphones', slug='smartphones')
+        self.audio = Category.objects.create(name='Headphones', slug='headphones')
+        self.apple = Brand.objects.create(name='Apple', slug='apple')
+        self.sony = Brand.objects.create(name='Sony', slug='sony')
+        self.iphone = Product.objects.create(
+            name='iPhone 15 Pro', slug='iphone-15-pro', category=self.phones, brand=self.apple,
+            description='Titanium flagship phone', base_price=Decimal('999.00'),
+        )
+        self.headphones = Product.objects.create(
+            name='WH-1000XM5', slug='wh-1000xm5', category=self.audio, brand=self.sony,
+            description='Noise cancelling headphones that pair with any iPhone', base_price=Decimal('399.00'),
+        )
+
+    def search(self, query, **params):
+        response = self.client.get('/api/products/', {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['slug'] for row in response.json()]
+
+    def test_results_are_ranked_by_relevance(self):
+        self.assertEqual(self.search('iphone'), ['iphone-15-pro', 'wh-1000xm5'])
+
+    def test_prefix_and_multi_term_queries(self):
+        self.assertEqual(self.search('titan'), ['iphone-15-pro'])
+        self.assertEqual(self.search('sony noise'), ['wh-1000xm5'])
+        self.assertEqual(self.search('"OR*'), [])
+
+    def test_explicit_ordering_overrides_relevance(self):
+        self.assertEqual(self.search('iphone', ordering='base_price'), ['wh-1000xm5', 'iphone-15-pro'])
+
+    def test_index_follows_product_brand_and_category_changes(self):
+        self.iphone.name = 'Galaxy S24'
+        self.iphone.save()
+        self.assertEqual(self.search('galaxy'), ['iphone-15-pro'])
+
+        self.sony.name = 'Bose'
+        self.sony.save()
+        self.assertEqual(self.search('bose'), ['wh-1000xm5'])
+
+        self.audio.name = 'Earbuds'
+        self.audio.save()
+        self.assertEqual(self.search('earbuds'), ['wh-1000xm5'])
+
+        self.headphones.delete()
+        self.assertEqual(self.search('bose'), [])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.client = APIClient()
+        self.products = make_products(7)
+        # Duplicate prices force the id tiebreaker to do its job.
+        Product.objects.filter(slug__in=['p-1', 'p-2', 'p-3']).update(base_price=Decimal('50.00'))
+
+    def walk(self, url, params):
+        slugs, response = [], self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            slugs.extend(row['slug'] for row in body['results'])
+            if not body['next']:
+                return slugs, body
+            response = self.client.get(body['next'])
+
+    def test_unpaginated_without_opt_in(self):
+        response = self.client.get('/api/products/')
+        self.assertIsInstance(response.json(), list)
+
+    def test_every_ordering_pages_through_whole_catalog(self):
+        for ordering in ['-created_at', 'created_at', 'base_price', '-base_price']:
+            tiebreaker = '-id' if ordering.startswith('-') else 'id'
+            expected = list(Product.objects.order_by(ordering, tiebreaker).values_list('slug', flat=True))
+            slugs, _ = self.walk('/api/products/', {'ordering': ordering, 'page_size': 2})
+            self.assertEqual(slugs, expected, ordering)
+
+    def test_previous_link_returns_prior_page(self):
+        first = self.client.get('/api/products/', {'ordering': 'base_price', 'page_size': 3}).json()
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_page_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as first_ctx:
+            first = self.client.get('/api/products/', {'page_size': 2}).json()
+        with CaptureQueriesContext(connection) as deep_ctx:
+            self.client.get(first['next'])
+        self.assertEqual(len(first_ctx.captured_queries), len(deep_ctx.captured_queries))
+
+    def test_cursor_is_bound_to_its_ordering(self):
+        first = self.client.get('/api/products/', {'ordering': 'base_price', 'page_size': 2}).json()
+        cursor = first['next'].split('cursor=')[1].split('&')[0]
+        response = self.client.get('/api/products/', {'ordering': '-created_at', 'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/products/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_values_that_do_not_convert_are_rejected(self):
+        def cursor(ordering, value):
+            payload = {'o': ordering, 'v': value, 'id': 1, 'd': 'n'}
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        for params in [
+            {'ordering': '-created_at', 'cursor': cursor('-created_at', [1])},
+            {'ordering': 'base_price', 'cursor': cursor('base_price', 'cheap')},
+            {'search': 'p', 'cursor': cursor('search_rank', 'high')},
+            {'search': 'p', 'cursor': cursor('search_rank', None)},
+        ]:
+            response = self.client.get('/api/products/', params)
+            self.assertEqual(response.status_code, 404, params)
+
+
+class RelatedProductsTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.client = APIClient()
+        self.phones = Category.objects.create(name='Phones', slug='phones')
+        self.cases = Category.objects.create(name='Cases', slug='cases')
+        self.acme = Brand.objects.create(name='Acme', slug='acme')
+        self.other = Brand.objects.create(name='Other', slug='other')
+        self.phone = self.create('phone', self.phones, self.acme, '1000.00')
+        self.twin = self.create('twin', self.phones, self.acme, '990.00')
+        self.cheap = self.create('cheap', self.phones, self.other, '100.00')
+        self.case = self.create('case', self.cases, self.other, '20.00')
+        refresh_queued()
+
+    def create(self, slug, category, brand, price):
+        return Product.objects.create(
+            name=slug.title(), slug=slug, category=category, brand=brand, base_price=Decimal(price),
+        )
+
+    def queued(self):
+        return list(NeighborRefresh.objects.order_by('pk').values_list('product_id', flat=True))
+
+    def related(self, product):
+        response = self.client.get(f'/api/products/{product.slug}/related/')
+        self.assertEqual(response.status_code, 200)
+        return [row['slug'] for row in response.json()]
+
+    def test_ranking_is_deterministic(self):
+        self.assertEqual(self.related(self.phone), ['twin', 'cheap'])
+        self.assertEqual(self.related(self.phone), ['twin', 'cheap'])
+
+    def test_curated_relations_and_co_sales_rank_first(self):
+        ProductRelation.objects.create(product=self.phone, related_product=self.case, relation_type='accessory')
+        self.assertEqual(self.related(self.phone), ['case', 'twin', 'cheap'])
+
+        day = date(2025, 1, 1)
+        ProductSales.objects.create(product=self.cheap, sale_date=day, quantity_sold=5, revenue=Decimal('500'))
+        ProductSales.objects.create(product=self.phone, sale_date=day, quantity_sold=1, revenue=Decimal('1000'))
+        # Co-sales are picked up by the periodic refresh.
+        call_command('refresh_related', stdout=StringIO())
+        self.assertEqual(self.related(self.phone), ['case', 'cheap', 'twin'])
+
+    def test_catalog_changes_refresh_lists_incrementally(self):
+        self.related(self.phone)
+        newcomer = self.create('newcomer', self.phones, self.acme, '1000.00')
+        call_command('refresh_related', '--queued', stdout=StringIO())
+        self.assertEqual(self.related(self.phone)[0], 'newcomer')
+
+        newcomer.is_active = False
+        newcomer.save()
+        refresh_queued()
+        self.assertNotIn('newcomer', self.related(self.phone))
+        self.assertFalse(ProductNeighbor.objects.filter(neighbor=newcomer).exists())
+
+    def test_saves_only_queue_the_refresh(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.phone.base_price = Decimal('500.00')
+            self.phone.save()
+        self.assertFalse([q for q in ctx.captured_queries if 'products_productsales' in q['sql']])
+        self.assertFalse([q for q in ctx.captured_queries if 'products_productneighbor' in q['sql']])
+        self.assertEqual(self.queued(), [self.phone.id])
+
+    def test_saves_that_leave_scored_fields_alone_queue_nothing(self):
+        self.phone.name = 'Renamed'
+        self.phone.save()
+        self.twin.description = 'New copy'
+        self.twin.save(update_fields=['description'])
+        self.assertEqual(self.queued(), [])
+
+    def test_products_queued_during_a_refresh_are_not_lost(self):
+        queue_refresh([self.phone.id, self.phone.id])
+        self.assertEqual(self.queued(), [self.phone.id])
+        real_refresh_around = related.refresh_around
+
+        def save_meanwhile(product_ids):
+            if self.case.id not in product_ids:
+                queue_refresh([self.case.id])
+            real_refresh_around(product_ids)
+
+        with mock.patch('products.related.refresh_around', side_effect=save_meanwhile) as refresh_around:
+            self.assertEqual(refresh_queued(), 2)
+        self.assertEqual([call.args[0] for call in refresh_around.call_args_list], [[self.phone.id], [self.case.id]])
+        self.assertEqual(self.queued(), [])
+
+    def test_served_from_stored_list(self):
+        self.related(self.phone)
+        reset_cache()
+        with CaptureQueriesContext(connection) as ctx:
+            self.related(self.phone)
+        # product lookup and neighbor join, each with its image prefetch
+        self.assertEqual(len(ctx.captured_queries), 4)
+
+    def test_reads_never_compute_or_invalidate(self):
+        ProductNeighbor.objects.all().delete()
+        version = get_catalog_version()
+        self.assertEqual(self.related(self.phone), [])
+        self.assertEqual(get_catalog_version(), version)
+        self.assertFalse(ProductNeighbor.objects.exists())
+
+    def test_unchanged_lists_are_not_rewritten(self):
+        version = get_catalog_version()
+        self.assertEqual(refresh_related([self.phone.id, self.case.id]), 0)
+        self.assertEqual(get_catalog_version(), version)
+        ProductNeighbor.objects.filter(product=self.phone).delete()
+        self.assertEqual(refresh_related([self.phone.id, self.case.id]), 1)
+        self.assertNotEqual(get_catalog_version(), version)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.client = APIClient()
+        self.product = make_products(1)[0]
+        self.variant = ProductVariant.objects.create(
+            product=self.product, sku='SKU-1', color='Black', base_price=Decimal('100.00'),
+        )
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers=headers)
+
+    def test_repeat_reads_skip_the_view(self):
+        for url in ['/api/products/', '/api/products/p-0/', '/api/products/p-0/variants/',
+                    '/api/products/categories/', '/api/products/brands/']:
+            first = self.get(url)
+            self.assertEqual(first.status_code, 200, url)
+            with CaptureQueriesContext(connection) as ctx:
+                second = self.get(url)
+            self.assertEqual(len(ctx.captured_queries), 0, url)
+            self.assertEqual(second.json(), first.json())
+            self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.get('/api/products/p-0/')['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get('/api/products/p-0/', If_None_Match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_bumps_from_another_process_invalidate(self):
+        etag = self.get('/api/products/p-0/')['ETag']
+        # A fresh handle on the state alias stands in for a command or
+        # another worker; this process's default cache never sees it.
+        caches.create_connection('state').incr(CATALOG_VERSION_KEY)
+        self.assertIsNone(cache.get(CATALOG_VERSION_KEY))
+        response = self.get('/api/products/p-0/', If_None_Match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_query_string_order_does_not_matter(self):
+        a = self.get('/api/products/?ordering=base_price&product_type=OTHER')['ETag']
+        b = self.get('/api/products/?product_type=OTHER&ordering=base_price')['ETag']
+        self.assertEqual(a, b)
+
+    def test_writes_invalidate(self):
+        etag = self.get('/api/products/p-0/variants/')['ETag']
+        for write in [
+            lambda: ProductVariant.objects.create(product=self.product, sku='SKU-2', base_price=Decimal('1')),
+            lambda: ProductImage.objects.create(product=self.product, image_url='https://img.test/x.jpg'),
+            lambda: Brand.objects.filter(slug='acme').get().save(),
+            lambda: Category.objects.filter(slug='phones').get().save(),
+            lambda: self.variant.delete(),
+        ]:
+            write()
+            response = self.get('/api/products/p-0/variants/', If_None_Match=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+        self.assertEqual([v['sku'] for v in response.json()], ['SKU-2'])
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.get('/api/products/missing/').status_code, 404)
+        make_products(1, prefix='missing')
+        Product.objects.filter(slug='missing-0').update(slug='missing')
+        self.assertEqual(self.get('/api/products/missing/').status_code, 200)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.client = APIClient()
+        phones = Category.objects.create(name='Phones', slug='phones')
+        audio = Category.objects.create(name='Audio', slug='audio')
+        apple = Brand.objects.create(name='Apple', slug='apple')
+        sony = Brand.objects.create(name='Sony', slug='sony')
+        for slug, category, brand, kind, price in [
+            ('iphone', phones, apple, Product.ProductType.PHONE_TABLET, '1199.00'),
+            ('xperia', phones, sony, Product.ProductType.PHONE_TABLET, '899.00'),
+            ('airpods', audio, apple, Product.ProductType.AUDIO, '249.00'),
+            ('wh1000', audio, sony, Product.ProductType.AUDIO, '399.00'),
+            ('earbuds', audio, sony, Product.ProductType.AUDIO, '49.00'),
+        ]:
+            Product.objects.create(
+                name=slug, slug=slug, category=category, brand=brand,
+                product_type=kind, base_price=Decimal(price),
+            )
+
+    def facets(self, **params):
+        response = self.client.get('/api/products/facets/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_for_whole_catalog(self):
+        data = self.facets()
+        self.assertEqual(data['total'], 5)
+        self.assertEqual([(b['slug'], b['count']) for b in data['brands']], [('sony', 3), ('apple', 2)])
+        self.assertEqual([(c['slug'], c['count']) for c in data['categories']], [('audio', 3), ('phones', 2)])
+        self.assertEqual(
+            [(t['value'], t['count']) for t in data['product_types']],
+            [('AUDIO', 3), ('PHONE_TABLET', 2)],
+        )
+        self.assertEqual([b['count'] for b in data['price_buckets']], [1, 2, 1, 1, 0])
+        self.assertEqual(data['price_buckets'][0], {'min': None, 'max': '100.00', 'count': 1})
+
+    def test_counts_respect_filters_and_search(self):
+        data = self.facets(brand__slug='sony', base_price__gte='100')
+        self.assertEqual(data['total'], 2)
+        self.assertEqual([(c['slug'], c['count']) for c in data['categories']], [('audio', 1), ('phones', 1)])
+        self.assertEqual(self.facets(search='airpods')['total'], 1)
+
+    def test_one_query_and_cached_by_filter_signature(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.facets(category__slug='audio', ordering='base_price')
+        self.assertEqual(len(ctx.captured_queries), 1)
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.facets(category__slug='audio', ordering='-created_at', product_type='')
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(data['total'], 3)
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.client = APIClient()
+        self.computers = Category.objects.create(name='Computers', slug='computers')
+        self.laptops = Category.objects.create(name='Laptops', slug='laptops', parent=self.computers)
+        self.gaming = Category.objects.create(name='Gaming', slug='gaming', parent=self.laptops)
+        self.phones = Category.objects.create(name='Phones', slug='phones')
+        brand = Brand.objects.create(name='Acme', slug='acme')
+        for slug, category in [('desk', self.computers), ('ultra', self.laptops), ('rog', self.gaming), ('pixel', self.phones)]:
+            Product.objects.create(name=slug, slug=slug, category=category, brand=brand, base_price=Decimal('1.00'))
+
+    def subtree(self, slug):
+        response = self.client.get('/api/products/', {'category__subtree': slug})
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['slug'] for row in response.json())
+
+    def test_paths_are_materialized(self):
+        self.gaming.refresh_from_db()
+        self.assertEqual(self.gaming.path, f"{self.computers.pk}/{self.laptops.pk}/{self.gaming.pk}/")
+        self.assertEqual(self.gaming.depth, 2)
+
+    def test_subtree_filter_includes_descendants(self):
+        self.assertEqual(self.subtree('computers'), ['desk', 'rog', 'ultra'])
+        self.assertEqual(self.subtree('laptops'), ['rog', 'ultra'])
+        self.assertEqual(self.subtree('missing'), [])
+
+    def test_moving_a_category_moves_its_subtree(self):
+        self.laptops.parent = self.phones
+        self.laptops.save()
+        self.gaming.refresh_from_db()
+        self.assertEqual(self.gaming.path, f"{self.phones.pk}/{self.laptops.pk}/{self.gaming.pk}/")
+        self.assertEqual(self.gaming.depth, 2)
+        self.assertEqual(self.subtree('computers'), ['desk'])
+        self.assertEqual(self.subtree('phones'), ['pixel', 'rog', 'ultra'])
+
+        self.laptops.parent = None
+        self.laptops.save()
+        self.gaming.refresh_from_db()
+        self.assertEqual(self.gaming.depth, 1)
+
+    def test_cannot_move_under_own_subtree(self):
+        self.computers.parent = self.gaming
+        with self.assertRaises(ValueError):
+            self.computers.save()
+
+    def test_tree_endpoint_is_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/products/categories/tree/')
+        self.assertEqual(len(ctx.captured_queries), 1)
+        tree = response.json()
+        self.assertEqual([node['slug'] for node in tree], ['computers', 'phones'])
+        laptops = tree[0]['children'][0]
+        self.assertEqual(laptops['slug'], 'laptops')
+        self.assertEqual([child['slug'] for child in laptops['children']], ['gaming'])
+
+
+class CatalogImportTests(TestCase):
+    CSV = (
+        "category_slug,category_name,category_parent_slug,brand_slug,brand_name,product_slug,product_name,"
+        "product_type,product_price,sku,color,storage,attributes,variant_price,image_url,branch_code,quantity\n"
+        "electronics,Electronics,,apple,Apple,iphone,iPhone,PHONE_TABLET,999,IPH-128,Black,128GB,,,"
+        "https://img.test/iphone.jpg,main,5\n"
+        "phones,Phones,electronics,apple,Apple,iphone,iPhone,PHONE_TABLET,999,IPH-256,Black,256GB,"
+        "\"{\"\"finish\"\": \"\"matte\"\"}\",1099,https://img.test/iphone.jpg,main,3\n"
+        "phones,Phones,electronics,sony,Sony,xperia,Xperia,NOT_A_TYPE,799,XP-1,,,,,,,\n"
+        "phones,Phones,electronics,sony,Sony,xperia,Xperia 1,PHONE_TABLET,,XP-1,,,,,,,\n"
+        "audio,Audio,missing-parent,sony,Sony,wh,WH,AUDIO,399,WH-1,,,,,,,\n"
+        "phones,Phones,electronics,sony,Sony,xperia,Xperia 1 V,PHONE_TABLET,899,XP-1,Green,,,,,outlet,2\n"
+    )
+
+    def run_command(self, content, suffix='.csv', chunk_size=2):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as handle:
+            handle.write(content)
+        self.addCleanup(os.remove, handle.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', handle.name, chunk_size=chunk_size, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_upserts_everything_and_reports_errors(self):
+        out, err = self.run_command(self.CSV)
+        self.assertIn('Imported 3/6 rows', out)
+        self.assertIn('line 4: Unknown product_type', err)
+        self.assertIn('line 5: product_price or variant_price is required.', err)
+        self.assertIn("line 6: Unknown parent category 'missing-parent'", err)
+
+        phones = Category.objects.get(slug='phones')
+        electronics = Category.objects.get(slug='electronics')
+        self.assertEqual(phones.parent, electronics)
+        self.assertEqual(phones.path, f"{electronics.pk}/{phones.pk}/")
+        iphone = Product.objects.get(slug='iphone')
+        self.assertEqual(iphone.variants.count(), 2)
+        self.assertEqual(iphone.images.count(), 1)
+        self.assertTrue(iphone.images.get().is_primary)
+        self.assertEqual(ProductVariant.objects.get(sku='IPH-256').attributes, {'finish': 'matte'})
+        self.assertEqual(ProductVariant.objects.get(sku='IPH-256').base_price, Decimal('1099'))
+        # The last row for XP-1 wins, across chunk boundaries.
+        xperia = Product.objects.get(slug='xperia')
+        self.assertEqual((xperia.name, xperia.base_price), ('Xperia 1 V', Decimal('899')))
+        self.assertEqual(ProductVariant.objects.get(sku='XP-1').color, 'Green')
+        self.assertEqual(
+            sorted(InventoryItem.objects.values_list('branch__code', 'variant__sku', 'quantity')),
+            [('main', 'IPH-128', 5), ('main', 'IPH-256', 3), ('outlet', 'XP-1', 2)],
+        )
+        # Imported products are searchable.
+        response = APIClient().get('/api/products/', {'search': 'xperia'})
+        self.assertEqual([row['slug'] for row in response.json()], ['xperia'])
+
+    def test_reimport_updates_in_place(self):
+        self.run_command(self.CSV)
+        self.run_command(self.CSV.replace('main,5', 'main,50'))
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(ProductVariant.objects.count(), 3)
+        self.assertEqual(ProductImage.objects.count(), 1)
+        self.assertEqual(InventoryItem.objects.get(variant__sku='IPH-128').quantity, 50)
+
+    def test_reimported_stock_goes_through_versioned_writes(self):
+        self.run_command(self.CSV)
+        item = InventoryItem.objects.get(variant__sku='IPH-128')
+        stale = InventoryItem.objects.get(pk=item.pk)
+        self.run_command(self.CSV.replace('main,5', 'main,50'))
+        item.refresh_from_db()
+        self.assertEqual((item.quantity, item.version), (50, stale.version + 1))
+        self.assertGreater(item.updated_at, stale.updated_at)
+        # A CAS writer that read the row before the import loses its race.
+        self.assertFalse(compare_and_swap(stale, quantity=1))
+
+    def test_reimport_updates_categories_and_brands(self):
+        self.run_command(self.CSV)
+        self.run_command(
+            "category_slug,category_name,category_parent_slug,brand_slug,brand_name,product_slug,product_price,sku\n"
+            "devices,Devices,,apple,Apple Inc.,iphone,999,IPH-128\n"
+            "phones,Mobile phones,devices,sony,Apple,xperia,899,XP-1\n"
+        )
+        devices = Category.objects.get(slug='devices')
+        phones = Category.objects.get(slug='phones')
+        self.assertEqual((phones.name, phones.parent), ('Mobile phones', devices))
+        self.assertEqual((phones.path, phones.depth), (f"{devices.pk}/{phones.pk}/", 1))
+        self.assertEqual(Brand.objects.get(slug='apple').name, 'Apple Inc.')
+        # 'Apple' was still Apple's name when the chunk was read.
+        self.assertEqual(Brand.objects.get(slug='sony').name, 'Sony')
+
+    def test_unreadable_lines_are_reported_per_row(self):
+        header = "category_slug,brand_slug,product_slug,product_price,sku\n"
+        oversized = 'x' * (csv.field_size_limit() + 1)
+        content = header + f"tv,lg,oled,1999,OLED-1\ntv,lg,{oversized},999,QLED-1\ntv,lg,nano,899,NANO-1\n"
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='admin', is_staff=True))
+        response = client.post(
+            '/api/products/import/', {'file': SimpleUploadedFile('catalog.csv', content.encode())}, format='multipart',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([error['line'] for error in response.json()['errors']], [3])
+        self.assertEqual(set(ProductVariant.objects.values_list('sku', flat=True)), {'OLED-1', 'NANO-1'})
+
+        content = (header + "tv,lg,oled,1999,OLED-2\n").encode() + b"tv,lg,\xff\xfe,1,BAD-1\n"
+        response = client.post(
+            '/api/products/import/', {'file': SimpleUploadedFile('catalog.csv', content)}, format='multipart',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('not valid UTF-8', response.json()['errors'][0]['error'])
+        self.assertFalse(ProductVariant.objects.filter(sku='BAD-1').exists())
+
+    def test_admin_api_accepts_jsonl(self):
+        lines = [
+            json.dumps({'category_slug': 'tv', 'brand_slug': 'lg', 'product_slug': 'oled', 'sku': 'OLED-65',
+                        'product_price': '1999.00', 'attributes': {'size': '65"'}}),
+            'not json',
+        ]
+        upload = SimpleUploadedFile('catalog.jsonl', '\n'.join(lines).encode())
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='admin', is_staff=True))
+        response = client.post('/api/products/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['rows'], body['imported'], body['failed']), (2, 1, 1))
+        self.assertEqual(body['errors'][0]['line'], 2)
+        self.assertIn('rows_per_sec', body)
+        self.assertEqual(ProductVariant.objects.get(sku='OLED-65').attributes, {'size': '65"'})
+
+    def test_admin_api_requires_staff(self):
+        response = APIClient().post('/api/products/import/', {}, format='multipart')
+        self.assertIn(response.status_code, (401, 403))
+
+
+class PromotionPricingTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.product = make_products(1)[0]
+        self.variant = ProductVariant.objects.create(product=self.product, sku='P-1', base_price=Decimal('100.00'))
+
+    def rule(self, rule_type, **kwargs):
+        kwargs.setdefault('product', self.product)
+        return PromotionRule.objects.create(rule_type=rule_type, **kwargs)
+
+    def price(self, quantity, unit_price='100.00', now=None):
+        line = PricedLine(self.variant.id, self.product.id, quantity, Decimal(unit_price))
+        return price_lines([line], now=now)[0]
+
+    def test_rule_changes_from_another_process_rebuild_the_index(self):
+        self.assertEqual(self.price(1).discount, Decimal('0.00'))
+        # Written without signals, then announced through a separate handle
+        # on the state alias, as a worker elsewhere would.
+        PromotionRule.objects.bulk_create([PromotionRule(
+            rule_type=PromotionRule.RuleType.PERCENT_DISCOUNT, product=self.product, discount_percent=Decimal('10'),
+        )])
+        caches.create_connection('state').incr(PROMOTIONS_VERSION_KEY)
+        self.assertEqual(self.price(1).discount, Decimal('10.00'))
+
+    def test_percent_and_fixed_discounts_take_the_best_rule(self):
+        self.rule(PromotionRule.RuleType.PERCENT_DISCOUNT, discount_percent=Decimal('10'))
+        self.rule(PromotionRule.RuleType.FIXED_DISCOUNT, variant=self.variant, product=None, discount_amount=Decimal('15'))
+        line = self.price(2)
+        self.assertEqual(line.discount, Decimal('30.00'))
+        self.assertEqual(line.discounted_unit_price, Decimal('85.00'))
+
+    def test_bulk_tiers_and_bundles(self):
+        self.rule(PromotionRule.RuleType.BULK_TIER, min_qty=5, max_qty=9, discount_percent=Decimal('5'))
+        self.rule(PromotionRule.RuleType.BULK_TIER, min_qty=10, discount_percent=Decimal('12'))
+        self.assertEqual(self.price(4).discount, Decimal('0.00'))
+        self.assertEqual(self.price(5).discount, Decimal('25.00'))
+        self.assertEqual(self.price(10).discount, Decimal('120.00'))
+
+        PromotionRule.objects.all().delete()
+        self.rule(PromotionRule.RuleType.BUNDLE, min_qty=3, discount_amount=Decimal('50'))
+        self.assertEqual(self.price(7).discount, Decimal('100.00'))
+
+    def test_gift_is_reported_without_price_change(self):
+        gift = self.rule(PromotionRule.RuleType.GIFT, min_qty=2)
+        line = self.price(2)
+        self.assertEqual(line.discount, Decimal('0.00'))
+        self.assertEqual(line.gifts, [gift.id])
+
+    def test_time_window_and_inactive_rules(self):
+        now = timezone.now()
+        self.rule(
+            PromotionRule.RuleType.PERCENT_DISCOUNT, discount_percent=Decimal('20'),
+            start_at=now + timedelta(days=1), end_at=now + timedelta(days=2),
+        )
+        self.rule(PromotionRule.RuleType.PERCENT_DISCOUNT, discount_percent=Decimal('50'), is_active=False)
+        self.assertEqual(self.price(1, now=now).discount, Decimal('0.00'))
+        self.assertEqual(self.price(1, now=now + timedelta(days=1, hours=1)).discount, Decimal('20.00'))
+        self.assertEqual(self.price(1, now=now + timedelta(days=3)).discount, Decimal('0.00'))
+
+    def test_index_is_compiled_once_and_rebuilt_on_rule_change(self):
+        rule = self.rule(PromotionRule.RuleType.PERCENT_DISCOUNT, discount_percent=Decimal('10'))
+        self.price(1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.price(1).discount, Decimal('10.00'))
+        rule.discount_percent = Decimal('25')
+        rule.save()
+        self.assertEqual(self.price(1).discount, Decimal('25.00'))
+
+    def test_listing_shows_promo_price_and_cache_follows_rule_changes(self):
+        client = APIClient()
+        self.assertIsNone(client.get('/api/products/').json()[0]['promo_price'])
+        rule = self.rule(PromotionRule.RuleType.PERCENT_DISCOUNT, discount_percent=Decimal('10'))
+        self.assertEqual(client.get('/api/products/').json()[0]['promo_price'], '90.00')
+        rule.delete()
+        self.assertIsNone(client.get('/api/products/').json()[0]['promo_price'])
+
+    def test_window_opening_changes_the_cached_listing(self):
+        client = APIClient()
+        start = timezone.now() + timedelta(seconds=2)
+        self.rule(PromotionRule.RuleType.PERCENT_DISCOUNT, discount_percent=Decimal('10'), start_at=start)
+        first = client.get('/api/products/')
+        self.assertIsNone(first.json()[0]['promo_price'])
+        with mock.patch('products.pricing.timezone.now', return_value=start + timedelta(seconds=1)):
+            second = client.get('/api/products/')
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        self.assertEqual(second.json()[0]['promo_price'], '90.00')
+
+
+class VariantAttributeFilterTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.client = APIClient()
+        self.phone, self.tablet, self.laptop = make_products(3)
+        self.variant(self.phone, 'PH-1', color='Natural Titanium', storage='256GB', attributes={'sim': 'esim'})
+        self.variant(self.phone, 'PH-2', color='Black', storage='128GB', attributes={'sim': ['esim', 'nano']})
+        self.variant(self.tablet, 'TB-1', color='Natural Titanium', storage='128GB')
+        self.variant(self.tablet, 'TB-2', color='Black', storage='256GB')
+        self.variant(self.laptop, 'LP-1', color='Natural Titanium', storage='256GB', ram='16GB', is_active=False)
+
+    def variant(self, product, sku, **fields):
+        return ProductVariant.objects.create(product=product, sku=sku, base_price=product.base_price, **fields)
+
+    def slugs(self, query):
+        response = self.client.get(f'/api/products/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return sorted(item['slug'] for item in response.json())
+
+    def test_attributes_must_match_on_the_same_variant(self):
+        # The tablet has both values, but on different variants.
+        self.assertEqual(self.slugs('storage=256GB&color=natural%20titanium'), ['p-0'])
+        self.assertEqual(self.slugs('storage=256gb'), ['p-0', 'p-1'])
+
+    def test_comma_separated_values_and_json_attributes(self):
+        self.assertEqual(self.slugs('storage=128GB,256GB&attr.sim=nano'), ['p-0'])
+        self.assertEqual(self.slugs('attr.sim=esim&color=Black'), ['p-0'])
+        self.assertEqual(self.slugs('attr.sim=physical'), [])
+
+    def test_inactive_variants_are_not_indexed_and_index_follows_saves(self):
+        self.assertEqual(self.slugs('ram=16GB'), [])
+        variant = ProductVariant.objects.get(sku='LP-1')
+        variant.is_active = True
+        variant.save()
+        self.assertEqual(self.slugs('ram=16GB'), ['p-2'])
+        variant.ram = '32GB'
+        variant.save()
+        self.assertEqual(self.slugs('ram=16GB'), [])
+
+    def test_variants_action_filters_variants(self):
+        response = self.client.get(f'/api/products/{self.phone.slug}/variants/?storage=256GB')
+        self.assertEqual([item['sku'] for item in response.json()], ['PH-1'])
+
+    def test_lookup_uses_attribute_index(self):
+        plan = matching_attributes({'color': ['black'], 'storage': ['256gb']}).values('product_id').explain()
+        self.assertIn('products_va_name', plan)
+
+
+class ProductDetailTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.client = APIClient()
+        self.phone, self.case = make_products(2)
+        self.variant = ProductVariant.objects.create(product=self.phone, sku='PH-1', base_price=Decimal('100.00'))
+        ProductVariant.objects.create(product=self.phone, sku='PH-OLD', base_price=Decimal('90.00'), is_active=False)
+        ProductRelation.objects.create(product=self.phone, related_product=self.case, relation_type='accessory')
+        self.branch = Branch.objects.create(name='Main', code='main')
+        self.stock = InventoryItem.objects.create(branch=self.branch, variant=self.variant, quantity=7, reserved_quantity=2)
+        self.url = f'/api/products/{self.phone.slug}/'
+
+    def test_detail_prefetches_images_and_active_variants(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        # product with category and brand, images, active variants
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertEqual([variant['sku'] for variant in response.json()['variants']], ['PH-1'])
+        self.assertEqual(len(response.json()['images']), 2)
+
+    def test_expansions_are_embedded_and_cached_per_slug(self):
+        PromotionRule.objects.create(
+            variant=self.variant, rule_type=PromotionRule.RuleType.PERCENT_DISCOUNT, discount_percent=Decimal('10'),
+        )
+        url = f'{self.url}?expand=related,promo_price'
+        data = self.client.get(url).json()
+        self.assertEqual([item['slug'] for item in data['related']], [self.case.slug])
+        self.assertIsNone(data['promo_price'])
+        self.assertEqual(data['variants'][0]['promo_price'], '90.00')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(f'{self.url}?expand=promo_price&expand=related').json(), data)
+
+    def test_cached_document_is_invalidated_by_any_piece(self):
+        self.client.get(self.url)
+        ProductImage.objects.create(product=self.phone, image_url='https://img.test/new.jpg', sort_order=5)
+        self.assertEqual(len(self.client.get(self.url).json()['images']), 3)
+        self.variant.base_price = Decimal('120.00')
+        self.variant.save()
+        self.assertEqual(self.client.get(self.url).json()['variants'][0]['base_price'], '120.00')
+
+    def test_availability_is_always_fresh(self):
+        url = f'{self.url}?expand=availability'
+        response = self.client.get(url)
+        self.assertNotIn('ETag', response)
+        self.assertEqual(response.json()['availability'], {'total': 5, 'variants': {str(self.variant.id): 5}})
+        InventoryItem.objects.filter(pk=self.stock.pk).update(quantity=1)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['availability']['total'], 0)
+
+    def test_unknown_expansion_is_rejected(self):
+        self.assertEqual(self.client.get(f'{self.url}?expand=reviews').status_code, 400)
+
+
+class FavoriteFlagTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.products = make_products(4)
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        self.client = APIClient()
+
+    def flags(self, user, url='/api/products/'):
+        self.client.force_authenticate(user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        items = data['results'] if isinstance(data, dict) else data
+        return {item['slug']: (item.get('is_favorited'), item['favorite_count']) for item in items}
+
+    def bulk(self, user, ids, action='toggle'):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/products/favorites/bulk/', {'product_ids': ids, 'action': action}, format='json')
+
+    def test_flags_are_per_user_over_a_shared_cache(self):
+        first, second = self.products[:2]
+        self.bulk(self.alice, [first.id])
+        self.bulk(self.bob, [first.id, second.id])
+
+        self.assertEqual(self.flags(self.alice)[first.slug], (True, 2))
+        bob = self.flags(self.bob)
+        self.assertEqual(bob[first.slug], (True, 2))
+        self.assertEqual(bob[second.slug], (True, 1))
+        self.assertEqual(self.flags(self.alice)[second.slug], (False, 1))
+        self.assertEqual(self.flags(None)[second.slug], (None, 1))
+
+    def test_overlay_is_one_query_per_page(self):
+        self.bulk(self.alice, [product.id for product in self.products])
+        self.flags(self.alice, '/api/products/?page_size=2')
+        with CaptureQueriesContext(connection) as ctx:
+            flags = self.flags(self.alice, '/api/products/?page_size=2')
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertTrue(all(favorited for favorited, _ in flags.values()))
+
+    def test_bulk_toggle_add_and_remove(self):
+        ids = [product.id for product in self.products]
+        response = self.bulk(self.alice, ids[:2])
+        self.assertEqual(response.json(), {'favorited': ids[:2], 'unfavorited': []})
+
+        response = self.bulk(self.alice, ids[1:3] + [999999])
+        self.assertEqual(response.json(), {'favorited': [ids[2]], 'unfavorited': [ids[1]]})
+        self.assertEqual(
+            sorted(Favorite.objects.filter(user=self.alice).values_list('product_id', flat=True)), [ids[0], ids[2]],
+        )
+        self.assertEqual(self.bulk(self.alice, ids, 'remove').json()['unfavorited'], [ids[0], ids[2]])
+        self.assertEqual(self.bulk(self.alice, [ids[3]], 'add').json()['favorited'], [ids[3]])
+        self.assertEqual(
+            list(Product.objects.order_by('id').values_list('favorite_count', flat=True)), [0, 0, 0, 1],
+        )
+        self.assertEqual(self.bulk(self.alice, []).status_code, 400)
+
+    def test_single_favorite_endpoints_keep_counts(self):
+        self.client.force_authenticate(self.alice)
+        product = self.products[0]
+        favorite = self.client.post('/api/products/favorites/', {'product_id': product.id}, format='json').json()
+        product.refresh_from_db()
+        self.assertEqual(product.favorite_count, 1)
+        self.client.delete(f"/api/products/favorites/{favorite['id']}/")
+        product.refresh_from_db()
+        self.assertEqual(product.favorite_count, 0)
+
+    def test_favorites_list_pages_by_created_at(self):
+        self.bulk(self.alice, [product.id for product in self.products])
+        self.client.force_authenticate(self.alice)
+        page = self.client.get('/api/products/favorites/?page_size=3').json()
+        self.assertEqual(len(page['results']), 3)
+        rest = self.client.get(page['next']).json()
+        self.assertEqual(len(rest['results']), 1)
+        seen = {item['product']['id'] for item in page['results'] + rest['results']}
+        self.assertEqual(seen, {product.id for product in self.products})
+
+
+class FastListContractTests(TestCase):
+    def setUp(self):
+        reset_cache()
+        self.products = make_products(3)
+        self.products[0].name = 'Écouteurs “Pro”\u2028line'
+        self.products[0].save()
+        self.products[1].images.all().delete()
+        child = Category.objects.create(name='Cases', slug='cases', parent=self.products[2].category)
+        self.products[2].category = child
+        self.products[2].save()
+        PromotionRule.objects.create(
+            product=self.products[2], rule_type=PromotionRule.RuleType.FIXED_DISCOUNT, discount_amount=Decimal('2.50'),
+        )
+
+    def queryset(self):
+        return Product.objects.filter(is_active=True).select_related('category', 'brand').with_primary_image()
+
+    def test_fast_path_is_byte_identical_to_the_serializer(self):
+        qs = self.queryset().order_by('id')
+        expected = JSONRenderer().render(ProductListSerializer(qs, many=True).data)
+        self.assertEqual(FastJSONRenderer().render(render_products(product_rows(qs))), expected)
+        self.assertEqual(JSONRenderer().render(render_products(product_rows(qs))), expected)
+        self.assertIn(b'\\u2028', expected)
 
-# Create your tests here.
+    def test_list_endpoint_serves_serializer_output(self):
+        qs = self.queryset().order_by('-created_at', '-id')
+        expected = JSONRenderer().render(ProductListSerializer(qs, many=True).data)
+        self.assertEqual(APIClient().get('/api/products/').content, expected)
+        page = APIClient().get('/api/products/?page_size=2&ordering=base_price').json()
+        self.assertEqual(
+            page['results'],
+            json.loads(JSONRenderer().render(ProductListSerializer(qs.order_by('base_price', 'id')[:2], many=True).data)),
+        )
@@ -1,13 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, BrandViewSet, ProductViewSet, FavoriteViewSet
+from .views import CategoryViewSet, BrandViewSet, ProductViewSet, FavoriteViewSet, CatalogImportView
 
 router = DefaultRouter()
 router.register('categories', CategoryViewSet, basename='category')
 router.register('brands', BrandViewSet, basename='brand')
-router.register('', ProductViewSet, basename='product')
 router.register('favorites', FavoriteViewSet, basename='favorite')
+router.register('', ProductViewSet, basename='product')
 
 urlpatterns = [
+    path('import/', CatalogImportView.as_view(), name='catalog-import'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
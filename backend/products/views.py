@@ -4,11 +4,15 @@ from django.shortcuts import render
 from decimal import Decimal
 
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets, permissions, filters
+from rest_framework import viewsets, permissions, views, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 
+from inventory.availability import available_stock
 from inventory.models import Branch, InventoryItem
+from inventory.stock import bump
 
 from .models import (
     Category,
@@ -17,6 +21,7 @@ from .models import (
     ProductVariant,
     Favorite,
     ProductImage,
+    primary_image_prefetch,
 )
 from .serializers import (
     CategorySerializer,
@@ -25,7 +30,19 @@ from .serializers import (
     ProductDetailSerializer,
     ProductVariantSerializer,
     FavoriteSerializer,
+    FavoriteBulkSerializer,
 )
+from .attributes import attribute_criteria, filter_variants, is_attribute_param
+from .cache import CatalogCacheMixin, cached_catalog_response, get_catalog_version
+from .facets import compute_facets
+from .favorites import bulk_set_favorites, overlay_favorites, refresh_favorite_counts
+from .listing import product_rows, render_products
+from .importer import CatalogImportError, detect_format, import_catalog, text_stream
+from .filters import ProductFilter
+from .pagination import KeysetCursorPagination
+from .pricing import PricedLine, get_promotion_index, price_lines, price_products
+from .related import related_products
+from .search import ProductSearchFilter, RelevanceOrderingFilter
 
 
 class IsAdminOrReadOnly(permissions.BasePermission):
@@ -35,63 +52,219 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         return bool(request.user and request.user.is_staff)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
     lookup_field = 'slug'
 
-
-class BrandViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'], url_path='tree', permission_classes=[permissions.AllowAny])
+    @cached_catalog_response
+    def category_tree(self, request):
+        """
+        The whole category hierarchy, nested, from a single query.
+        """
+        nodes, roots = {}, []
+        categories = Category.objects.order_by('path').values('id', 'name', 'slug', 'parent_id', 'depth')
+        # Ordering by path guarantees parents are seen before their children.
+        for row in categories:
+            node = {'id': row['id'], 'name': row['name'], 'slug': row['slug'], 'depth': row['depth'], 'children': []}
+            nodes[row['id']] = node
+            parent = nodes.get(row['parent_id'])
+            (parent['children'] if parent else roots).append(node)
+        return Response(roots)
+
+
+class BrandViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
     permission_classes = [IsAdminOrReadOnly]
     lookup_field = 'slug'
 
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.filter(is_active=True).select_related('category', 'brand')
+class ProductViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
+    queryset = (
+        Product.objects.filter(is_active=True)
+        .select_related('category', 'brand')
+        .with_primary_image()
+    )
     permission_classes = [IsAdminOrReadOnly]
     lookup_field = 'slug'
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = {
-        'category__slug': ['exact'],
-        'brand__slug': ['exact'],
-        'product_type': ['exact'],
-        'base_price': ['gte', 'lte'],
-    }
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, RelevanceOrderingFilter]
+    filterset_class = ProductFilter
     search_fields = ['name', 'description', 'brand__name', 'category__name']
     ordering_fields = ['base_price', 'created_at']
     ordering = ['-created_at']
+    pagination_class = KeysetCursorPagination
+    # ``variants`` are always embedded in the detail document; the name is
+    # accepted so clients can ask for it explicitly.
+    detail_expansions = ('variants', 'related', 'availability', 'promo_price')
+
+    def get_queryset(self):
+        if self.action == 'retrieve':
+            return Product.objects.filter(is_active=True).with_detail()
+        return super().get_queryset()
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return ProductDetailSerializer
         return ProductListSerializer
 
+    def get_expand(self, request):
+        expand = {
+            part.strip()
+            for value in request.query_params.getlist('expand')
+            for part in value.split(',')
+            if part.strip()
+        }
+        unknown = expand.difference(self.detail_expansions)
+        if unknown:
+            raise ParseError(f"Unknown expand value(s): {', '.join(sorted(unknown))}.")
+        return expand
+
+    def get_cache_version(self):
+        # Promo prices change when a rule's window opens or closes, which
+        # is not a write, so the boundary count is part of the version.
+        return f"{get_catalog_version()}.{get_promotion_index().epoch()}"
+
+    def get_cache_timeout(self):
+        timeout = super().get_cache_timeout()
+        until_change = get_promotion_index().seconds_until_change()
+        return timeout if until_change is None else min(timeout, until_change)
+
+    def is_personalized(self, request):
+        return request.user.is_authenticated and self.action in ('list', 'related')
+
+    def personalize(self, request, data):
+        overlay_favorites(data['results'] if isinstance(data, dict) else data, request.user)
+        return data
+
+    def get_cache_params(self, request):
+        params = super().get_cache_params(request)
+        if self.action == 'retrieve':
+            # One document per slug and set of cached expansions;
+            # availability is laid over it fresh (see retrieve()).
+            cached = sorted(self.get_expand(request) - {'variants', 'availability'})
+            return [('expand', ','.join(cached))] if cached else []
+        if self.action != 'facets':
+            return params
+        # Facets only depend on the filters, so ordering/paging params and
+        # empty values must not fragment the cache.
+        filter_params = {*self.filterset_class.base_filters, ProductSearchFilter.search_param}
+        return [
+            (key, value.strip())
+            for key, value in params
+            if (key in filter_params or is_attribute_param(key)) and value.strip()
+        ]
+
+    @cached_catalog_response
+    def list(self, request, *args, **kwargs):
+        """
+        Rendered from values() rows (see ``products.listing``); the output
+        matches ProductListSerializer.
+        """
+        queryset = product_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(render_products(page))
+        return Response(render_products(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Product page document. ``?expand=`` adds ``related`` products,
+        ``promo_price`` (product and per variant) and ``availability``.
+        """
+        if 'availability' not in self.get_expand(request):
+            return self.cached_response(request, self.detail_document, *args, **kwargs)
+        # Stock changes with every sale, so it is not cached with the
+        # document: one grouped query per request, and no ETag.
+        response = self.cached_response(request, self.detail_document, *args, conditional=False, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            stock = available_stock(variant['id'] for variant in response.data['variants'])
+            response.data = {
+                **response.data,
+                'availability': {
+                    'total': sum(stock.values()),
+                    'variants': {str(variant_id): available for variant_id, available in sorted(stock.items())},
+                },
+            }
+            del response['ETag']
+        return response
+
+    def detail_document(self, request, *args, **kwargs):
+        product = self.get_object()
+        data = self.get_serializer(product).data
+        expand = self.get_expand(request)
+        if 'related' in expand:
+            related_qs = related_products(
+                product,
+                queryset=Product.objects.select_related('category', 'brand').with_primary_image(),
+            )
+            data['related'] = ProductListSerializer(related_qs, many=True).data
+        if 'promo_price' in expand:
+            line = price_products([product])[product.id]
+            data['promo_price'] = str(line.discounted_unit_price) if line.discount else None
+            priced = price_lines([
+                PricedLine(variant.id, product.id, 1, variant.base_price) for variant in product.active_variants
+            ])
+            for variant, line in zip(data['variants'], priced):
+                variant['promo_price'] = str(line.discounted_unit_price) if line.discount else None
+        return Response(data)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    @cached_catalog_response
+    def facets(self, request):
+        """
+        Brand, category, product type and price bucket counts for the current filters.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(compute_facets(queryset))
+
     @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
-    def variants(self, request, pk=None):
+    @cached_catalog_response
+    def variants(self, request, slug=None):
         product = self.get_object()
-        qs = product.variants.filter(is_active=True)
+        qs = filter_variants(product.variants.filter(is_active=True), attribute_criteria(request.query_params))
         serializer = ProductVariantSerializer(qs, many=True)
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
-    def related(self, request, pk=None):
+    @cached_catalog_response
+    def related(self, request, slug=None):
         """
-        Get related products based on same category (simple recommendation).
+        Get related products from the precomputed neighbor lists.
         """
         product = self.get_object()
-        # Simple logic: same category, exclude self
-        related_qs = Product.objects.filter(
-            category=product.category,
-            is_active=True
-        ).exclude(id=product.id).order_by('?')[:5] # Random 5 from same category
-        
+        related_qs = related_products(
+            product,
+            queryset=Product.objects.select_related('category', 'brand').with_primary_image(),
+        )
         serializer = ProductListSerializer(related_qs, many=True)
         return Response(serializer.data)
 
 
+class CatalogImportView(views.APIView):
+    """Bulk-import a CSV/JSONL catalog upload (multipart field ``file``).
+
+    The file is streamed in chunks (see ``products.importer``); the
+    response reports rows/sec and per-row errors.
+    """
+
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"detail": "Missing file."}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('format') or detect_format(upload.name)
+        try:
+            report = import_catalog(text_stream(upload.file), fmt)
+        except CatalogImportError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict())
+
+
 def create_demo_catalog():
     """Seed demo categories, brands, products, variants, images, and inventory.
 
@@ -246,20 +419,35 @@ def create_demo_catalog():
             },
         )
         if not created and inv.quantity < 10:
-            inv.quantity = 10
-            inv.save(update_fields=["quantity"])
+            InventoryItem.objects.filter(pk=inv.pk, quantity__lt=10).update(**bump(quantity=10))
 
 
 class FavoriteViewSet(viewsets.ModelViewSet):
     serializer_class = FavoriteSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetCursorPagination
+    ordering_fields = ['created_at']
+    ordering = ['-created_at']
 
     def get_queryset(self):
         return Favorite.objects.filter(user=self.request.user).select_related(
             'product', 'product__brand', 'product__category'
-        )
+        ).prefetch_related(primary_image_prefetch('product__images'))
 
     def perform_destroy(self, instance):
         if instance.user != self.request.user:
             raise permissions.PermissionDenied("Cannot delete another user's favorite.")
-        instance.delete()
\ No newline at end of file
+        instance.delete()
+        refresh_favorite_counts([instance.product_id])
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Add, remove or toggle (default) many favorites in one transaction.
+        """
+        serializer = FavoriteBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        added, removed = bulk_set_favorites(
+            request.user, serializer.validated_data['product_ids'], serializer.validated_data['action'],
+        )
+        return Response({'favorited': added, 'unfavorited': removed})
\ No newline at end of file
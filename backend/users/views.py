@@ -11,6 +11,7 @@ from rest_framework.views import APIView
 from rest_framework.generics import RetrieveUpdateAPIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from cart.guest import get_session_id, merge_into_user_cart
 from .models import EmailOTP, PhoneOTP, UserProfile
 from .serializers import (
     RequestOTPSerializer,
@@ -37,6 +38,13 @@ def send_otp_via_sms(phone_number: str, code: str):
     print(f"[DEV] SMS OTP for {phone_number}: {code}")
 
 
+def merge_guest_cart(request, user):
+    """Fold the cart the visitor built before logging in into their account."""
+    session_id = get_session_id(request)
+    if session_id:
+        merge_into_user_cart(session_id, user)
+
+
 class RequestOTPView(APIView):
     permission_classes = [permissions.AllowAny]
 
@@ -120,6 +128,7 @@ class VerifyOTPView(APIView):
                 address_line1=serializer.validated_data.get('address_line1', ''),
             )
 
+        merge_guest_cart(request, user)
         refresh = RefreshToken.for_user(user)
         data = {
             "access": str(refresh.access_token),
@@ -165,6 +174,7 @@ class VerifyPhoneOTPView(APIView):
                 profile.phone = phone_number
                 profile.save(update_fields=['phone'])
 
+        merge_guest_cart(request, user)
         refresh = RefreshToken.for_user(user)
         data = {
             "access": str(refresh.access_token),